@@ -29,9 +29,15 @@ target_metadata = Base.metadata
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+# Created by raw SQL in migration 0007 (PostgreSQL only), not by the models
+UNMANAGED_OBJECTS = {"search_vector", "idx_transcriptions_search", "idx_audio_files_search"}
+
 def get_url():
     return DATABASE_URL
 
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and name in UNMANAGED_OBJECTS)
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -50,6 +56,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -73,7 +80,8 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
@@ -0,0 +1,90 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+Databases created by ``create_tables()`` before migrations were introduced
+already have these tables: mark them with ``alembic stamp 0001``.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'audio_files',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('original_url', sa.Text(), nullable=False),
+        sa.Column('title', sa.String(length=500), nullable=True),
+        sa.Column('episode_number', sa.Integer(), nullable=True),
+        sa.Column('series_name', sa.String(length=255), nullable=True),
+        sa.Column('duration_seconds', sa.Integer(), nullable=True),
+        sa.Column('file_size_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('file_path', sa.String(length=500), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_audio_files_id', 'audio_files', ['id'], unique=False)
+
+    op.create_table(
+        'transcriptions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('audio_file_id', sa.Integer(), nullable=True),
+        sa.Column('language', sa.String(length=10), nullable=False),
+        sa.Column('content_type', sa.String(length=20), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('confidence_score', sa.DECIMAL(precision=3, scale=2), nullable=True),
+        sa.Column('start_time_seconds', sa.DECIMAL(precision=10, scale=3), nullable=True),
+        sa.Column('end_time_seconds', sa.DECIMAL(precision=10, scale=3), nullable=True),
+        sa.Column('segment_order', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['audio_file_id'], ['audio_files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_transcriptions_id', 'transcriptions', ['id'], unique=False)
+
+    op.create_table(
+        'download_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('url', sa.Text(), nullable=False),
+        sa.Column('source_host', sa.String(length=255), nullable=True),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('progress', sa.Float(), nullable=True),
+        sa.Column('downloaded_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('total_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('audio_file_id', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['audio_file_id'], ['audio_files.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_download_jobs_id', 'download_jobs', ['id'], unique=False)
+    op.create_index('ix_download_jobs_source_host', 'download_jobs', ['source_host'], unique=False)
+    op.create_index('ix_download_jobs_status', 'download_jobs', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_download_jobs_status', table_name='download_jobs')
+    op.drop_index('ix_download_jobs_source_host', table_name='download_jobs')
+    op.drop_index('ix_download_jobs_id', table_name='download_jobs')
+    op.drop_table('download_jobs')
+    op.drop_index('ix_transcriptions_id', table_name='transcriptions')
+    op.drop_table('transcriptions')
+    op.drop_index('ix_audio_files_id', table_name='audio_files')
+    op.drop_table('audio_files')
@@ -0,0 +1,34 @@
+"""audio_files listing indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('idx_audio_files_episode', 'audio_files', ['episode_number'], unique=False)
+    op.create_index('idx_audio_files_series', 'audio_files', ['series_name'], unique=False)
+    op.create_index('idx_audio_files_created_at_id', 'audio_files', ['created_at', 'id'], unique=False)
+    op.create_index('idx_audio_files_updated_at_id', 'audio_files', ['updated_at', 'id'], unique=False)
+    op.create_index('idx_audio_files_status_created_at_id', 'audio_files', ['status', 'created_at', 'id'], unique=False)
+    op.create_index('idx_audio_files_series_created_at_id', 'audio_files', ['series_name', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_audio_files_series_created_at_id', table_name='audio_files')
+    op.drop_index('idx_audio_files_status_created_at_id', table_name='audio_files')
+    op.drop_index('idx_audio_files_updated_at_id', table_name='audio_files')
+    op.drop_index('idx_audio_files_created_at_id', table_name='audio_files')
+    op.drop_index('idx_audio_files_series', table_name='audio_files')
+    op.drop_index('idx_audio_files_episode', table_name='audio_files')
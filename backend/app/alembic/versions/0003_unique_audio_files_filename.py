@@ -0,0 +1,33 @@
+"""unique audio_files.filename
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Videos with the same title used to share a filename: keep the oldest row's
+    # name and prefix the others with their id so the unique index can be built
+    op.execute(
+        """
+        UPDATE audio_files
+        SET filename = id || '_' || filename
+        WHERE id NOT IN (SELECT MIN(id) FROM audio_files GROUP BY filename)
+        """
+    )
+    op.create_index('idx_audio_files_filename', 'audio_files', ['filename'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_audio_files_filename', table_name='audio_files')
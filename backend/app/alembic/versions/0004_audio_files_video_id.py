@@ -0,0 +1,29 @@
+"""audio_files video_id for batch ingestion deduplication
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 11:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows keep a NULL video_id and are matched by original_url instead
+    op.add_column('audio_files', sa.Column('video_id', sa.String(length=64), nullable=True))
+    op.create_index('idx_audio_files_video_id', 'audio_files', ['video_id'], unique=False)
+    op.create_index('idx_audio_files_original_url', 'audio_files', ['original_url'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_audio_files_original_url', table_name='audio_files')
+    op.drop_index('idx_audio_files_video_id', table_name='audio_files')
+    op.drop_column('audio_files', 'video_id')
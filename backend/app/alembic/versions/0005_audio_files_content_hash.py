@@ -0,0 +1,27 @@
+"""audio_files content hash for content-addressed storage
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Files stored before this revision keep their path and a NULL hash
+    op.add_column('audio_files', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index('idx_audio_files_file_path', 'audio_files', ['file_path'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_audio_files_file_path', table_name='audio_files')
+    op.drop_column('audio_files', 'content_hash')
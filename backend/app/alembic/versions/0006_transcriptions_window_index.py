@@ -0,0 +1,29 @@
+"""transcriptions (audio_file_id, language, start_time_seconds) index
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 13:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_transcriptions_file_language_start',
+        'transcriptions',
+        ['audio_file_id', 'language', 'start_time_seconds'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_transcriptions_file_language_start', table_name='transcriptions')
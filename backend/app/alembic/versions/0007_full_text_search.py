@@ -0,0 +1,73 @@
+"""full-text search over transcripts and titles (PostgreSQL)
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 14:10:00.000000
+
+Adds generated ``search_vector`` tsvector columns with GIN indexes to
+``transcriptions`` and ``audio_files``. English and French segments use their
+stemming configurations; Japanese (and other languages written without
+spaces) are indexed as overlapping character bigrams, so any substring of two
+or more characters can be matched as a phrase. Other databases are left
+unchanged and searched with LIKE.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("""
+        CREATE OR REPLACE FUNCTION castlang_ts_config(language text) RETURNS regconfig
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT CASE language
+                WHEN 'en' THEN 'english'::regconfig
+                WHEN 'fr' THEN 'french'::regconfig
+                ELSE 'simple'::regconfig
+            END
+        $$
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION castlang_ngrams(content text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT coalesce(string_agg(substr(s.t, i, 2), ' ' ORDER BY i), '')
+            FROM (SELECT regexp_replace(lower(coalesce(content, '')), '[[:space:][:punct:]]+', '', 'g') AS t) s,
+                 generate_series(1, greatest(length(s.t) - 1, 1)) AS i
+        $$
+    """)
+    op.execute("""
+        ALTER TABLE transcriptions ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            CASE WHEN language IN ('ja', 'zh', 'ko')
+                THEN to_tsvector('simple'::regconfig, castlang_ngrams(content))
+                ELSE to_tsvector(castlang_ts_config(language), content)
+            END
+        ) STORED
+    """)
+    op.execute("CREATE INDEX idx_transcriptions_search ON transcriptions USING gin (search_vector)")
+    op.execute("""
+        ALTER TABLE audio_files ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            to_tsvector('simple'::regconfig, coalesce(title, ''))
+            || to_tsvector('simple'::regconfig, castlang_ngrams(title))
+        ) STORED
+    """)
+    op.execute("CREATE INDEX idx_audio_files_search ON audio_files USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS idx_audio_files_search")
+    op.execute("ALTER TABLE audio_files DROP COLUMN IF EXISTS search_vector")
+    op.execute("DROP INDEX IF EXISTS idx_transcriptions_search")
+    op.execute("ALTER TABLE transcriptions DROP COLUMN IF EXISTS search_vector")
+    op.execute("DROP FUNCTION IF EXISTS castlang_ngrams(text)")
+    op.execute("DROP FUNCTION IF EXISTS castlang_ts_config(text)")
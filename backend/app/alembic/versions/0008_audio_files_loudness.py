@@ -0,0 +1,25 @@
+"""audio_files integrated loudness
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Filled in by the waveform analysis; POST /audio-files/{id}/waveform backfills older files
+    op.add_column('audio_files', sa.Column('loudness_lufs', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('audio_files', 'loudness_lufs')
@@ -0,0 +1,41 @@
+"""extraction cache keyed by video id and audio settings
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'extraction_cache',
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('extractor', sa.String(length=64), nullable=False),
+        sa.Column('video_id', sa.String(length=64), nullable=False),
+        sa.Column('info', sa.Text(), nullable=False),
+        sa.Column('file_path', sa.String(length=500), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('hit_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('cache_key'),
+    )
+    op.create_index('idx_extraction_cache_file_path', 'extraction_cache', ['file_path'], unique=False)
+    op.create_index('ix_extraction_cache_last_used_at', 'extraction_cache', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_extraction_cache_last_used_at', table_name='extraction_cache')
+    op.drop_index('idx_extraction_cache_file_path', table_name='extraction_cache')
+    op.drop_table('extraction_cache')
@@ -0,0 +1,25 @@
+"""audio_files last played timestamp for the storage quota
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Never-played files are ranked by updated_at (their download) until played
+    op.add_column('audio_files', sa.Column('last_played_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('audio_files', 'last_played_at')
@@ -0,0 +1,63 @@
+"""transcription jobs and their finished chunks
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'transcription_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('audio_file_id', sa.Integer(), nullable=False),
+        sa.Column('language', sa.String(length=10), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('progress', sa.Float(), nullable=True),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('engine', sa.String(length=200), nullable=False),
+        sa.Column('chunk_seconds', sa.Float(), nullable=False),
+        sa.Column('overlap_seconds', sa.Float(), nullable=False),
+        sa.Column('chunks_total', sa.Integer(), nullable=True),
+        sa.Column('chunks_done', sa.Integer(), nullable=True),
+        sa.Column('segments', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['audio_file_id'], ['audio_files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_transcription_jobs_id', 'transcription_jobs', ['id'], unique=False)
+    op.create_index('ix_transcription_jobs_status', 'transcription_jobs', ['status'], unique=False)
+    op.create_index('idx_transcription_jobs_file_language', 'transcription_jobs', ['audio_file_id', 'language'], unique=False)
+    op.create_table(
+        'transcription_chunks',
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('chunk_index', sa.Integer(), nullable=False),
+        sa.Column('start_seconds', sa.Float(), nullable=False),
+        sa.Column('end_seconds', sa.Float(), nullable=False),
+        sa.Column('segments', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['transcription_jobs.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('job_id', 'chunk_index'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('transcription_chunks')
+    op.drop_index('idx_transcription_jobs_file_language', table_name='transcription_jobs')
+    op.drop_index('ix_transcription_jobs_status', table_name='transcription_jobs')
+    op.drop_index('ix_transcription_jobs_id', table_name='transcription_jobs')
+    op.drop_table('transcription_jobs')
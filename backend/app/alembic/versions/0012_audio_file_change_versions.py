@@ -0,0 +1,42 @@
+"""change versions and tombstones of audio files for delta sync
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows get version 0, so the first sync of any client returns them
+    op.add_column('audio_files', sa.Column('change_version', sa.BigInteger(), server_default='0', nullable=False))
+    op.create_index('idx_audio_files_change_version_id', 'audio_files', ['change_version', 'id'], unique=False)
+    op.create_table(
+        'audio_file_tombstones',
+        sa.Column('audio_file_id', sa.Integer(), nullable=False),
+        sa.Column('change_version', sa.BigInteger(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('audio_file_id'),
+    )
+    op.create_index(
+        'idx_audio_file_tombstones_change_version_id',
+        'audio_file_tombstones',
+        ['change_version', 'audio_file_id'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_audio_file_tombstones_change_version_id', table_name='audio_file_tombstones')
+    op.drop_table('audio_file_tombstones')
+    op.drop_index('idx_audio_files_change_version_id', table_name='audio_files')
+    op.drop_column('audio_files', 'change_version')
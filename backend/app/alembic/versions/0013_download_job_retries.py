@@ -0,0 +1,28 @@
+"""retry state of download jobs
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0013'
+down_revision = '0012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('download_jobs', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('download_jobs', sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_download_jobs_next_attempt_at', 'download_jobs', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_download_jobs_next_attempt_at', table_name='download_jobs')
+    op.drop_column('download_jobs', 'next_attempt_at')
+    op.drop_column('download_jobs', 'attempts')
@@ -0,0 +1,27 @@
+"""audio_files integrity verification timestamp
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0014'
+down_revision = '0013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing files have never been verified: the scrubber checks them first
+    op.add_column('audio_files', sa.Column('verified_at', sa.DateTime(), nullable=True))
+    op.create_index('idx_audio_files_status_verified_at', 'audio_files', ['status', 'verified_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_audio_files_status_verified_at', table_name='audio_files')
+    op.drop_column('audio_files', 'verified_at')
@@ -0,0 +1,44 @@
+"""one active transcription job per audio file and language
+
+Revision ID: 0015
+Revises: 0014
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0015'
+down_revision = '0014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Concurrent requests may already have queued duplicates: keep the newest
+    op.execute(
+        """
+        UPDATE transcription_jobs SET status = 'failed', error = 'Superseded by a newer job'
+        WHERE status IN ('queued', 'running')
+        AND id < (
+            SELECT MAX(newer.id) FROM transcription_jobs newer
+            WHERE newer.audio_file_id = transcription_jobs.audio_file_id
+            AND newer.language = transcription_jobs.language
+            AND newer.status IN ('queued', 'running')
+        )
+        """
+    )
+    op.create_index(
+        'uq_transcription_jobs_active',
+        'transcription_jobs',
+        ['audio_file_id', 'language'],
+        unique=True,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+        sqlite_where=sa.text("status IN ('queued', 'running')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_transcription_jobs_active', table_name='transcription_jobs')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+HTTP load test for a running CastLang API.
+
+Keeps ``--concurrency`` requests in flight for ``--duration`` seconds,
+cycling through the given paths, and reports throughput and latency.
+
+Usage:
+    python benchmarks/load_test.py --base-url http://localhost:8000/api/v1 \\
+        --concurrency 64 --duration 10 /audio-files?limit=50 /audio-files/1
+"""
+
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+
+import httpx
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run(base_url, paths, concurrency, duration, headers):
+    latencies = []
+    errors = 0
+    cycle = itertools.cycle(paths)
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0, headers=headers) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                path = next(cycle)
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    await response.aread()
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Paths relative to --base-url")
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--header", action="append", default=[], help="Extra header, e.g. 'Range: bytes=0-1023'")
+    args = parser.parse_args()
+
+    headers = dict(header.split(":", 1) for header in args.header)
+    headers = {key.strip(): value.strip() for key, value in headers.items()}
+    result = asyncio.run(run(args.base_url, args.paths, args.concurrency, args.duration, headers))
+    print(
+        f"{result['requests']} requests, {result['errors']} errors, "
+        f"{result['throughput_rps']:.1f} req/s, p50 {result['p50_ms']:.1f} ms, "
+        f"p99 {result['p99_ms']:.1f} ms"
+    )
+
+if __name__ == "__main__":
+    main()
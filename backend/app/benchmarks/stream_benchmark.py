@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the /stream response path.
+
+Compares the previous 8KB generator + StreamingResponse implementation with
+AudioFileResponse, for full-file transfers and random single-range seeks.
+Responses are driven directly through the ASGI interface, so the numbers
+measure the server-side cost of producing the body, not network speed.
+
+Usage:
+    python benchmarks/stream_benchmark.py --size-mb 200 --iterations 5
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from starlette.responses import StreamingResponse
+from src.streaming import AudioFileResponse, STREAM_CHUNK_SIZE
+
+def legacy_response(file_path, file_size, start=None, end=None):
+    """The generator-based response /stream used before AudioFileResponse."""
+    if start is None:
+        start, end = 0, file_size - 1
+
+    def generate_chunk():
+        with open(file_path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(remaining, 8192))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(generate_chunk(), status_code=206, media_type="audio/mpeg")
+
+async def drive(response):
+    """Run an ASGI response and return the number of body bytes produced."""
+    received = 0
+
+    async def receive():
+        # An idle client: never disconnects while the body is being sent
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+
+    scope = {"type": "http", "method": "GET", "extensions": {}}
+    await response(scope, receive, send)
+    return received
+
+async def bench(name, make_response, requests):
+    started = time.perf_counter()
+    total = 0
+    for args in requests:
+        total += await drive(make_response(*args))
+    elapsed = time.perf_counter() - started
+    throughput = total / elapsed / (1024 * 1024)
+    print(f"  {name:<18} {elapsed * 1000:9.1f} ms  {throughput:9.1f} MiB/s  ({total} bytes)")
+    return throughput
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=100, help="Size of the generated audio file")
+    parser.add_argument("--iterations", type=int, default=3, help="Full-file transfers per implementation")
+    parser.add_argument("--seeks", type=int, default=200, help="Random range requests per implementation")
+    parser.add_argument("--seek-size-kb", type=int, default=512, help="Size of each range request")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE, help="AudioFileResponse chunk size")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            tmp.write(block)
+        file_path = tmp.name
+    file_size = os.path.getsize(file_path)
+
+    try:
+        rng = random.Random(42)
+        seek_bytes = args.seek_size_kb * 1024
+        seeks = []
+        for _ in range(args.seeks):
+            start = rng.randrange(0, max(1, file_size - seek_bytes))
+            seeks.append((start, min(file_size - 1, start + seek_bytes - 1)))
+
+        print(f"File: {args.size_mb} MiB, chunk size: {args.chunk_size} bytes")
+        print("Full file:")
+        full = [()] * args.iterations
+        old = await bench("generator (8KB)", lambda: legacy_response(file_path, file_size), full)
+        new = await bench("AudioFileResponse", lambda: AudioFileResponse(file_path, file_size, chunk_size=args.chunk_size), full)
+        print(f"  speedup: {new / old:.2f}x")
+
+        print(f"Random range seeks ({args.seeks} x {args.seek_size_kb} KiB):")
+        old = await bench("generator (8KB)", lambda s, e: legacy_response(file_path, file_size, s, e), seeks)
+        new = await bench(
+            "AudioFileResponse",
+            lambda s, e: AudioFileResponse(file_path, file_size, ranges=[(s, e)], chunk_size=args.chunk_size),
+            seeks,
+        )
+        print(f"  speedup: {new / old:.2f}x")
+    finally:
+        os.unlink(file_path)
+
+if __name__ == "__main__":
+    asyncio.run(main())
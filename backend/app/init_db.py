@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Database initialization script for CastLang backend.
-This script creates the database tables and can be used for initial setup.
+This script applies the Alembic migrations and can be used for initial setup.
 """
 
 import sys
@@ -10,19 +10,20 @@ import os
 # Add the src directory to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.database import create_tables, engine
-from src.models import Base
+from sqlalchemy import text
+from src.database import engine
+from src.lifecycle import run_migrations
 
 def init_database():
-    """Initialize the database by creating all tables."""
-    print("Creating database tables...")
+    """Initialize the database by migrating it to the latest schema."""
+    print("Migrating database schema...")
     try:
-        create_tables()
-        print("✅ Database tables created successfully!")
+        run_migrations()
+        print("✅ Database schema is up to date!")
         
         # Test the connection
         with engine.connect() as conn:
-            result = conn.execute("SELECT version();")
+            result = conn.execute(text("SELECT version();"))
             version = result.fetchone()[0]
             print(f"✅ Database connection successful! PostgreSQL version: {version}")
             
@@ -1,9 +1,13 @@
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import os
 import time
 from dotenv import load_dotenv
 from src.models import Base
+from src.metrics import METRICS_ENABLED, instrument_engine
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,17 +26,70 @@ DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NA
 if os.getenv("DATABASE_URL"):
     DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Create SQLAlchemy engine
-engine = create_engine(
-    DATABASE_URL,
+# asyncio drivers used by the async engine, keyed by backend name
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(url: str) -> str:
+    """Map a DATABASE_URL onto the matching asyncio driver."""
+    url_obj = make_url(url)
+    driver = ASYNC_DRIVERS.get(url_obj.get_backend_name(), url_obj.drivername)
+    return url_obj.set(drivername=driver).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Connection pool configuration for the async engine used by the API routes
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Connection pool of the sync engine used by background workers. Every running
+# download holds a lock connection plus its job session's connection; the rest
+# covers the schedulers, the storage passes and the sync routes
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", str(2 * int(os.getenv("DOWNLOAD_WORKERS", "4")) + 5)))
+DB_SYNC_MAX_OVERFLOW = int(os.getenv("DB_SYNC_MAX_OVERFLOW", "10"))
+
+# Errors meaning the database itself is unreachable (mapped to 503 by the routes)
+DATABASE_ERRORS = (OperationalError, InterfaceError, ConnectionError)
+
+# Create SQLAlchemy engine (background workers and scripts)
+engine_options = dict(
     pool_pre_ping=True,  # Verify connections before use
     pool_recycle=300,    # Recycle connections every 5 minutes
     echo=os.getenv("DB_ECHO", "false").lower() == "true"  # SQL debugging
 )
+if make_url(DATABASE_URL).get_backend_name() != "sqlite":
+    engine_options.update(pool_size=DB_SYNC_POOL_SIZE, max_overflow=DB_SYNC_MAX_OVERFLOW)
+engine = create_engine(DATABASE_URL, **engine_options)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the API routes: queries never block the event loop.
+# pool_pre_ping replaces a per-request health check: stale connections are
+# detected and replaced when checked out of the pool.
+async_engine_options = dict(
+    pool_pre_ping=True,
+    pool_recycle=300,
+    echo=os.getenv("DB_ECHO", "false").lower() == "true",
+)
+if make_url(ASYNC_DATABASE_URL).get_backend_name() != "sqlite":
+    async_engine_options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **async_engine_options)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Count queries per engine and per request for /metrics
+if METRICS_ENABLED:
+    instrument_engine(engine, "sync")
+    instrument_engine(async_engine.sync_engine, "async")
+
 # Dependency to get database session
 def get_db():
     db = SessionLocal()
@@ -41,6 +98,11 @@ def get_db():
     finally:
         db.close()
 
+# Dependency to get an async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def wait_for_database(max_retries=30, retry_interval=2):
     """
     Wait for database to be available.
@@ -0,0 +1,242 @@
+"""
+Incremental disk-status reconciliation.
+
+Keeps an in-memory cache of each audio file's ``(mtime, size, inode)`` and
+refreshes it in the background in TTL-bounded batches, so list endpoints can
+read ``audio_files.status`` straight from the database instead of stat()ing
+the whole library on every request. Status changes found by a pass are
+written back with one bulk UPDATE per status.
+
+A file whose size differs from ``file_size_bytes`` (or that is empty) is
+``corrupted``: a crashed copy or a truncated write. Content checks that need
+to read the file are left to the integrity scrubber (``src/integrity.py``).
+"""
+import logging
+import os
+import stat
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src.database import SessionLocal
+from src.models import AudioFileDB
+from src.file_cache import audio_file_cache
+from src.metrics import FS_STATS
+from src.events import publish_status
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached stat result stays fresh before the file is checked again
+DISK_STATUS_TTL = float(os.getenv("DISK_STATUS_TTL", "60"))
+# Seconds between two background reconciliation passes
+DISK_SCAN_INTERVAL = float(os.getenv("DISK_SCAN_INTERVAL", "5"))
+# Maximum number of files stat()ed per background pass
+DISK_SCAN_BATCH_SIZE = int(os.getenv("DISK_SCAN_BATCH_SIZE", "500"))
+# Seconds between full row resyncs (catches rows deleted by other processes)
+DISK_FULL_SYNC_INTERVAL = float(os.getenv("DISK_FULL_SYNC_INTERVAL", "600"))
+
+# Statuses owned by other subsystems that the reconciler must not override
+# ('not_downloaded' rows are queued placeholders with no file yet, 'evicted'
+# rows had their file deleted by the storage quota, 'corrupted' rows stay so
+# until they are downloaded again)
+SKIPPED_STATUSES = ('downloading', 'not_downloaded', 'evicted', 'corrupted')
+
+FileSignature = Tuple[int, int, int]  # (mtime_ns, size, inode)
+
+def stat_regular_file(file_path: str) -> Optional[os.stat_result]:
+    """Return the stat() result of a regular file, or None if it is missing or not a file."""
+    FS_STATS.inc("stat_regular_file")
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+def disk_status(st: Optional[os.stat_result], expected_size: Optional[int]) -> str:
+    """Status of an audio file from the stat() result of its file and its recorded size."""
+    if st is None:
+        return 'file_missing'
+    if st.st_size == 0 or (expected_size is not None and st.st_size != expected_size):
+        return 'corrupted'
+    return 'downloaded'
+
+def stat_file(file_path: str) -> Optional[FileSignature]:
+    """Return the file's ``(mtime_ns, size, inode)``, or None if it is not a regular file."""
+    st = stat_regular_file(file_path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino) if st else None
+
+@dataclass
+class CachedFile:
+    file_path: str
+    status: str
+    expected_size: Optional[int] = None
+    signature: Optional[FileSignature] = None
+    checked_at: float = 0.0
+
+class DiskStatusReconciler:
+    """Background reconciler between ``audio_files.status`` and the filesystem."""
+
+    def __init__(self, ttl: float, interval: float, batch_size: int, full_sync_interval: float):
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.full_sync_interval = full_sync_interval
+        self._files: Dict[int, CachedFile] = {}
+        self._watermark: Optional[datetime] = None
+        self._last_full_sync = 0.0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="disk-status", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                self.reconcile(db)
+            except Exception as e:
+                logger.error(f"Disk status reconciliation failed: {e}")
+                db.rollback()
+            finally:
+                db.close()
+            self._stop.wait(self.interval)
+
+    def get_signature(self, audio_file_id: int) -> Optional[FileSignature]:
+        with self._lock:
+            cached = self._files.get(audio_file_id)
+            return cached.signature if cached else None
+
+    def invalidate(self, audio_file_id: int):
+        """Drop a file from the cache (deleted or re-downloaded)."""
+        with self._lock:
+            self._files.pop(audio_file_id, None)
+
+    def _sync_rows(self, db: Session, full: bool):
+        """Load new or changed rows (or every row when ``full``) into the cache."""
+        query = db.query(
+            AudioFileDB.id,
+            AudioFileDB.file_path,
+            AudioFileDB.file_size_bytes,
+            AudioFileDB.status,
+            AudioFileDB.updated_at,
+        )
+        if not full and self._watermark is not None:
+            query = query.filter(AudioFileDB.updated_at >= self._watermark)
+        rows = query.all()
+
+        with self._lock:
+            if full:
+                seen = {row.id for row in rows}
+                for audio_file_id in list(self._files):
+                    if audio_file_id not in seen:
+                        del self._files[audio_file_id]
+                self._last_full_sync = time.monotonic()
+            for row in rows:
+                cached = self._files.get(row.id)
+                if cached is None or cached.file_path != row.file_path:
+                    self._files[row.id] = CachedFile(
+                        file_path=row.file_path,
+                        status=row.status,
+                        expected_size=row.file_size_bytes,
+                    )
+                else:
+                    cached.status = row.status
+                    cached.expected_size = row.file_size_bytes
+                if row.updated_at and (self._watermark is None or row.updated_at > self._watermark):
+                    self._watermark = row.updated_at
+
+    def reconcile(self, db: Session, force: bool = False) -> int:
+        """
+        Run one reconciliation pass.
+        
+        Args:
+            db (Session): Database session used for the row sync and bulk updates
+            force (bool): Re-check every file regardless of TTL and batch size
+        
+        Returns:
+            int: Number of audio files whose status changed
+        """
+        now = time.monotonic()
+        full = force or self._watermark is None or now - self._last_full_sync >= self.full_sync_interval
+        self._sync_rows(db, full)
+
+        with self._lock:
+            stale = [
+                (cached.checked_at, audio_file_id, cached.file_path)
+                for audio_file_id, cached in self._files.items()
+                if force or now - cached.checked_at >= self.ttl
+            ]
+        if not force:
+            # Oldest checks first, so every file is eventually visited
+            stale.sort()
+            stale = stale[:self.batch_size]
+
+        # stat() outside the lock so readers are never blocked on disk I/O
+        results = [(audio_file_id, stat_file(file_path)) for _, audio_file_id, file_path in stale]
+
+        changes: Dict[str, List[int]] = {'downloaded': [], 'file_missing': [], 'corrupted': []}
+        checked_at = time.monotonic()
+        with self._lock:
+            for audio_file_id, signature in results:
+                cached = self._files.get(audio_file_id)
+                if cached is None:
+                    continue
+                if cached.signature != signature:
+                    # Replaced, truncated or removed: drop the streaming metadata
+                    audio_file_cache.invalidate(audio_file_id)
+                cached.signature = signature
+                cached.checked_at = checked_at
+                if cached.status in SKIPPED_STATUSES:
+                    continue
+                if signature is None:
+                    new_status = 'file_missing'
+                elif signature[1] == 0 or cached.expected_size not in (None, signature[1]):
+                    new_status = 'corrupted'
+                else:
+                    new_status = 'downloaded'
+                if cached.status != new_status:
+                    changes[new_status].append(audio_file_id)
+                    cached.status = new_status
+
+        changed = 0
+        for status, ids in changes.items():
+            if ids:
+                db.execute(
+                    update(AudioFileDB)
+                    .where(AudioFileDB.id.in_(ids))
+                    .where(AudioFileDB.status.notin_(SKIPPED_STATUSES))
+                    .values(status=status)
+                )
+                changed += len(ids)
+        if changed:
+            db.commit()
+            for status, ids in changes.items():
+                publish_status(ids, status)
+            logger.info(f"Disk status reconciliation updated {changed} audio files")
+        return changed
+
+reconciler = DiskStatusReconciler(
+    ttl=DISK_STATUS_TTL,
+    interval=DISK_SCAN_INTERVAL,
+    batch_size=DISK_SCAN_BATCH_SIZE,
+    full_sync_interval=DISK_FULL_SYNC_INTERVAL,
+)
@@ -0,0 +1,422 @@
+"""
+Library and download change events.
+
+The service layer publishes a small event whenever an audio file is created,
+changes status or is deleted and whenever a download or transcription job is
+created or makes progress. ``GET /events`` streams them to clients as
+server-sent events, so a client loads the library once and then applies the
+deltas instead of polling ``/audio-files``.
+
+On PostgreSQL every worker publishes through ``NOTIFY`` and receives every
+worker's events (its own included) through ``LISTEN`` on one dedicated
+connection, so a client connected to any worker sees every change, in the
+same order. Other databases only support a single API process and deliver
+events in-process.
+
+Each worker keeps the last ``EVENTS_REPLAY_SIZE`` events, so a client
+reconnecting with ``Last-Event-ID`` receives what it missed. When that id is
+no longer known (or the client fell too far behind), it receives a
+``resync`` event and has to reload the library.
+
+The same events keep each process's caches coherent: receiving an
+``audio_file`` event drops that file's cached streaming metadata, whichever
+worker changed it, a ``transcript`` event drops that transcript's index,
+and a ``resync`` (events possibly missed) clears the
+caches. Events are therefore published even when ``/events`` is disabled.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional, Set, Tuple
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text
+from dotenv import load_dotenv
+from src.database import engine
+from src.file_cache import audio_file_cache
+from src.metrics import counter, gauge
+from src.models import AudioFile, DownloadJob, TranscriptionJob
+from src.transcript_index import transcript_index_cache
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Serve /events; events are published regardless, caches depend on them
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "true").lower() == "true"
+# PostgreSQL NOTIFY channel shared by all workers
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "castlang_events")
+# Recent events kept per worker for clients reconnecting with Last-Event-ID
+EVENTS_REPLAY_SIZE = int(os.getenv("EVENTS_REPLAY_SIZE", "1000"))
+# Events buffered per client; a client further behind is told to resync
+EVENTS_CLIENT_QUEUE_SIZE = int(os.getenv("EVENTS_CLIENT_QUEUE_SIZE", "1000"))
+# Seconds between keepalive comments on an idle stream
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# Reconnection delay suggested to clients, in milliseconds
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+
+# NOTIFY payloads must stay under 8000 bytes
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+RESYNC = "resync"
+
+EVENTS_PUBLISHED = counter("castlang_events_published_total", "Change events published by this process, by type.", ("type",))
+EVENT_SUBSCRIBERS = gauge("castlang_event_subscribers", "Clients connected to /events.")
+
+_sequence = itertools.count(1)
+
+@dataclass
+class Event:
+    id: str
+    type: str
+    data: Any
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "type": self.type, "data": self.data}
+
+    def encode(self) -> str:
+        """Server-sent event frame."""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, separators=(',', ':'))}\n\n"
+
+def new_event(event_type: str, data: Any) -> Event:
+    # Unique across workers; ordering comes from the delivery order, not the id
+    return Event(f"{time.time_ns()}-{os.getpid()}-{next(_sequence)}", event_type, jsonable_encoder(data))
+
+def resync_event() -> Event:
+    return Event("", RESYNC, {})
+
+def notify_payloads(events: Iterable[Event]) -> List[str]:
+    """Pack events into JSON-array NOTIFY payloads that fit the size limit."""
+    payloads, batch, size = [], [], 2
+    for event in events:
+        encoded = json.dumps(event.to_dict(), separators=(',', ':'))
+        if len(encoded.encode()) + 2 > NOTIFY_PAYLOAD_LIMIT:
+            logger.warning(f"Dropping {event.type} event {event.id}: too large for NOTIFY")
+            continue
+        if batch and size + len(encoded.encode()) + 1 > NOTIFY_PAYLOAD_LIMIT:
+            payloads.append("[" + ",".join(batch) + "]")
+            batch, size = [], 2
+        batch.append(encoded)
+        size += len(encoded.encode()) + 1
+    if batch:
+        payloads.append("[" + ",".join(batch) + "]")
+    return payloads
+
+class Subscriber:
+    """One connected client: a bounded queue fed from any thread."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, types: Optional[Set[str]], max_size: int):
+        self.loop = loop
+        self.types = types
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.max_size = max_size
+        self.overflowed = False
+
+    def wants(self, event: Event) -> bool:
+        return self.types is None or event.type == RESYNC or event.type.split(".", 1)[0] in self.types
+
+    def push(self, events: List[Event]):
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        for event in events:
+            if not self.wants(event):
+                continue
+            if self.queue.qsize() >= self.max_size:
+                # Too slow to follow: drop the backlog and make it reload
+                self.overflowed = True
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(resync_event())
+                return
+            self.queue.put_nowait(event)
+
+class EventBus:
+    """Fans published events out to subscribers, across workers on PostgreSQL."""
+
+    def __init__(self, channel: str, replay_size: int, client_queue_size: int):
+        self.channel = channel
+        self.client_queue_size = client_queue_size
+        self._recent: deque = deque(maxlen=replay_size)
+        self._subscribers: Set[Subscriber] = set()
+        self._listeners: List[Callable[[List[Event]], None]] = []
+        self._lock = threading.Lock()
+        self._outbox: "queue.Queue[Event]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._wakeup: Optional[Tuple[int, int]] = None
+
+    @property
+    def distributed(self) -> bool:
+        return engine.dialect.name == "postgresql"
+
+    def start(self):
+        if not self.distributed or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._wakeup = os.pipe()
+        os.set_blocking(self._wakeup[0], False)
+        os.set_blocking(self._wakeup[1], False)
+        self._thread = threading.Thread(target=self._loop, name="event-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._wake()
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._wakeup:
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+    def publish(self, event_type: str, data: Any):
+        self.publish_many([(event_type, data)])
+
+    def publish_many(self, events: Iterable[Tuple[str, Any]]):
+        """
+        Publish events; never blocks on I/O in an API worker.
+
+        Call after the change is committed, so no client sees a change that
+        is rolled back.
+        """
+        built = [new_event(event_type, data) for event_type, data in events]
+        if not built:
+            return
+        for event in built:
+            EVENTS_PUBLISHED.inc(event.type)
+        if not self.distributed:
+            self._deliver(built)
+        elif self._thread is not None:
+            for event in built:
+                self._outbox.put(event)
+            self._wake()
+        else:
+            # A download worker process: no listener, notify directly
+            self._notify_now(built)
+
+    def subscribe(self, types: Optional[Set[str]] = None, last_event_id: Optional[str] = None) -> Subscriber:
+        """
+        Register a client on the running event loop.
+
+        Args:
+            types (set): Event type prefixes to receive (``audio_file``, ``job``), None for all
+            last_event_id (str): Last event the client received, to replay what followed
+
+        Returns:
+            Subscriber: Its queue receives the replayed events, then new ones
+        """
+        subscriber = Subscriber(asyncio.get_running_loop(), types, self.client_queue_size)
+        with self._lock:
+            if last_event_id:
+                recent = list(self._recent)
+                ids = [event.id for event in recent]
+                if last_event_id in ids:
+                    subscriber.push(recent[ids.index(last_event_id) + 1:])
+                else:
+                    subscriber.push([resync_event()])
+            self._subscribers.add(subscriber)
+        EVENT_SUBSCRIBERS.inc()
+        return subscriber
+
+    def add_listener(self, listener: Callable[[List[Event]], None]):
+        """Call ``listener`` in this process with every batch of delivered events."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.discard(subscriber)
+                EVENT_SUBSCRIBERS.dec()
+
+    def _deliver(self, events: List[Event]):
+        for listener in self._listeners:
+            try:
+                listener(events)
+            except Exception as e:
+                logger.error(f"Event listener {listener.__name__} failed: {e}")
+        with self._lock:
+            self._recent.extend(event for event in events if event.type != RESYNC)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, events)
+            except RuntimeError:
+                # Its event loop is closed
+                self.unsubscribe(subscriber)
+
+    def _wake(self):
+        if self._wakeup:
+            try:
+                os.write(self._wakeup[1], b"\0")
+            except (BlockingIOError, OSError):
+                pass
+
+    def _drain_outbox(self) -> List[Event]:
+        events = []
+        while True:
+            try:
+                events.append(self._outbox.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _notify_now(self, events: List[Event]):
+        try:
+            with engine.connect() as connection:
+                for payload in notify_payloads(events):
+                    connection.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload})
+                connection.commit()
+        except Exception as e:
+            logger.error(f"Publishing {len(events)} events failed: {e}")
+
+    def _loop(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self._listen()
+                if backoff > 1.0:
+                    # Events of other workers may have been missed while disconnected
+                    self._deliver([resync_event()])
+                backoff = 1.0
+                self._serve(connection)
+            except Exception as e:
+                logger.error(f"Event listener failed, reconnecting in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+    def _listen(self):
+        # A dedicated DBAPI connection outside the pool, in autocommit mode
+        raw = engine.raw_connection()
+        raw.detach()
+        connection = raw.dbapi_connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _serve(self, connection):
+        while not self._stop.is_set():
+            pending = self._drain_outbox()
+            if pending:
+                try:
+                    with connection.cursor() as cursor:
+                        for payload in notify_payloads(pending):
+                            cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+                except Exception:
+                    # Send them again on the next connection
+                    for event in pending:
+                        self._outbox.put(event)
+                    raise
+            readable, _, _ = select.select([connection, self._wakeup[0]], [], [], 5.0)
+            if self._wakeup[0] in readable:
+                try:
+                    while os.read(self._wakeup[0], 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            if connection in readable:
+                connection.poll()
+            # pg_notify above may already have read notifications
+            if connection.notifies:
+                received = []
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        received.extend(Event(**item) for item in json.loads(notify.payload))
+                    except (ValueError, TypeError) as e:
+                        logger.warning(f"Ignoring malformed event payload: {e}")
+                if received:
+                    self._deliver(received)
+
+event_bus = EventBus(
+    channel=EVENTS_CHANNEL,
+    replay_size=EVENTS_REPLAY_SIZE,
+    client_queue_size=EVENTS_CLIENT_QUEUE_SIZE,
+)
+
+def invalidate_caches(events: List[Event]) -> None:
+    """Drop what this process cached about files another process (or this one) changed."""
+    for event in events:
+        if event.type == RESYNC:
+            # Events may have been missed while the listener was disconnected
+            audio_file_cache.clear()
+            transcript_index_cache.clear()
+        elif event.type == "transcript.updated":
+            transcript_index_cache.invalidate(event.data["audio_file_id"], event.data["language"])
+        elif event.type.startswith("audio_file."):
+            audio_file_cache.invalidate(event.data["id"])
+            if event.type == "audio_file.deleted":
+                transcript_index_cache.invalidate(event.data["id"])
+
+event_bus.add_listener(invalidate_caches)
+
+def publish_audio_file(event_type: str, db_audio_file) -> None:
+    """Publish ``audio_file.created`` or ``audio_file.updated`` with the whole row."""
+    event_bus.publish(event_type, AudioFile.from_orm(db_audio_file))
+
+def publish_status(audio_file_ids: Iterable[int], status: str) -> None:
+    """Publish ``audio_file.updated`` with only the new status, for bulk updates."""
+    event_bus.publish_many(("audio_file.updated", {"id": audio_file_id, "status": status}) for audio_file_id in audio_file_ids)
+
+def publish_deleted(audio_file_id: int) -> None:
+    event_bus.publish("audio_file.deleted", {"id": audio_file_id})
+
+def publish_job(event_type: str, db_job) -> None:
+    """Publish ``job.created`` or ``job.updated`` with the whole job."""
+    event_bus.publish(event_type, DownloadJob.from_orm(db_job))
+
+EVENT_TYPES = ("audio_file", "job", "transcription_job", "transcript")
+
+def publish_transcription_job(event_type: str, db_job) -> None:
+    """Publish ``transcription_job.created`` or ``transcription_job.updated``."""
+    event_bus.publish(event_type, TranscriptionJob.from_orm(db_job))
+
+def publish_transcript(audio_file_id: int, language: str, content_type: str) -> None:
+    """Publish ``transcript.updated`` after the segments of a transcript were replaced."""
+    event_bus.publish("transcript.updated", {"audio_file_id": audio_file_id, "language": language, "content_type": content_type})
+
+async def event_stream(types: Optional[Set[str]] = None, last_event_id: Optional[str] = None, keepalive: float = EVENTS_KEEPALIVE):
+    """
+    Server-sent event frames for one client, until it has to resync.
+
+    Args:
+        types (set): Event type prefixes to receive, None for all
+        last_event_id (str): ``Last-Event-ID`` sent by a reconnecting client
+        keepalive (float): Seconds of silence before a keepalive comment
+    """
+    # Subscribed on the first iteration, so a response that never starts leaks nothing
+    subscriber = event_bus.subscribe(types, last_event_id)
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the connection and detects gone clients
+                yield ": keepalive\n\n"
+                continue
+            events = [event]
+            while not subscriber.queue.empty():
+                events.append(subscriber.queue.get_nowait())
+            yield "".join(event.encode() for event in events)
+            if any(event.type == RESYNC for event in events):
+                # The client reconnects and reloads the library
+                return
+    finally:
+        event_bus.unsubscribe(subscriber)
@@ -0,0 +1,233 @@
+"""
+Persistent yt-dlp extraction cache.
+
+Every finished download is remembered under the extractor, the video id and
+the audio format settings, with the part of the info dict the audio file rows
+use and the stored blob it produced. A later request for the same video (a
+re-download, or another ``extract-audio`` of the same URL) is resolved from
+the cache:
+
+- when the URL alone identifies the video (``youtube.com/watch?v=...``,
+  ``youtu.be/...``), without any network request;
+- otherwise after the metadata request, skipping the download and the
+  FFmpeg transcode.
+
+Entries keep their blob on disk after the last audio file using it is
+deleted, so it can be re-linked. Those cache-only blobs are evicted least
+recently used first whenever together they exceed
+``EXTRACTION_CACHE_MAX_BYTES``; files audio files use do not count, the
+storage quota (``src.storage_quota``) bounds those.
+"""
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+from sqlalchemy import func, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from yt_dlp.extractor import gen_extractor_classes
+from dotenv import load_dotenv
+from src.models import AudioFileDB, ExtractionCacheDB
+from src.storage import StoredBlob, blob_lock_name, remove_blob
+from src.hls import content_hash_of, remove_renditions
+from src.waveform import remove_waveform
+from src.locks import advisory_lock
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+# Budget for files only the cache keeps (no audio file uses them); 0 keeps them forever
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+
+# Info dict fields needed to create an audio file row from the cache
+CACHED_INFO_FIELDS = (
+    "id", "title", "episode_number", "series", "duration",
+    "extractor_key", "webpage_url", "channel", "uploader", "upload_date",
+)
+
+@dataclass(frozen=True)
+class CachedExtraction:
+    info: dict
+    blob: StoredBlob
+
+def cache_key(extractor: str, video_id: str, settings: Sequence[str]) -> str:
+    """Key of a video extracted with the given (format, codec, quality) settings."""
+    material = "\0".join((extractor.lower(), video_id, *settings))
+    return hashlib.sha256(material.encode()).hexdigest()
+
+@lru_cache(maxsize=4096)
+def url_video_key(url: str) -> Optional[Tuple[str, str]]:
+    """
+    (extractor, video id) of a URL from yt-dlp's URL patterns, without network access.
+
+    Returns None when no specific extractor matches or the URL does not
+    contain the id (e.g. playlist and channel URLs yield their own id, which
+    simply never matches a cached video).
+    """
+    for extractor in gen_extractor_classes():
+        if extractor.suitable(url):
+            if extractor.ie_key() == "Generic":
+                return None
+            video_id = extractor.get_temp_id(url)
+            return (extractor.ie_key(), video_id) if video_id else None
+    return None
+
+def lookup(db: Session, extractor: str, video_id: str, settings: Sequence[str]) -> Optional[CachedExtraction]:
+    """Return a cache entry whose stored file is still intact, dropping stale entries."""
+    entry = db.get(ExtractionCacheDB, cache_key(extractor, video_id, settings))
+    if entry is None:
+        return None
+    try:
+        intact = os.stat(entry.file_path).st_size == entry.size_bytes
+    except OSError:
+        intact = False
+    if not intact:
+        logger.info(f"Dropping stale extraction cache entry for {extractor}:{video_id}")
+        db.delete(entry)
+        db.commit()
+        return None
+    blob = StoredBlob(Path(entry.file_path), entry.content_hash, entry.size_bytes, deduplicated=True)
+    cached = CachedExtraction(json.loads(entry.info), blob)
+    entry.hit_count += 1
+    entry.last_used_at = datetime.utcnow()
+    db.commit()
+    return cached
+
+def lookup_url(db: Session, url: str, settings: Sequence[str]) -> Optional[CachedExtraction]:
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    key = url_video_key(url)
+    return lookup(db, key[0], key[1], settings) if key else None
+
+def lookup_info(db: Session, info: dict, settings: Sequence[str]) -> Optional[CachedExtraction]:
+    if not EXTRACTION_CACHE_ENABLED or not info.get("id") or not info.get("extractor_key"):
+        return None
+    return lookup(db, info["extractor_key"], str(info["id"]), settings)
+
+def remember(db: Session, info: dict, blob: StoredBlob, settings: Sequence[str]):
+    """Record the file a video produced, then enforce the storage budget."""
+    if not EXTRACTION_CACHE_ENABLED or not info.get("id") or not info.get("extractor_key"):
+        return
+    key = cache_key(info["extractor_key"], str(info["id"]), settings)
+    cached_info = json.dumps({field: info.get(field) for field in CACHED_INFO_FIELDS}, default=str)
+    now = datetime.utcnow()
+    entry = db.get(ExtractionCacheDB, key)
+    if entry is None:
+        entry = ExtractionCacheDB(cache_key=key, hit_count=0, created_at=now)
+        db.add(entry)
+    entry.extractor = info["extractor_key"]
+    entry.video_id = str(info["id"])
+    entry.info = cached_info
+    entry.file_path = str(blob.path)
+    entry.content_hash = blob.content_hash
+    entry.size_bytes = blob.size
+    entry.last_used_at = now
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent download of the same video recorded it first
+        db.rollback()
+    enforce_budget(db)
+
+def is_cached_file(db: Session, file_path: str) -> bool:
+    return db.query(ExtractionCacheDB.cache_key).filter(ExtractionCacheDB.file_path == file_path).first() is not None
+
+def storage_used(db: Session) -> int:
+    """Bytes of stored audio: files of downloaded audio files and of cache entries, each counted once."""
+    files = union_all(
+        select(AudioFileDB.file_path.label("file_path"), AudioFileDB.file_size_bytes.label("size"))
+        .where(AudioFileDB.status == 'downloaded', AudioFileDB.file_size_bytes.isnot(None)),
+        select(ExtractionCacheDB.file_path, ExtractionCacheDB.size_bytes),
+    ).subquery()
+    per_file = select(func.max(files.c.size).label("size")).group_by(files.c.file_path).subquery()
+    return int(db.execute(select(func.coalesce(func.sum(per_file.c.size), 0))).scalar())
+
+def cache_only_used(db: Session) -> int:
+    """Bytes of files kept only by the cache, each counted once; grows with the cache, not the library."""
+    cached = (
+        select(ExtractionCacheDB.file_path, func.max(ExtractionCacheDB.size_bytes).label("size"))
+        .where(
+            ~select(AudioFileDB.id)
+            .where(AudioFileDB.file_path == ExtractionCacheDB.file_path, AudioFileDB.status != 'evicted')
+            .exists()
+        )
+        .group_by(ExtractionCacheDB.file_path)
+        .subquery()
+    )
+    return int(db.execute(select(func.coalesce(func.sum(cached.c.size), 0))).scalar())
+
+def evict_entry(db: Session, entry: ExtractionCacheDB) -> int:
+    """Delete an entry and, when nothing else uses it, its file; returns the bytes freed."""
+    file_path, size = entry.file_path, entry.size_bytes
+    db.delete(entry)
+    db.commit()
+    # Checked under the file's lock: a download deduplicated onto it links it under the same lock
+    with advisory_lock(blob_lock_name(file_path)):
+        if is_cached_file(db, file_path):
+            return 0
+        if db.query(AudioFileDB.id).filter(AudioFileDB.file_path == file_path, AudioFileDB.status != 'evicted').first():
+            return 0
+        remove_renditions(content_hash_of(file_path))
+        remove_waveform(content_hash_of(file_path))
+        return size if remove_blob(file_path) else 0
+
+def evict_cache_only(db: Session, excess: int) -> Tuple[int, int]:
+    """
+    Evict least recently used cache-only files until ``excess`` bytes are freed.
+
+    Files still used by an audio file are never evicted; their entries are
+    kept since they cost no extra disk space.
+
+    Args:
+        db (Session): Database session
+        excess (int): Bytes to free
+
+    Returns:
+        tuple: ``(entries evicted, bytes freed)``
+    """
+    in_use = (
+        select(AudioFileDB.id)
+        .where(AudioFileDB.file_path == ExtractionCacheDB.file_path, AudioFileDB.status != 'evicted')
+        .exists()
+    )
+    candidates = (
+        db.query(ExtractionCacheDB)
+        .filter(~in_use)
+        .order_by(ExtractionCacheDB.last_used_at)
+        .all()
+    )
+    evicted = freed = 0
+    for entry in candidates:
+        if freed >= excess:
+            break
+        freed += evict_entry(db, entry)
+        evicted += 1
+    return evicted, freed
+
+def enforce_budget(db: Session) -> int:
+    """
+    Evict cache-only files until they fit EXTRACTION_CACHE_MAX_BYTES.
+
+    Args:
+        db (Session): Database session
+
+    Returns:
+        int: Number of entries evicted
+    """
+    if not EXTRACTION_CACHE_ENABLED or EXTRACTION_CACHE_MAX_BYTES <= 0:
+        return 0
+    excess = cache_only_used(db) - EXTRACTION_CACHE_MAX_BYTES
+    if excess <= 0:
+        return 0
+    evicted, _ = evict_cache_only(db, excess)
+    if evicted:
+        logger.info(f"Evicted {evicted} extraction cache entries to stay within {EXTRACTION_CACHE_MAX_BYTES} bytes")
+    return evicted
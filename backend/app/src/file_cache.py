@@ -0,0 +1,115 @@
+"""
+In-process cache of resolved audio files for the streaming hot path.
+
+Audio players issue many range requests per listening session. Caching the
+resolved ``(path, stat, status)`` per filename lets a seek skip both the
+database round-trip and the extra stat() calls. Entries expire after a TTL
+and are invalidated whenever a file or its status changes, in this process
+or, through the change events, in another one.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+AUDIO_FILE_CACHE_SIZE = int(os.getenv("AUDIO_FILE_CACHE_SIZE", "10000"))
+AUDIO_FILE_CACHE_TTL = float(os.getenv("AUDIO_FILE_CACHE_TTL", "30"))
+
+@dataclass(frozen=True)
+class ResolvedAudioFile:
+    id: int
+    filename: str
+    file_path: str
+    status: str
+    stat: Optional[os.stat_result]
+    expires_at: float
+
+    @property
+    def size(self) -> Optional[int]:
+        return self.stat.st_size if self.stat else None
+
+    @property
+    def mtime(self) -> Optional[float]:
+        return self.stat.st_mtime if self.stat else None
+
+class AudioFileCache:
+    """Thread-safe LRU cache with TTL, keyed by filename."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, ResolvedAudioFile]" = OrderedDict()
+        self._filenames: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename: str) -> Optional[ResolvedAudioFile]:
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    self._remove(filename)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(filename)
+            self.hits += 1
+            return entry
+
+    def put(
+        self,
+        audio_file_id: int,
+        filename: str,
+        file_path: str,
+        status: str,
+        stat: Optional[os.stat_result],
+    ) -> ResolvedAudioFile:
+        entry = ResolvedAudioFile(
+            id=audio_file_id,
+            filename=filename,
+            file_path=file_path,
+            status=status,
+            stat=stat,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        if self.max_size <= 0 or self.ttl <= 0:
+            return entry
+        with self._lock:
+            previous = self._filenames.get(audio_file_id)
+            if previous is not None and previous != filename:
+                self._remove(previous)
+            self._entries[filename] = entry
+            self._entries.move_to_end(filename)
+            self._filenames[audio_file_id] = filename
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+        return entry
+
+    def _remove(self, filename: str):
+        entry = self._entries.pop(filename, None)
+        if entry is not None and self._filenames.get(entry.id) == filename:
+            del self._filenames[entry.id]
+
+    def invalidate(self, audio_file_id: int):
+        with self._lock:
+            filename = self._filenames.get(audio_file_id)
+            if filename is not None:
+                self._remove(filename)
+
+    def invalidate_filename(self, filename: str):
+        with self._lock:
+            self._remove(filename)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._filenames.clear()
+
+audio_file_cache = AudioFileCache(max_size=AUDIO_FILE_CACHE_SIZE, ttl=AUDIO_FILE_CACHE_TTL)
@@ -0,0 +1,188 @@
+"""
+HLS rendition pipeline.
+
+When ``HLS_ENABLED`` is set, every stored audio file is transcoded after its
+download into an HLS bitrate ladder (``HLS_BITRATES``) under
+``HLS_DIR/<content hash>/``. One FFmpeg run decodes the source once and
+encodes every rendition; at most ``HLS_WORKERS`` run at the same time.
+Renditions are keyed by content hash like the blobs themselves, so their
+playlists and segments never change and can be cached forever.
+"""
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Set
+from dotenv import load_dotenv
+from src.storage import DOWNLOADS_DIR
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HLS_ENABLED = os.getenv("HLS_ENABLED", "false").lower() == "true"
+HLS_DIR = Path(os.getenv("HLS_DIR", str(DOWNLOADS_DIR / "hls")))
+HLS_BITRATES = [int(b) for b in os.getenv("HLS_BITRATES", "64,128,192").split(",") if b.strip()]
+HLS_CODEC = os.getenv("HLS_CODEC", "aac").lower()  # aac (MPEG-TS segments) or opus (fMP4 segments)
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "6"))
+HLS_WORKERS = int(os.getenv("HLS_WORKERS", "2"))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+MASTER_PLAYLIST = "master.m3u8"
+CONTENT_HASH = re.compile(r"^[0-9a-f]{64}$")
+# Files a rendition directory may contain: <bitrate>k/index.m3u8, segments, fMP4 init
+RENDITION_FILE = re.compile(r"^(master\.m3u8|\d+k/(index\.m3u8|init\.mp4|seg_\d{5}\.(ts|m4s)))$")
+MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "audio/mp4",
+    ".mp4": "audio/mp4",
+}
+CODECS = {
+    "aac": ("aac", "mp4a.40.2", "mpegts", "ts"),
+    "opus": ("libopus", "opus", "fmp4", "m4s"),
+}
+
+def rendition_dir(content_hash: str) -> Path:
+    return HLS_DIR / content_hash
+
+def master_playlist_path(content_hash: str) -> Path:
+    return rendition_dir(content_hash) / MASTER_PLAYLIST
+
+def has_renditions(content_hash: Optional[str]) -> bool:
+    return bool(content_hash) and master_playlist_path(content_hash).is_file()
+
+def content_hash_of(file_path: str) -> Optional[str]:
+    """Content hash of a blob path (``<aa>/<sha256>.<ext>``); None for legacy files."""
+    stem = Path(file_path).stem
+    return stem if CONTENT_HASH.match(stem) else None
+
+def rendition_file(content_hash: str, relative_path: str) -> Optional[Path]:
+    """Resolve a playlist or segment request to a file, rejecting anything outside the ladder."""
+    if not CONTENT_HASH.match(content_hash) or not RENDITION_FILE.match(relative_path):
+        return None
+    path = rendition_dir(content_hash) / relative_path
+    return path if path.is_file() else None
+
+def media_type_for(path: Path) -> str:
+    return MEDIA_TYPES.get(path.suffix, "application/octet-stream")
+
+def ffmpeg_command(source: Path, output_dir: Path, bitrates: List[int]) -> List[str]:
+    encoder, _, segment_type, extension = CODECS[HLS_CODEC]
+    command = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", "-i", str(source)]
+    for bitrate in bitrates:
+        variant = output_dir / f"{bitrate}k"
+        variant.mkdir(parents=True, exist_ok=True)
+        command += [
+            "-map", "0:a:0", "-vn",
+            "-c:a", encoder, "-b:a", f"{bitrate}k",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SECONDS),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_type", segment_type,
+            "-hls_segment_filename", str(variant / f"seg_%05d.{extension}"),
+        ]
+        if segment_type == "fmp4":
+            command += ["-hls_fmp4_init_filename", "init.mp4"]
+        command.append(str(variant / "index.m3u8"))
+    return command
+
+def master_playlist(bitrates: List[int]) -> str:
+    _, codec, segment_type, _ = CODECS[HLS_CODEC]
+    lines = ["#EXTM3U", f"#EXT-X-VERSION:{7 if segment_type == 'fmp4' else 3}", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for bitrate in sorted(bitrates):
+        # Peak bandwidth: encoder bitrate plus container overhead
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={int(bitrate * 1000 * 1.1)},CODECS="{codec}"')
+        lines.append(f"{bitrate}k/index.m3u8")
+    return "\n".join(lines) + "\n"
+
+def transcode_renditions(source: Path, content_hash: str) -> Path:
+    """
+    Encode the HLS ladder of an audio file.
+
+    The ladder is written to a temporary directory and renamed into place,
+    so a partially encoded ladder is never served.
+
+    Args:
+        source (Path): Stored audio file
+        content_hash (str): Its content hash (names the rendition directory)
+
+    Returns:
+        Path: The master playlist
+
+    Raises:
+        subprocess.CalledProcessError: If FFmpeg fails
+    """
+    destination = rendition_dir(content_hash)
+    if has_renditions(content_hash):
+        return master_playlist_path(content_hash)
+    HLS_DIR.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(tempfile.mkdtemp(dir=HLS_DIR, prefix=f".{content_hash[:12]}."))
+    try:
+        subprocess.run(ffmpeg_command(source, work_dir, HLS_BITRATES), check=True, capture_output=True)
+        (work_dir / MASTER_PLAYLIST).write_text(master_playlist(HLS_BITRATES))
+        if destination.exists():
+            # Left over from an interrupted run (the master playlist is missing)
+            shutil.rmtree(destination)
+        try:
+            os.replace(work_dir, destination)
+        except OSError:
+            # Another worker finished the same ladder first
+            if not has_renditions(content_hash):
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return master_playlist_path(content_hash)
+
+def remove_renditions(content_hash: Optional[str]):
+    if content_hash and CONTENT_HASH.match(content_hash):
+        shutil.rmtree(rendition_dir(content_hash), ignore_errors=True)
+
+class HlsTranscoder:
+    """Bounded queue of FFmpeg transcodes, deduplicated by content hash."""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def submit(self, source_path: str, content_hash: Optional[str]) -> bool:
+        """Queue the ladder of a stored file; False if there is nothing to do."""
+        if not content_hash or has_renditions(content_hash):
+            return False
+        with self._lock:
+            if content_hash in self._in_flight:
+                return False
+            self._in_flight.add(content_hash)
+            if self._executor is None:
+                # Each worker drives one FFmpeg process
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hls")
+            self._executor.submit(self._run, Path(source_path), content_hash)
+        return True
+
+    def _run(self, source: Path, content_hash: str):
+        try:
+            transcode_renditions(source, content_hash)
+            logger.info(f"HLS renditions ready for {content_hash[:12]}")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"HLS transcoding failed for {content_hash[:12]}: {e.stderr.decode(errors='replace')[-500:]}")
+        except Exception as e:
+            logger.error(f"HLS transcoding failed for {content_hash[:12]}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(content_hash)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+hls_transcoder = HlsTranscoder(max_workers=HLS_WORKERS)
@@ -0,0 +1,338 @@
+"""
+Integrity scrubbing of stored audio.
+
+Every download records the size and SHA-256 of its stored file. The disk
+status checks compare sizes with a stat() call, which catches missing, empty
+and truncated files for free; a file of the right size with damaged content
+can only be found by reading it. The scrubber does that in the background:
+it re-hashes the downloaded files never verified first, then those verified
+longest ago, once per ``INTEGRITY_SCRUB_REVERIFY_INTERVAL``.
+
+The scrub is meant to run all the time over a large library without being
+noticed:
+
+- reads are rate-limited to ``INTEGRITY_SCRUB_READ_RATE`` bytes per second;
+- the scrubber thread runs at idle I/O priority and lowest CPU priority
+  (Linux), so any other disk access goes first;
+- pages it has read are dropped from the page cache, which keeps the cache
+  for the files being streamed;
+- a file shared by several audio files is read once, and only one worker
+  scrubs at a time.
+
+A file whose size or hash does not match is deleted and its audio files
+marked ``corrupted`` (the file cannot be deduplicated onto by a later
+download). With ``INTEGRITY_AUTO_REDOWNLOAD`` a download job is queued for
+each of them, with the usual retries.
+"""
+import ctypes
+import hashlib
+import logging
+import os
+import platform
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src.database import SessionLocal
+from src.models import AudioFileDB, ExtractionCacheDB
+from src.storage import STORAGE_CHUNK_SIZE, blob_lock_name, remove_blob
+from src.hls import content_hash_of, remove_renditions
+from src.waveform import remove_waveform
+from src.disk_status import disk_status, reconciler, stat_regular_file
+from src.file_cache import audio_file_cache
+from src.locks import advisory_lock, try_advisory_lock
+from src.events import publish_status
+from src.metrics import INTEGRITY_BYTES, INTEGRITY_CHECKS
+from src.jobs import submit_redownloads
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INTEGRITY_SCRUB_ENABLED = os.getenv("INTEGRITY_SCRUB_ENABLED", "true").lower() == "true"
+# Read budget of the scrubber in bytes per second; 0 reads as fast as the disk allows
+INTEGRITY_SCRUB_READ_RATE = int(os.getenv("INTEGRITY_SCRUB_READ_RATE", str(16 * 1024 * 1024)))
+# Seconds after which a verified file is verified again
+INTEGRITY_SCRUB_REVERIFY_INTERVAL = float(os.getenv("INTEGRITY_SCRUB_REVERIFY_INTERVAL", str(30 * 24 * 3600)))
+# Seconds between checks for due files once every file is verified
+INTEGRITY_SCRUB_INTERVAL = float(os.getenv("INTEGRITY_SCRUB_INTERVAL", "60"))
+# Stored files verified per pass
+INTEGRITY_SCRUB_BATCH_SIZE = int(os.getenv("INTEGRITY_SCRUB_BATCH_SIZE", "100"))
+# Queue a download job for every audio file found corrupted
+INTEGRITY_AUTO_REDOWNLOAD = os.getenv("INTEGRITY_AUTO_REDOWNLOAD", "false").lower() == "true"
+
+# ioprio_set(2) syscall numbers; Python has no wrapper
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "aarch64": 30, "i386": 289, "i686": 289, "armv7l": 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+def lower_io_priority() -> bool:
+    """
+    Move the calling thread to idle I/O priority and lowest CPU priority.
+
+    Linux only, and the I/O class is only honoured by the BFQ scheduler; the
+    nice value also lowers the thread's default I/O priority elsewhere.
+
+    Returns:
+        bool: Whether the idle I/O class was set
+    """
+    if platform.system() != "Linux":
+        return False
+    try:
+        # On Linux the nice value is per thread
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except OSError as e:
+        logger.debug(f"Could not lower the scrubber's CPU priority: {e}")
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        return False
+    # Pid 0 is the calling thread
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        logger.debug(f"Could not set idle I/O priority: {os.strerror(ctypes.get_errno())}")
+        return False
+    return True
+
+class RateLimiter:
+    """Token bucket holding up to one second of reads."""
+
+    def __init__(self, rate: int, stop: threading.Event):
+        self.rate = rate
+        self._stop = stop
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+
+    def consume(self, amount: int) -> bool:
+        """Wait until ``amount`` bytes may be read; False if the scrubber is stopping."""
+        if self.rate <= 0:
+            return not self._stop.is_set()
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate) - amount
+        self._updated = now
+        if self._tokens < 0:
+            return not self._stop.wait(-self._tokens / self.rate)
+        return not self._stop.is_set()
+
+def hash_file_throttled(path: str, limiter: RateLimiter) -> Optional[str]:
+    """
+    SHA-256 of a file read through the rate limiter, leaving the page cache as it was.
+
+    Returns:
+        str: The hex digest, or None if the scrubber stopped while reading
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(STORAGE_CHUNK_SIZE)
+    view = memoryview(buffer)
+    advise = hasattr(os, "posix_fadvise")
+    with open(path, "rb", buffering=0) as file:
+        fd = file.fileno()
+        if advise:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        offset = 0
+        while True:
+            if not limiter.consume(STORAGE_CHUNK_SIZE):
+                return None
+            read = file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+            if advise:
+                # Scrubbed files would otherwise push the files being streamed out of the cache
+                os.posix_fadvise(fd, offset, read, os.POSIX_FADV_DONTNEED)
+            offset += read
+            INTEGRITY_BYTES.inc(amount=read)
+    return digest.hexdigest()
+
+def verify_file(path: str, size: Optional[int], content_hash: Optional[str], limiter: RateLimiter) -> Optional[str]:
+    """
+    Check a stored file against its recorded size and SHA-256.
+
+    Args:
+        path (str): Stored file
+        size (int): Recorded size; None skips the size check
+        content_hash (str): Recorded SHA-256; None (files stored before hashes were recorded) checks the size only
+        limiter (RateLimiter): Read budget
+
+    Returns:
+        str: ``ok``, ``corrupted`` or ``missing``; None if the check was
+            interrupted or the file was replaced while it was read
+    """
+    st = stat_regular_file(path)
+    status = disk_status(st, size)
+    if status == 'file_missing':
+        return 'missing'
+    if status == 'corrupted':
+        return 'corrupted'
+    if content_hash is None:
+        return 'ok'
+    try:
+        digest = hash_file_throttled(path, limiter)
+    except FileNotFoundError:
+        return 'missing'
+    if digest is None:
+        return None
+    after = stat_regular_file(path)
+    if after is None or (after.st_ino, after.st_mtime_ns) != (st.st_ino, st.st_mtime_ns):
+        # Re-downloaded or evicted meanwhile: the next pass checks the new state
+        return None
+    return 'ok' if digest == content_hash else 'corrupted'
+
+def due_files(db: Session, cutoff: datetime, limit: int) -> List[Tuple[str, Optional[int], Optional[str]]]:
+    """Stored files of downloaded audio files due for verification, as (path, size, content hash)."""
+    columns = (AudioFileDB.file_path, AudioFileDB.file_size_bytes, AudioFileDB.content_hash)
+    downloaded = db.query(*columns).filter(AudioFileDB.status == 'downloaded')
+    rows = downloaded.filter(AudioFileDB.verified_at.is_(None)).limit(limit).all()
+    if len(rows) < limit:
+        rows += (
+            downloaded.filter(AudioFileDB.verified_at < cutoff)
+            .order_by(AudioFileDB.verified_at)
+            .limit(limit - len(rows))
+            .all()
+        )
+    # Rows with identical audio share their stored file
+    files = {}
+    for file_path, size, content_hash in rows:
+        files.setdefault(file_path, (file_path, size, content_hash))
+    return list(files.values())
+
+def mark_verified(db: Session, file_path: str, verified_at: datetime) -> None:
+    table = AudioFileDB.__table__
+    db.execute(
+        update(table)
+        .where(table.c.file_path == file_path, table.c.status == 'downloaded')
+        # Verification is not a metadata change for updated_at or GET /sync
+        .values(verified_at=verified_at, updated_at=table.c.updated_at, change_version=table.c.change_version)
+    )
+    db.commit()
+
+def mark_corrupted(db: Session, file_path: str) -> List[int]:
+    """Delete a damaged stored file and mark every audio file using it as corrupted."""
+    # A download deduplicated onto the file links it under the same lock: it is either
+    # marked here or stores a fresh copy once the damaged one is gone
+    with advisory_lock(blob_lock_name(file_path)):
+        ids = [
+            audio_file_id for (audio_file_id,) in
+            db.query(AudioFileDB.id).filter(AudioFileDB.file_path == file_path, AudioFileDB.status == 'downloaded')
+        ]
+        if ids:
+            db.execute(
+                update(AudioFileDB)
+                .where(AudioFileDB.id.in_(ids), AudioFileDB.status == 'downloaded')
+                .values(status='corrupted')
+            )
+        # Deleted even when no downloaded row uses it any more: the extraction cache
+        # or a restore must not hand the file out again
+        db.query(ExtractionCacheDB).filter(ExtractionCacheDB.file_path == file_path).delete(synchronize_session=False)
+        db.commit()
+        # Derived from the damaged file, and keyed by the hash a re-download produces
+        remove_renditions(content_hash_of(file_path))
+        remove_waveform(content_hash_of(file_path))
+        # A later download of the same audio would otherwise be deduplicated onto it
+        remove_blob(file_path)
+    for audio_file_id in ids:
+        reconciler.invalidate(audio_file_id)
+        audio_file_cache.invalidate(audio_file_id)
+    publish_status(ids, 'corrupted')
+    return ids
+
+class IntegrityScrubber:
+    """Background thread re-hashing stored files at a throttled rate."""
+
+    def __init__(self, read_rate: int, reverify_interval: float, interval: float, batch_size: int, auto_redownload: bool):
+        self.reverify_interval = reverify_interval
+        self.interval = interval
+        self.batch_size = batch_size
+        self.auto_redownload = auto_redownload
+        self._stop = threading.Event()
+        self._limiter = RateLimiter(read_rate, self._stop)
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="integrity-scrub", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Interrupts the read in progress
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _loop(self):
+        lower_io_priority()
+        delay = self.interval
+        while not self._stop.wait(delay):
+            # A full batch means more files are due: go on right away
+            delay = 0 if self.run_once() >= self.batch_size else self.interval
+
+    def run_once(self) -> int:
+        """
+        Verify one batch of due files.
+
+        Returns:
+            int: Number of stored files verified or found corrupted
+        """
+        db = SessionLocal()
+        try:
+            with try_advisory_lock("integrity-scrub") as acquired:
+                # Another worker is already scrubbing
+                return self._scrub(db) if acquired else 0
+        except Exception as e:
+            logger.error(f"Integrity scrub pass failed: {e}")
+            db.rollback()
+            return 0
+        finally:
+            db.close()
+
+    def _scrub(self, db: Session) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=self.reverify_interval)
+        files = due_files(db, cutoff, self.batch_size)
+        # No transaction stays open while files are read
+        db.commit()
+        checked = 0
+        for file_path, size, content_hash in files:
+            result = verify_file(file_path, size, content_hash, self._limiter)
+            if result is None:
+                if self._stop.is_set():
+                    break
+                continue
+            INTEGRITY_CHECKS.inc(result)
+            if result == 'ok':
+                mark_verified(db, file_path, datetime.utcnow())
+            elif result == 'corrupted':
+                ids = mark_corrupted(db, file_path)
+                logger.warning(f"Stored file {file_path} is corrupted (audio files {ids})")
+            else:
+                # Missing files are left to the disk status reconciler
+                continue
+            checked += 1
+        if self.auto_redownload:
+            self.redownload_corrupted(db)
+        return checked
+
+    def redownload_corrupted(self, db: Session) -> int:
+        """Queue download jobs for corrupted audio files, including those found by the disk status checks."""
+        ids = [
+            audio_file_id for (audio_file_id,) in
+            db.query(AudioFileDB.id).filter(AudioFileDB.status == 'corrupted').limit(self.batch_size)
+        ]
+        db_jobs = submit_redownloads(db, ids) if ids else []
+        if db_jobs:
+            logger.info(f"Queued re-downloads of corrupted audio files {[db_job.audio_file_id for db_job in db_jobs]}")
+        return len(db_jobs)
+
+integrity_scrubber = IntegrityScrubber(
+    read_rate=INTEGRITY_SCRUB_READ_RATE,
+    reverify_interval=INTEGRITY_SCRUB_REVERIFY_INTERVAL,
+    interval=INTEGRITY_SCRUB_INTERVAL,
+    batch_size=INTEGRITY_SCRUB_BATCH_SIZE,
+    auto_redownload=INTEGRITY_AUTO_REDOWNLOAD,
+)
@@ -0,0 +1,554 @@
+"""
+Background download job queue.
+
+Downloads run on a bounded thread pool so yt-dlp and FFmpeg never block the
+event loop. Jobs are persisted in the ``download_jobs`` table and dispatched
+per source host, so a single slow upstream cannot take every worker. With
+``DOWNLOAD_EXECUTOR=process`` each worker thread hands its job to a process
+pool, so yt-dlp's CPU-bound extraction of large batches is not serialized by
+the GIL.
+
+Several API workers can share the job table: a job is claimed with a
+conditional update and runs under a per-video lock (a PostgreSQL advisory
+lock), so two workers never download the same video at the same time. A job
+whose video is already being downloaded is not waited for: it goes back to
+``retrying`` for ``DOWNLOAD_LOCK_RETRY_DELAY`` seconds, so waiting jobs hold
+neither a worker thread nor a database connection.
+
+A download that fails for a reason that may pass (a dropped connection, a
+flaky upstream) is retried: the job waits in ``retrying`` with an
+exponentially growing ``next_attempt_at``, then the retry scheduler queues it
+again. The next attempt continues the partial download kept in the video's
+staging directory. After ``DOWNLOAD_MAX_ATTEMPTS`` attempts the job fails.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+from src.database import SessionLocal
+from src.disk_status import stat_regular_file
+from src.file_cache import audio_file_cache
+from src.locks import advisory_lock, try_advisory_lock
+from src.events import publish_job, publish_status
+from src.models import AudioFileDB, DownloadJob, DownloadJobDB, IngestResponse
+from src.storage import DOWNLOAD_STAGING_TTL, blob_lock_name, sweep_staging
+from src.services import (
+    ACTIVE_JOB_STATUSES,
+    download_audio,
+    download_lock_name,
+    claim_download_job,
+    create_download_job,
+    defer_download_job,
+    create_ingest_jobs,
+    get_source_host,
+    expand_urls,
+    update_download_job,
+    get_unfinished_download_jobs,
+    is_retryable_download_error,
+    queue_due_retries,
+)
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Worker pool configuration
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+# "thread" runs downloads in the worker threads, "process" in a process pool
+DOWNLOAD_EXECUTOR = os.getenv("DOWNLOAD_EXECUTOR", "thread").lower()
+DOWNLOAD_HOST_CONCURRENCY = int(os.getenv("DOWNLOAD_HOST_CONCURRENCY", "2"))
+# Per-host overrides, e.g. "youtube.com=2,soundcloud.com=1"
+DOWNLOAD_HOST_LIMITS = os.getenv("DOWNLOAD_HOST_LIMITS", "")
+# Minimum seconds between two progress writes for the same job
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1.0"))
+# Attempts of a download job before it fails, and the backoff between them
+DOWNLOAD_MAX_ATTEMPTS = int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", "5"))
+DOWNLOAD_RETRY_DELAY = float(os.getenv("DOWNLOAD_RETRY_DELAY", "30"))
+DOWNLOAD_RETRY_MAX_DELAY = float(os.getenv("DOWNLOAD_RETRY_MAX_DELAY", "3600"))
+# Seconds between checks for retrying jobs that are due
+DOWNLOAD_RETRY_POLL_INTERVAL = float(os.getenv("DOWNLOAD_RETRY_POLL_INTERVAL", "5"))
+# Seconds a job waits while another job downloads the same video
+DOWNLOAD_LOCK_RETRY_DELAY = float(os.getenv("DOWNLOAD_LOCK_RETRY_DELAY", "10"))
+# Seconds between sweeps of abandoned staging directories
+DOWNLOAD_STAGING_SWEEP_INTERVAL = float(os.getenv("DOWNLOAD_STAGING_SWEEP_INTERVAL", "3600"))
+
+def parse_host_limits(value: str) -> Dict[str, int]:
+    """Parse a ``host=limit`` comma-separated list into a dict."""
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        host, limit = item.split("=", 1)
+        try:
+            limits[host.strip().lower()] = max(1, int(limit))
+        except ValueError:
+            logger.warning(f"Ignoring invalid download host limit: {item}")
+    return limits
+
+class DownloadJobManager:
+    """Dispatches persisted download jobs to a bounded worker pool."""
+
+    def __init__(self, max_workers: int, default_host_limit: int, host_limits: Dict[str, int], use_processes: bool = False):
+        self.max_workers = max_workers
+        self.default_host_limit = default_host_limit
+        self.host_limits = host_limits
+        self.use_processes = use_processes
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = defaultdict(deque)
+        self._active = defaultdict(int)
+
+    def host_limit(self, host: str) -> int:
+        for key, limit in self.host_limits.items():
+            if host == key or host.endswith("." + key):
+                return limit
+        return self.default_host_limit
+
+    def enqueue(self, job_id: int, url: str, host: str):
+        self.enqueue_many([(job_id, url, host)])
+
+    def enqueue_many(self, jobs: List[tuple]):
+        """Queue several ``(job_id, url, host)`` jobs and dispatch them at once."""
+        with self._lock:
+            for job_id, url, host in jobs:
+                self._pending[host].append((job_id, url))
+        self._dispatch()
+
+    def _dispatch(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="download-worker",
+                )
+            if self.use_processes and self._process_pool is None:
+                # spawn: never fork a process holding threads and pooled DB connections
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            for host, queue in self._pending.items():
+                while queue and self._active[host] < self.host_limit(host):
+                    job_id, url = queue.popleft()
+                    self._active[host] += 1
+                    self._executor.submit(self._run, job_id, url, host)
+
+    def _run(self, job_id: int, url: str, host: str):
+        try:
+            process_pool = self._process_pool
+            if process_pool is not None:
+                process_pool.submit(run_download_job, job_id, url).result()
+            else:
+                run_download_job(job_id, url)
+        except Exception as e:
+            # The worker process died (or the pool is shutting down)
+            logger.error(f"Download job {job_id} crashed: {e}")
+            db = SessionLocal()
+            try:
+                update_download_job(db, job_id, status='failed', error=str(e), finished_at=datetime.utcnow())
+            finally:
+                db.close()
+            with self._lock:
+                if self._process_pool is process_pool and getattr(process_pool, "_broken", False):
+                    self._process_pool = None
+        finally:
+            with self._lock:
+                self._active[host] -= 1
+            self._dispatch()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            process_pool, self._process_pool = self._process_pool, None
+            self._pending.clear()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if process_pool:
+            process_pool.shutdown(wait=False, cancel_futures=True)
+
+job_manager = DownloadJobManager(
+    max_workers=DOWNLOAD_WORKERS,
+    default_host_limit=DOWNLOAD_HOST_CONCURRENCY,
+    host_limits=parse_host_limits(DOWNLOAD_HOST_LIMITS),
+    use_processes=DOWNLOAD_EXECUTOR == "process",
+)
+
+def retry_delay(attempts: int) -> float:
+    """Backoff after the ``attempts``-th failed attempt, with jitter so retries of one host spread out."""
+    delay = min(DOWNLOAD_RETRY_DELAY * 2 ** (attempts - 1), DOWNLOAD_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.75, 1.0)
+
+class DownloadRetryScheduler:
+    """Queues retrying jobs once their backoff has elapsed and sweeps abandoned staging directories."""
+
+    def __init__(self, interval: float, sweep_interval: float, staging_ttl: float):
+        self.interval = interval
+        self.sweep_interval = sweep_interval
+        self.staging_ttl = staging_ttl
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_sweep = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="download-retries", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        db = SessionLocal()
+        try:
+            db_jobs = queue_due_retries(db, datetime.utcnow())
+            if db_jobs:
+                job_manager.enqueue_many([(db_job.id, db_job.url, db_job.source_host) for db_job in db_jobs])
+        except Exception as e:
+            logger.error(f"Queueing download retries failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            try:
+                removed = sweep_staging(self.staging_ttl)
+                if removed:
+                    logger.info(f"Removed {removed} abandoned download staging directories")
+            except OSError as e:
+                logger.error(f"Sweeping download staging directories failed: {e}")
+
+retry_scheduler = DownloadRetryScheduler(
+    interval=DOWNLOAD_RETRY_POLL_INTERVAL,
+    sweep_interval=DOWNLOAD_STAGING_SWEEP_INTERVAL,
+    staging_ttl=DOWNLOAD_STAGING_TTL,
+)
+
+def make_progress_hook(db: Session, job_id: int):
+    """Build a yt-dlp progress hook that records throttled progress on the job row."""
+    last_update = [0.0]
+
+    def hook(d: dict):
+        status = d.get("status")
+        if status == "downloading":
+            now = time.monotonic()
+            if now - last_update[0] < JOB_PROGRESS_INTERVAL:
+                return
+            last_update[0] = now
+            downloaded = d.get("downloaded_bytes")
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            progress = round(downloaded * 100.0 / total, 1) if downloaded and total else 0.0
+            update_download_job(
+                db, job_id,
+                downloaded_bytes=downloaded,
+                total_bytes=total,
+                progress=min(progress, 100.0),
+            )
+        elif status == "finished":
+            # Download is done, FFmpeg transcoding starts next
+            update_download_job(
+                db, job_id,
+                status='processing',
+                downloaded_bytes=d.get("downloaded_bytes") or d.get("total_bytes"),
+                progress=100.0,
+            )
+
+    return hook
+
+def run_download_job(job_id: int, url: str):
+    """Execute a single download job in a worker thread or process."""
+    db = SessionLocal()
+    db_audio_file = None
+    attempts = 0
+    try:
+        with try_advisory_lock(download_lock_name(url)) as acquired:
+            if not acquired:
+                # Another worker is downloading the same video: check again later
+                # instead of holding a thread and a connection while it finishes
+                next_attempt_at = datetime.utcnow() + timedelta(seconds=DOWNLOAD_LOCK_RETRY_DELAY)
+                if defer_download_job(db, job_id, next_attempt_at, "Waiting for another download of the same video"):
+                    logger.info(f"Download job {job_id} deferred: the same video is being downloaded")
+                return
+            db_job = claim_download_job(db, job_id)
+            if db_job is None:
+                logger.info(f"Download job {job_id} was already claimed by another worker")
+                return
+            attempts = db_job.attempts
+            if db_job.audio_file_id:
+                # Batch ingestion created the audio file row up front
+                db_audio_file = db.query(AudioFileDB).filter(AudioFileDB.id == db_job.audio_file_id).first()
+                if db_audio_file:
+                    db_audio_file.status = 'downloading'
+                    db.commit()
+                    publish_status([db_audio_file.id], 'downloading')
+            audio_file = download_audio(
+                url, db,
+                existing_audio_file=db_audio_file,
+                progress_hook=make_progress_hook(db, job_id),
+            )
+            update_download_job(
+                db, job_id,
+                status='completed',
+                progress=100.0,
+                audio_file_id=audio_file.id,
+                finished_at=datetime.utcnow(),
+            )
+    except Exception as e:
+        db.rollback()
+        if attempts and attempts < DOWNLOAD_MAX_ATTEMPTS and is_retryable_download_error(e):
+            # The audio file stays downloading; the partial download is kept for the next attempt
+            delay = retry_delay(attempts)
+            logger.warning(
+                f"Download job {job_id} failed (attempt {attempts} of {DOWNLOAD_MAX_ATTEMPTS}), "
+                f"retrying in {delay:.0f} s: {e}"
+            )
+            update_download_job(
+                db, job_id,
+                status='retrying',
+                error=str(e),
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+            )
+            return
+        logger.error(f"Download job {job_id} failed: {e}")
+        if db_audio_file is not None:
+            db_audio_file.status = 'download_failed'
+        update_download_job(db, job_id, status='failed', error=str(e), finished_at=datetime.utcnow())
+        if db_audio_file is not None:
+            publish_status([db_audio_file.id], 'download_failed')
+    finally:
+        db.close()
+
+async def submit_download_job(db: AsyncSession, url: str) -> DownloadJob:
+    """Persist a new download job and queue it for the worker pool."""
+    db_job = await create_download_job(db, url)
+    job_manager.enqueue(db_job.id, db_job.url, db_job.source_host)
+    return DownloadJob.from_orm(db_job)
+
+def relink_evicted_file(audio_file_id: int, file_path: str, file_size: int) -> bool:
+    """Flip an evicted row back to downloaded if its stored file is (still) on disk."""
+    # Under the file's lock: eviction cannot delete it between the check and the update
+    with advisory_lock(blob_lock_name(file_path)):
+        st = stat_regular_file(file_path)
+        if st is None or st.st_size != file_size:
+            return False
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                update(AudioFileDB)
+                .where(AudioFileDB.id == audio_file_id, AudioFileDB.status == 'evicted')
+                .values(status='downloaded')
+            )
+            db.commit()
+            return result.rowcount == 1
+        finally:
+            db.close()
+
+async def submit_restore(db: AsyncSession, db_audio_file: AudioFileDB) -> Optional[DownloadJob]:
+    """
+    Bring an evicted audio file back.
+
+    Relinks the stored file when identical audio was downloaded again in the
+    meantime, otherwise queues a download job for the existing row. Only the
+    caller that flips the row out of ``evicted`` queues the job.
+
+    Args:
+        db (AsyncSession): Database session
+        db_audio_file (AudioFileDB): The evicted audio file
+
+    Returns:
+        DownloadJob: The queued job, or None if the file was relinked or is
+            already being restored
+    """
+    audio_file_id = db_audio_file.id
+    if await run_in_threadpool(relink_evicted_file, audio_file_id, db_audio_file.file_path, db_audio_file.file_size_bytes):
+        # Updated on another session
+        await db.refresh(db_audio_file)
+        audio_file_cache.invalidate(audio_file_id)
+        publish_status([audio_file_id], 'downloaded')
+        return None
+    result = await db.execute(
+        update(AudioFileDB)
+        .where(AudioFileDB.id == audio_file_id, AudioFileDB.status == 'evicted')
+        .values(status='downloading')
+    )
+    if result.rowcount != 1:
+        await db.commit()
+        audio_file_cache.invalidate(audio_file_id)
+        return None
+    db_job = DownloadJobDB(
+        url=db_audio_file.original_url,
+        source_host=get_source_host(db_audio_file.original_url),
+        status='queued',
+        progress=0.0,
+        audio_file_id=audio_file_id,
+    )
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    audio_file_cache.invalidate(audio_file_id)
+    publish_status([audio_file_id], 'downloading')
+    publish_job("job.created", db_job)
+    job_manager.enqueue(db_job.id, db_job.url, db_job.source_host)
+    return DownloadJob.from_orm(db_job)
+
+async def submit_redownload(db: AsyncSession, db_audio_file: AudioFileDB) -> Optional[DownloadJob]:
+    """
+    Queue a download job that fetches an audio file again into its existing row.
+
+    The job runs with the usual per-video lock, retries and resumption. Only
+    the caller that flips the row to ``downloading`` queues a job; a file
+    already being downloaded returns its active job.
+
+    Args:
+        db (AsyncSession): Database session
+        db_audio_file (AudioFileDB): The audio file to download again
+
+    Returns:
+        DownloadJob: The queued (or already active) job, or None if the file
+            is being downloaded by a job not attached to it
+    """
+    audio_file_id = db_audio_file.id
+    result = await db.execute(
+        update(AudioFileDB)
+        .where(AudioFileDB.id == audio_file_id, AudioFileDB.status != 'downloading')
+        .values(status='downloading')
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        active = await db.execute(
+            select(DownloadJobDB)
+            .where(DownloadJobDB.audio_file_id == audio_file_id, DownloadJobDB.status.in_(ACTIVE_JOB_STATUSES))
+            .order_by(DownloadJobDB.id.desc())
+            .limit(1)
+        )
+        db_job = active.scalar_one_or_none()
+        return DownloadJob.from_orm(db_job) if db_job else None
+    db_job = DownloadJobDB(
+        url=db_audio_file.original_url,
+        source_host=get_source_host(db_audio_file.original_url),
+        status='queued',
+        progress=0.0,
+        audio_file_id=audio_file_id,
+    )
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    audio_file_cache.invalidate(audio_file_id)
+    publish_status([audio_file_id], 'downloading')
+    publish_job("job.created", db_job)
+    job_manager.enqueue(db_job.id, db_job.url, db_job.source_host)
+    return DownloadJob.from_orm(db_job)
+
+def submit_redownloads(db: Session, audio_file_ids: List[int]) -> List[DownloadJobDB]:
+    """
+    Queue a download job for each corrupted audio file, reusing its row.
+
+    Only the caller that flips a row out of ``corrupted`` queues its job.
+
+    Args:
+        db (Session): Database session
+        audio_file_ids (list): Ids of corrupted audio files
+
+    Returns:
+        list: The queued jobs
+    """
+    db_jobs = []
+    for db_audio_file in db.query(AudioFileDB).filter(AudioFileDB.id.in_(audio_file_ids)):
+        result = db.execute(
+            update(AudioFileDB)
+            .where(AudioFileDB.id == db_audio_file.id, AudioFileDB.status == 'corrupted')
+            .values(status='downloading')
+        )
+        if result.rowcount != 1:
+            continue
+        db_jobs.append(DownloadJobDB(
+            url=db_audio_file.original_url,
+            source_host=get_source_host(db_audio_file.original_url),
+            status='queued',
+            progress=0.0,
+            audio_file_id=db_audio_file.id,
+        ))
+    if not db_jobs:
+        db.rollback()
+        return []
+    db.add_all(db_jobs)
+    db.commit()
+    ids = [db_job.audio_file_id for db_job in db_jobs]
+    for audio_file_id in ids:
+        audio_file_cache.invalidate(audio_file_id)
+    publish_status(ids, 'downloading')
+    for db_job in db_jobs:
+        publish_job("job.created", db_job)
+    job_manager.enqueue_many([(db_job.id, db_job.url, db_job.source_host) for db_job in db_jobs])
+    return db_jobs
+
+async def submit_ingest(db: AsyncSession, urls: List[str]) -> IngestResponse:
+    """
+    Expand video, playlist and channel URLs and queue a job for every new video.
+    
+    Args:
+        db (AsyncSession): Database session
+        urls (list): URLs to ingest
+    
+    Returns:
+        IngestResponse: Counts, queued jobs, skipped duplicates and expansion errors
+    """
+    # Flat extraction is blocking network I/O
+    entries, errors = await run_in_threadpool(expand_urls, urls)
+    db_jobs, skipped = await create_ingest_jobs(db, entries)
+    job_manager.enqueue_many([(db_job.id, db_job.url, db_job.source_host) for db_job in db_jobs])
+    return IngestResponse(
+        entries=len(entries),
+        queued=len(db_jobs),
+        skipped=skipped,
+        errors=errors,
+        jobs=[DownloadJob.from_orm(db_job) for db_job in db_jobs],
+    )
+
+def recover_download_jobs():
+    """
+    Re-queue jobs interrupted by a restart.
+
+    With several workers, only one recovers at a time, and running jobs are
+    only reset when no worker holds their download lock (it would be running
+    them). A job queued in more than one worker still runs once: only one
+    worker can claim it.
+    """
+    db = SessionLocal()
+    try:
+        with try_advisory_lock("recover-download-jobs") as acquired:
+            if not acquired:
+                return
+            for db_job in get_unfinished_download_jobs(db):
+                if db_job.status == 'retrying':
+                    # The retry scheduler queues it when it is due
+                    continue
+                if db_job.status != 'queued':
+                    with try_advisory_lock(download_lock_name(db_job.url)) as idle:
+                        if not idle:
+                            continue
+                        update_download_job(db, db_job.id, status='queued', progress=0.0)
+                job_manager.enqueue(db_job.id, db_job.url, db_job.source_host)
+    finally:
+        db.close()
@@ -0,0 +1,106 @@
+"""
+Schema migrations at startup and readiness.
+
+Every API worker calls ``run_migrations`` while starting. The first one to
+take the ``migrations`` lock runs ``alembic upgrade head``; the others wait
+for it and then find the schema at head, so DDL never runs twice
+concurrently. ``/ready`` reports whether this worker has finished starting,
+the database answers and its schema is at the revision this code expects;
+``/health`` only reports that the process is alive.
+"""
+import logging
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from src.database import DATABASE_ERRORS, create_tables, engine
+from src.locks import advisory_lock
+from src.storage import DOWNLOADS_DIR
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Run `alembic upgrade head` at startup; disable when a release step migrates
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+ALEMBIC_DIR = Path(__file__).resolve().parent.parent / "alembic"
+
+_started = threading.Event()
+
+def alembic_config() -> Config:
+    # No ini file: alembic.ini's logging setup would replace the application's
+    config = Config()
+    config.set_main_option("script_location", str(ALEMBIC_DIR))
+    return config
+
+@lru_cache(maxsize=1)
+def head_revision() -> Optional[str]:
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+def current_revision(connection) -> Optional[str]:
+    return MigrationContext.configure(connection).get_current_revision()
+
+def run_migrations():
+    """
+    Bring the database schema to head, once across all workers.
+
+    A database created by ``create_all`` (``init_db.py`` or an older
+    release) has tables but no Alembic revision. Upgrading it would fail, so
+    only missing tables are created and the operator has to stamp it.
+    """
+    with advisory_lock("migrations"):
+        with engine.connect() as connection:
+            revision = current_revision(connection)
+            unversioned = revision is None and inspect(connection).has_table("audio_files")
+        if unversioned:
+            logger.error(
+                "The database schema is not versioned by Alembic; stamp it with the revision "
+                "it matches (`alembic stamp 0001` for the initial tables) and run `alembic upgrade head`. "
+                "Creating missing tables only."
+            )
+            create_tables()
+            return
+        if revision != head_revision():
+            logger.info(f"Upgrading database schema from {revision} to {head_revision()}")
+            command.upgrade(alembic_config(), "head")
+
+def mark_started():
+    _started.set()
+
+def mark_stopping():
+    """Report not ready while shutting down, so load balancers drain this worker."""
+    _started.clear()
+
+async def check_readiness(db: AsyncSession) -> Tuple[bool, Dict[str, str]]:
+    """
+    Check whether this worker can serve traffic.
+
+    Args:
+        db (AsyncSession): Database session
+
+    Returns:
+        tuple: ``(ready, checks)`` with the outcome of every check by name
+    """
+    checks = {"startup": "ok" if _started.is_set() else "starting"}
+    try:
+        revision = await db.run_sync(lambda session: current_revision(session.connection()))
+        checks["database"] = "ok"
+        if revision == head_revision():
+            checks["schema"] = "ok"
+        else:
+            checks["schema"] = f"at revision {revision}, expected {head_revision()}"
+    except DATABASE_ERRORS:
+        checks["database"] = "unavailable"
+        checks["schema"] = "unknown"
+    checks["storage"] = "ok" if os.access(DOWNLOADS_DIR, os.W_OK) else f"{DOWNLOADS_DIR} is not writable"
+    return all(value == "ok" for value in checks.values()), checks
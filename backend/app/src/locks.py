@@ -0,0 +1,84 @@
+"""
+Named locks shared by every worker process.
+
+On PostgreSQL a lock is a session-level advisory lock held on a dedicated
+connection for as long as the ``with`` block runs. It covers every process
+(and host) using the database and is released by the server if its holder
+dies. Other databases only support a single API process, so the locks are
+process-local there.
+"""
+import hashlib
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Iterator
+from sqlalchemy import func, select
+from src.database import engine
+
+logger = logging.getLogger(__name__)
+
+_local_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+_local_locks_guard = threading.Lock()
+
+def lock_key(name: str) -> int:
+    """Signed 64-bit advisory lock key of a lock name."""
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big", signed=True)
+
+def uses_advisory_locks() -> bool:
+    return engine.dialect.name == "postgresql"
+
+def _local_lock(name: str) -> threading.Lock:
+    with _local_locks_guard:
+        lock = _local_locks.get(name)
+        if lock is None:
+            lock = _local_locks[name] = threading.Lock()
+        return lock
+
+@contextmanager
+def _advisory_lock(name: str, blocking: bool) -> Iterator[bool]:
+    key = lock_key(name)
+    with engine.connect() as connection:
+        if blocking:
+            connection.execute(select(func.pg_advisory_lock(key)))
+            acquired = True
+        else:
+            acquired = connection.execute(select(func.pg_try_advisory_lock(key))).scalar()
+        # The lock belongs to the session: do not sit idle in a transaction while holding it
+        connection.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    connection.execute(select(func.pg_advisory_unlock(key)))
+                    connection.commit()
+                except Exception as e:
+                    # Never return a connection that may still hold the lock to the pool
+                    logger.error(f"Releasing lock {name!r} failed: {e}")
+                    connection.invalidate()
+
+@contextmanager
+def advisory_lock(name: str) -> Iterator[None]:
+    """Hold the named lock, waiting for it if another worker holds it."""
+    if not uses_advisory_locks():
+        with _local_lock(name):
+            yield
+        return
+    with _advisory_lock(name, blocking=True):
+        yield
+
+@contextmanager
+def try_advisory_lock(name: str) -> Iterator[bool]:
+    """Take the named lock if it is free; yields whether it was acquired."""
+    if not uses_advisory_locks():
+        lock = _local_lock(name)
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+    with _advisory_lock(name, blocking=False) as acquired:
+        yield acquired
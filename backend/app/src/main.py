@@ -1,8 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from src.routes import router
-from src.database import create_tables
-from src.models import Base
+from src.database import async_engine, engine
+from src.jobs import job_manager, recover_download_jobs, retry_scheduler
+from src.disk_status import reconciler
+from src.hls import hls_transcoder
+from src.waveform import waveform_analyzer
+from src.storage_quota import storage_manager
+from src.metrics import CONTENT_TYPE, METRICS_ENABLED, MetricsMiddleware, render_metrics
+from src.lifecycle import DB_MIGRATE_ON_STARTUP, mark_started, mark_stopping, run_migrations
+from src.storage import DOWNLOADS_DIR
+from src.events import event_bus
+from src.transcriber import recover_transcription_jobs, transcription_manager
+from src.integrity import INTEGRITY_SCRUB_ENABLED, integrity_scrubber
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -15,10 +26,16 @@ APP_VERSION = os.getenv("APP_VERSION", "1.0.0")
 APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
 APP_PORT = int(os.getenv("APP_PORT", "8000"))
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+# Worker processes started by `python -m src.main` (0 = one per CPU core)
+APP_WORKERS = int(os.getenv("APP_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))) or os.cpu_count() or 1
+# Seconds to wait for open connections (/events streams never end) when stopping
+APP_SHUTDOWN_TIMEOUT = int(os.getenv("APP_SHUTDOWN_TIMEOUT", "10"))
 
 # CORS configuration
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title=APP_TITLE, version=APP_VERSION, debug=DEBUG)
 
 # Add CORS middleware
@@ -28,21 +45,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link"],
 )
 
+# Time every request and count its database queries (outermost, so CORS is included)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Include router
 app.include_router(router, prefix="/api/v1")
 
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        """Prometheus text exposition of this process's metrics"""
+        return Response(render_metrics(), media_type=CONTENT_TYPE)
+
 @app.on_event("startup")
 async def startup_event():
-    # Create database tables
-    create_tables()
+    # Bring the schema to head; with several workers only the first one migrates
+    if DB_MIGRATE_ON_STARTUP:
+        run_migrations()
+    if APP_WORKERS > 1 and engine.dialect.name != "postgresql":
+        logger.warning("Several workers need PostgreSQL: download locks only hold within a process on other databases")
+    DOWNLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    # Share change events and cache invalidations with the other workers (PostgreSQL LISTEN/NOTIFY)
+    event_bus.start()
+    # Resume download jobs interrupted by the previous shutdown
+    recover_download_jobs()
+    recover_transcription_jobs()
+    # Queue failed downloads again after their backoff, sweep abandoned partial downloads
+    retry_scheduler.start()
+    # Keep audio file statuses in sync with the disk in the background
+    reconciler.start()
+    # Record plays and keep stored audio within the quota
+    storage_manager.start()
+    # Re-hash stored audio at a throttled rate to find damaged files
+    if INTEGRITY_SCRUB_ENABLED:
+        integrity_scrubber.start()
+    mark_started()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    mark_stopping()
+    retry_scheduler.stop()
+    job_manager.shutdown()
+    transcription_manager.shutdown()
+    hls_transcoder.shutdown()
+    waveform_analyzer.shutdown()
+    reconciler.stop()
+    storage_manager.stop()
+    integrity_scrubber.stop()
+    event_bus.stop()
+    await async_engine.dispose()
 
 if __name__ == "__main__":
     import uvicorn
+    # An import string lets uvicorn start the worker processes
     uvicorn.run(
-        app, 
-        host=APP_HOST, 
+        "src.main:app",
+        host=APP_HOST,
         port=APP_PORT,
-        reload=DEBUG
+        reload=DEBUG,
+        workers=None if DEBUG else APP_WORKERS,
+        timeout_graceful_shutdown=APP_SHUTDOWN_TIMEOUT,
     ) 
\ No newline at end of file
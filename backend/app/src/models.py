@@ -1,12 +1,40 @@
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Text, BigInteger, DateTime, DECIMAL, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, BigInteger, DateTime, DECIMAL, Float, ForeignKey, Index, text
 from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 # SQLAlchemy Base
 Base = declarative_base()
 
+class next_change_version(FunctionElement):
+    """
+    Change sequence number stamped on every audio file write and tombstone.
+
+    Numbers only grow in commit-visible order, which is what ``GET /sync``
+    needs: a client that has seen everything below its token misses nothing
+    by asking for the rows at or above it.
+    """
+    type = BigInteger()
+    inherit_cache = True
+
+@compiles(next_change_version, "postgresql")
+def _next_change_version_postgresql(element, compiler, **kw):
+    # The writing transaction's id; transactions still running when a sync
+    # reads keep ids at or above its snapshot's xmin
+    return "pg_current_xact_id()::text::bigint"
+
+@compiles(next_change_version)
+def _next_change_version(element, compiler, **kw):
+    # SQLite serializes writers, so one above every stamped row is unique
+    return (
+        "(SELECT coalesce(max(v), 0) + 1 FROM ("
+        "SELECT max(change_version) AS v FROM audio_files "
+        "UNION ALL SELECT max(change_version) FROM audio_file_tombstones))"
+    )
+
 # SQLAlchemy Database Models
 class AudioFileDB(Base):
     __tablename__ = "audio_files"
@@ -14,18 +42,58 @@ class AudioFileDB(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255), nullable=False)
     original_url = Column(Text, nullable=False)
+    video_id = Column(String(64))
     title = Column(String(500))
     episode_number = Column(Integer)
     series_name = Column(String(255))
     duration_seconds = Column(Integer)
     file_size_bytes = Column(BigInteger)
     file_path = Column(String(500), nullable=False)
+    content_hash = Column(String(64))  # SHA-256 of the stored audio
+    loudness_lufs = Column(Float)  # BS.1770 integrated loudness, set by waveform analysis
+    last_played_at = Column(DateTime)  # Last /stream request, orders quota eviction
+    verified_at = Column(DateTime)  # Last time the integrity scrubber hashed the stored file
     status = Column(String(50), default='not_downloaded')
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set on every write except play timestamps, read by GET /sync
+    change_version = Column(
+        BigInteger, nullable=False, server_default="0", default=next_change_version(), onupdate=next_change_version()
+    )
     
     # Relationship
     transcriptions = relationship("TranscriptionDB", back_populates="audio_file", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("idx_audio_files_filename", "filename", unique=True),
+        Index("idx_audio_files_episode", "episode_number"),
+        Index("idx_audio_files_video_id", "video_id"),
+        Index("idx_audio_files_original_url", "original_url"),
+        # Stored files are shared between rows with identical audio
+        Index("idx_audio_files_file_path", "file_path"),
+        Index("idx_audio_files_series", "series_name"),
+        # Keyset pagination indexes for GET /audio-files
+        Index("idx_audio_files_created_at_id", "created_at", "id"),
+        Index("idx_audio_files_updated_at_id", "updated_at", "id"),
+        Index("idx_audio_files_status_created_at_id", "status", "created_at", "id"),
+        Index("idx_audio_files_series_created_at_id", "series_name", "created_at", "id"),
+        # Delta sync index for GET /sync
+        Index("idx_audio_files_change_version_id", "change_version", "id"),
+        # Integrity scrubber: downloaded files least recently verified first
+        Index("idx_audio_files_status_verified_at", "status", "verified_at"),
+    )
+
+class AudioFileTombstoneDB(Base):
+    __tablename__ = "audio_file_tombstones"
+    
+    # One row per deleted audio file, so GET /sync can report deletions
+    audio_file_id = Column(Integer, primary_key=True)
+    change_version = Column(BigInteger, nullable=False, default=next_change_version())
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("idx_audio_file_tombstones_change_version_id", "change_version", "audio_file_id"),
+    )
 
 class TranscriptionDB(Base):
     __tablename__ = "transcriptions"
@@ -44,6 +112,95 @@ class TranscriptionDB(Base):
     
     # Relationship
     audio_file = relationship("AudioFileDB", back_populates="transcriptions")
+    
+    __table_args__ = (
+        # Windowed segment lookups for synchronized subtitles
+        Index("idx_transcriptions_file_language_start", "audio_file_id", "language", "start_time_seconds"),
+    )
+
+class DownloadJobDB(Base):
+    __tablename__ = "download_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    url = Column(Text, nullable=False)
+    source_host = Column(String(255), index=True)
+    status = Column(String(50), default='queued', index=True)  # queued, downloading, processing, retrying, completed, failed
+    progress = Column(Float, default=0.0)  # 0.0 to 100.0
+    downloaded_bytes = Column(BigInteger)
+    total_bytes = Column(BigInteger)
+    audio_file_id = Column(Integer, ForeignKey("audio_files.id", ondelete="SET NULL"))
+    error = Column(Text)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)  # Download attempts started
+    next_attempt_at = Column(DateTime, index=True)  # When a retrying job is queued again
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class TranscriptionJobDB(Base):
+    __tablename__ = "transcription_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    audio_file_id = Column(Integer, ForeignKey("audio_files.id", ondelete="CASCADE"), nullable=False)
+    language = Column(String(10), nullable=False)
+    status = Column(String(50), default='queued', index=True)  # queued, running, completed, failed
+    progress = Column(Float, default=0.0)  # 0.0 to 100.0
+    # Finished chunks are only reused with the audio, engine and windows that produced them
+    content_hash = Column(String(64))
+    engine = Column(String(200), nullable=False)
+    chunk_seconds = Column(Float, nullable=False)
+    overlap_seconds = Column(Float, nullable=False)
+    chunks_total = Column(Integer)
+    chunks_done = Column(Integer, default=0)
+    segments = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("idx_transcription_jobs_file_language", "audio_file_id", "language"),
+        # At most one queued or running job per file and language, whichever worker queues it
+        Index(
+            "uq_transcription_jobs_active",
+            "audio_file_id",
+            "language",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+            sqlite_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+
+class TranscriptionChunkDB(Base):
+    __tablename__ = "transcription_chunks"
+    
+    # Output of one finished window of a job, kept until the job completes
+    job_id = Column(Integer, ForeignKey("transcription_jobs.id", ondelete="CASCADE"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    start_seconds = Column(Float, nullable=False)
+    end_seconds = Column(Float, nullable=False)
+    segments = Column(Text, nullable=False)  # JSON list of [start, end, text, confidence]
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ExtractionCacheDB(Base):
+    __tablename__ = "extraction_cache"
+    
+    # SHA-256 of the extractor, video id and audio format settings
+    cache_key = Column(String(64), primary_key=True)
+    extractor = Column(String(64), nullable=False)
+    video_id = Column(String(64), nullable=False)
+    info = Column(Text, nullable=False)  # JSON subset of the yt-dlp info dict
+    file_path = Column(String(500), nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    size_bytes = Column(BigInteger, nullable=False)
+    hit_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        Index("idx_extraction_cache_file_path", "file_path"),
+    )
 
 # Pydantic Models for API
 class YouTubeURL(BaseModel):
@@ -55,19 +212,75 @@ class AudioResponse(BaseModel):
     filename: str
     path: str
 
+class DownloadJob(BaseModel):
+    id: int
+    url: str
+    source_host: Optional[str] = None
+    status: str
+    progress: float = 0.0
+    downloaded_bytes: Optional[int] = None
+    total_bytes: Optional[int] = None
+    audio_file_id: Optional[int] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class IngestRequest(BaseModel):
+    urls: List[str]
+
+class IngestResponse(BaseModel):
+    entries: int
+    queued: int
+    skipped: List[str] = []
+    errors: List[str] = []
+    jobs: List[DownloadJob] = []
+
 class HealthResponse(BaseModel):
     status: str
 
+class ReadinessResponse(BaseModel):
+    status: str  # ready or not_ready
+    checks: Dict[str, str]
+
+class TranscriptionJob(BaseModel):
+    id: int
+    audio_file_id: int
+    language: str
+    status: str
+    progress: float = 0.0
+    engine: str
+    chunks_total: Optional[int] = None
+    chunks_done: int = 0
+    segments: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
 class AudioFile(BaseModel):
     id: Optional[int] = None
     filename: str
     original_url: str
+    video_id: Optional[str] = None
     title: Optional[str] = None
     episode_number: Optional[int] = None
     series_name: Optional[str] = None
     duration_seconds: Optional[int] = None
     file_size_bytes: Optional[int] = None
     file_path: str
+    content_hash: Optional[str] = None
+    loudness_lufs: Optional[float] = None
+    last_played_at: Optional[datetime] = None
+    verified_at: Optional[datetime] = None
     status: str = 'not_downloaded'
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
@@ -75,6 +288,12 @@ class AudioFile(BaseModel):
     class Config:
         from_attributes = True
 
+class SyncResponse(BaseModel):
+    changes: List[AudioFile]  # Created or updated since the token
+    deleted: List[int]  # Ids of audio files deleted since the token
+    token: str  # Pass as `since` on the next request
+    has_more: bool  # Request again right away with the new token
+
 class Transcription(BaseModel):
     id: Optional[int] = None
     audio_file_id: int
@@ -91,16 +310,65 @@ class Transcription(BaseModel):
     class Config:
         from_attributes = True
 
+class TranscriptIngestResult(BaseModel):
+    audio_file_id: int
+    language: str
+    content_type: str
+    format: str
+    rows: int
+    seconds: float
+    rows_per_second: float
+
+class SearchHit(BaseModel):
+    match: str  # 'transcript' or 'title'
+    audio_file_id: int
+    filename: str
+    title: Optional[str] = None
+    transcription_id: Optional[int] = None
+    language: Optional[str] = None
+    content_type: Optional[str] = None
+    content: Optional[str] = None
+    start_time_seconds: Optional[float] = None
+    end_time_seconds: Optional[float] = None
+    rank: float = 0.0
+
+class StorageUsage(BaseModel):
+    quota_bytes: int  # 0 when no quota is configured
+    used_bytes: int
+    cache_only_bytes: int  # kept only for re-linking by the extraction cache
+    disk_free_bytes: int
+    downloaded_files: int
+    evicted_files: int
+    evicted_bytes: int
+
+class StorageStats(BaseModel):
+    # Counters of this process since it started
+    since: datetime
+    stream_hits: int
+    stream_misses: int  # requests for evicted files, each queuing a restore
+    hit_rate: Optional[float] = None
+    restores: int
+    evictions: int
+    evicted_bytes: int
+    metadata_cache_hits: int
+    metadata_cache_misses: int
+    extraction_cache_hits: int  # all time, from the extraction cache table
+
 class AudioFileWithTranscriptions(BaseModel):
     id: int
     filename: str
     original_url: str
+    video_id: Optional[str] = None
     title: Optional[str] = None
     episode_number: Optional[int] = None
     series_name: Optional[str] = None
     duration_seconds: Optional[int] = None
     file_size_bytes: Optional[int] = None
     file_path: str
+    content_hash: Optional[str] = None
+    loudness_lufs: Optional[float] = None
+    last_played_at: Optional[datetime] = None
+    verified_at: Optional[datetime] = None
     status: str
     created_at: datetime
     updated_at: datetime
@@ -1,284 +1,689 @@
-from fastapi import APIRouter, HTTPException, Request, Depends
-from fastapi.responses import StreamingResponse, FileResponse
-from typing import List
-import os
-from pathlib import Path
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import OperationalError
-from src.models import YouTubeURL, AudioResponse, HealthResponse, AudioFile, AudioFileWithTranscriptions
+from fastapi import APIRouter, HTTPException, Header, Request, Response, Depends, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
+from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from src.models import YouTubeURL, HealthResponse, ReadinessResponse, AudioFile, Transcription, TranscriptIngestResult, TranscriptionJob, SearchHit, DownloadJob, IngestRequest, IngestResponse, StorageStats, StorageUsage, SyncResponse
 from src.services import (
-    download_audio, 
-    get_downloaded_audio_files, 
+    list_audio_files_page,
     get_audio_file_by_id,
-    get_audio_file_by_filename,
+    resolve_audio_file,
     update_audio_file_status,
     delete_audio_file,
     get_audio_files_by_series,
     check_all_audio_files_status,
-    re_download_audio,
-    update_audio_file_status_from_disk
+    update_audio_file_status_from_disk,
+    get_download_job,
+    get_transcript_window,
+    get_audio_file_row,
+    AUDIO_FILES_PAGE_SIZE,
+    AUDIO_FILES_MAX_PAGE_SIZE,
+    AUDIO_FILES_MAX_STREAM_PAGE_SIZE,
+    AUDIO_FILE_FIELDS
 )
-from src.database import get_db, wait_for_database
+from src.jobs import submit_download_job, submit_ingest, submit_redownload, submit_restore
+from src.search import search, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from src.hls import MASTER_PLAYLIST, has_renditions, hls_transcoder, media_type_for, rendition_file
+from src.waveform import WAVEFORM_CACHE_CONTROL, has_waveform, waveform_analyzer, waveform_path
+from src.storage_quota import STORAGE_RESTORE_RETRY_AFTER, storage_manager
+from src.file_cache import ResolvedAudioFile, audio_file_cache
+from src.lifecycle import check_readiness
+from src.events import EVENTS_ENABLED, EVENT_TYPES, event_stream
+from src.serialization import MEDIA_TYPES, NDJSON_MEDIA_TYPE, STREAM_FORMATS, encode_rows
+from src.sync import SYNC_MAX_PAGE_SIZE, SYNC_PAGE_SIZE, get_changes
+from src.transcriber import TranscriptionUnavailable, get_transcription_job, submit_transcription
+from src.transcript_ingest import TRANSCRIPT_FORMATS, TranscriptParseError, detect_format, ingest_transcript
+from src.streaming import RangeNotSatisfiable, conditional_audio_response, etag_matches
+from src.database import get_async_db, DATABASE_ERRORS
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-def check_database_connection():
-    """Check if database is available and raise appropriate error if not."""
-    if not wait_for_database(max_retries=1, retry_interval=1):
+def audio_file_response(request: Request, audio_file: ResolvedAudioFile, headers: Optional[dict] = None) -> Response:
+    """Serve an audio file with caching validators, conditional requests and ranges."""
+    try:
+        return conditional_audio_response(request.headers, audio_file.file_path, headers=headers)
+    except RangeNotSatisfiable as e:
+        raise HTTPException(
+            status_code=416,
+            detail="Range Not Satisfiable",
+            headers={"Content-Range": f"bytes */{e.file_size}"}
+        )
+    except FileNotFoundError:
+        # Evicted, scrubbed or deleted since it was resolved: the retry re-reads
+        # the row, which restores the file or reports it gone
+        audio_file_cache.invalidate(audio_file.id)
         raise HTTPException(
-            status_code=503, 
-            detail="Database is not available. Please ensure PostgreSQL is running."
+            status_code=503,
+            detail="Audio file is no longer on disk",
+            headers={"Retry-After": str(STORAGE_RESTORE_RETRY_AFTER)},
         )
+    except OSError as e:
+        logger.warning(f"Cannot open audio file {audio_file.file_path}: {e}")
+        raise HTTPException(status_code=503, detail="Audio file is temporarily unavailable")
+
+# Connection health is handled by the pool (pool_pre_ping); a database that is
+# down surfaces as a DATABASE_ERRORS exception and is reported as 503
+DATABASE_UNAVAILABLE = "Database is not available. Please ensure PostgreSQL is running."
 
-@router.post("/extract-audio", response_model=AudioResponse)
-async def extract_audio(youtube_url: YouTubeURL, db: Session = Depends(get_db)):
+@router.post("/extract-audio", response_model=DownloadJob, status_code=202)
+async def extract_audio(youtube_url: YouTubeURL, db: AsyncSession = Depends(get_async_db)):
+    """Queue a download job; poll /jobs/{job_id} for its progress."""
     try:
-        check_database_connection()
-        audio_file = download_audio(youtube_url.url, db)
-        return AudioResponse(
-            status="success",
-            message="Download successful",
-            filename=audio_file.filename,
-            path=audio_file.file_path
-        )
+        return await submit_download_job(db, youtube_url.url)
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error queuing audio download: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/ingest", response_model=IngestResponse, status_code=202)
+async def ingest(ingest_request: IngestRequest, db: AsyncSession = Depends(get_async_db)):
+    """Queue one download job per new video behind the given video, playlist or channel URLs."""
+    if not ingest_request.urls:
+        raise HTTPException(status_code=400, detail="No URLs given")
+    try:
+        return await submit_ingest(db, ingest_request.urls)
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error ingesting {len(ingest_request.urls)} URLs: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}", response_model=DownloadJob)
+async def get_job(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    try:
+        job = await get_download_job(db, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error getting job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/search", response_model=List[SearchHit])
+async def search_library(
+    q: str = Query(..., min_length=1, max_length=200, description="Text to search for"),
+    lang: Optional[str] = Query(None, description="Only transcript segments of this language"),
+    scope: str = Query("all", description="all, titles or transcripts"),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Ranked matches in titles and transcripts, with the segment timestamps to seek to."""
+    try:
+        return await search(db, q, language=lang, scope=scope, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error searching for {q!r}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/admin/storage", response_model=StorageUsage)
+async def get_storage_usage(db: AsyncSession = Depends(get_async_db)):
+    """Stored audio against the quota, cache-only and evicted files."""
+    try:
+        return await db.run_sync(storage_manager.usage)
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error getting storage usage: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/admin/storage/stats", response_model=StorageStats)
+async def get_storage_stats(db: AsyncSession = Depends(get_async_db)):
+    """Stream hit/miss rates, evictions and cache counters."""
+    try:
+        return await db.run_sync(storage_manager.stats)
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error getting storage stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/admin/storage/enforce")
+async def enforce_storage_quota(db: AsyncSession = Depends(get_async_db)):
+    """Flush play timestamps and evict files until the quota is met, now."""
+    try:
+        # Deletes files: off the event loop, like the background pass
+        evicted = await run_in_threadpool(storage_manager.enforce_now)
+        return {"evicted": evicted, "usage": await db.run_sync(storage_manager.usage)}
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
-        logger.error(f"Error downloading audio: {e}")
+        logger.error(f"Error enforcing storage quota: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     return HealthResponse(status="healthy")
 
-@router.get("/audio-files", response_model=List[AudioFile])
-async def list_audio_files(db: Session = Depends(get_db)):
+@router.get("/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+async def readiness_check(response: Response, db: AsyncSession = Depends(get_async_db)):
+    """Whether this worker has started, reaches the database and runs against the current schema"""
+    ready, checks = await check_readiness(db)
+    if not ready:
+        response.status_code = 503
+    return ReadinessResponse(status="ready" if ready else "not_ready", checks=checks)
+
+@router.get("/events", response_class=StreamingResponse, responses={200: {"content": {"text/event-stream": {}}}})
+async def stream_events(
+    types: Optional[str] = Query(None, description="Comma-separated event types to receive: audio_file, job, transcription_job"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Server-sent events for library and download changes.
+
+    Events: ``audio_file.created``, ``audio_file.updated`` (the fields present
+    changed), ``audio_file.deleted``, ``job.created``, ``job.updated``,
+    ``transcription_job.created``, ``transcription_job.updated``,
+    ``transcript.updated`` and ``resync`` (reload the library, then reconnect). Load the library once,
+    then apply the events; browsers resend ``Last-Event-ID`` on reconnect.
+    """
+    if not EVENTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Events are disabled")
+    selected = None
+    if types:
+        selected = {name.strip() for name in types.split(",") if name.strip()}
+        unknown = selected - set(EVENT_TYPES)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown event types: {', '.join(sorted(unknown))}")
+    return StreamingResponse(
+        event_stream(selected, last_event_id),
+        media_type="text/event-stream",
+        # No caching, and no buffering by reverse proxies such as nginx
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/sync", response_model=SyncResponse)
+async def sync_library(
+    since: Optional[str] = Query(None, description="Token of the previous sync; omit to get the whole library"),
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Audio files created, updated or deleted since the token, for offline clients.
+
+    Upsert ``changes``, remove ``deleted`` and keep ``token`` for the next
+    sync; while ``has_more`` is set, request again with it right away.
+    """
+    try:
+        return await get_changes(db, since, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error syncing audio files since {since!r}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(
+    "/audio-files",
+    response_model=List[AudioFile],
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def list_audio_files(
+    request: Request,
+    response: Response,
+    limit: int = Query(
+        AUDIO_FILES_PAGE_SIZE,
+        ge=1,
+        le=max(AUDIO_FILES_MAX_PAGE_SIZE, AUDIO_FILES_MAX_STREAM_PAGE_SIZE),
+        description="Page size; streamed formats allow larger pages",
+    ),
+    cursor: Optional[str] = None,
+    sort: str = Query("created_at", description="created_at, updated_at or id; prefix with '-' for descending"),
+    status: Optional[str] = Query(None, description="Comma-separated statuses"),
+    series_name: Optional[str] = None,
+    min_duration: Optional[int] = Query(None, ge=0),
+    max_duration: Optional[int] = Query(None, ge=0),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    format: Optional[str] = Query(None, description="json (default), json-stream, ndjson or columnar"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """List audio files one page at a time; the next page cursor is in the X-Next-Cursor header."""
+    if format is None and NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        format = "ndjson"
+    stream_format = None if format in (None, "json") else format
+    if stream_format is not None and stream_format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be json or one of {', '.join(STREAM_FORMATS)}")
+    if stream_format is None and limit > AUDIO_FILES_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must not exceed {AUDIO_FILES_MAX_PAGE_SIZE} without a streamed format",
+        )
+    if stream_format is not None and limit > AUDIO_FILES_MAX_STREAM_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must not exceed {AUDIO_FILES_MAX_STREAM_PAGE_SIZE}")
     try:
-        check_database_connection()
-        return get_downloaded_audio_files(db)
+        field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        if stream_format is not None:
+            # Column tuples instead of ORM objects and models
+            field_list = field_list or list(AUDIO_FILE_FIELDS)
+        audio_files, next_cursor = await list_audio_files_page(
+            db,
+            limit=limit,
+            cursor=cursor,
+            sort=sort,
+            status=[value.strip() for value in status.split(",") if value.strip()] if status else None,
+            series_name=series_name,
+            min_duration=min_duration,
+            max_duration=max_duration,
+            fields=field_list,
+            as_rows=stream_format is not None,
+        )
+        headers = {}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+            headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+        if stream_format is not None:
+            return StreamingResponse(
+                encode_rows(stream_format, field_list, audio_files),
+                media_type=MEDIA_TYPES[stream_format],
+                headers=headers,
+            )
+        if field_list:
+            # Projected rows do not match the full AudioFile schema
+            return JSONResponse(content=jsonable_encoder(audio_files), headers=headers)
+        response.headers.update(headers)
+        return audio_files
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error listing audio files: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/audio-files/{audio_file_id}", response_model=AudioFile)
-async def get_audio_file(audio_file_id: int, db: Session = Depends(get_db)):
+async def get_audio_file(audio_file_id: int, db: AsyncSession = Depends(get_async_db)):
     try:
-        check_database_connection()
-        audio_file = get_audio_file_by_id(db, audio_file_id)
+        audio_file = await get_audio_file_by_id(db, audio_file_id)
         if not audio_file:
             raise HTTPException(status_code=404, detail="Audio file not found")
         return audio_file
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error getting audio file {audio_file_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/audio-files/{audio_file_id}/transcriptions", response_model=List[Transcription])
+async def get_audio_file_transcriptions(
+    audio_file_id: int,
+    lang: str = Query(..., description="Language code, e.g. ja"),
+    start: float = Query(0.0, alias="from", ge=0, description="Window start in seconds"),
+    end: Optional[float] = Query(None, alias="to", ge=0, description="Window end in seconds"),
+    content_type: Optional[str] = Query(None, description="'transcription' or 'translation'"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Segments of one language overlapping the [from, to] window (the whole transcript by default)."""
+    if end is not None and end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    try:
+        segments = await get_transcript_window(
+            db, audio_file_id, lang,
+            start=start,
+            end=float("inf") if end is None else end,
+            content_type=content_type,
+        )
+        if segments is None:
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        return segments
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error getting transcriptions for audio file {audio_file_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/audio-files/{audio_file_id}/transcriptions", response_model=TranscriptIngestResult)
+async def upload_audio_file_transcriptions(
+    audio_file_id: int,
+    request: Request,
+    lang: str = Query(..., max_length=10, description="Language code, e.g. ja"),
+    content_type: str = Query("transcription", pattern="^(transcription|translation)$"),
+    format: Optional[str] = Query(None, description="jsonl, srt or vtt (defaults to the Content-Type)"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Replace the segments of one language with a JSONL, SRT or WebVTT transcript sent as the request body."""
+    transcript_format = (format or detect_format(request.headers.get("content-type")) or "").lower()
+    if transcript_format not in TRANSCRIPT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(TRANSCRIPT_FORMATS)}")
+    try:
+        if await get_audio_file_row(db, audio_file_id) is None:
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        result = await ingest_transcript(
+            db, audio_file_id, lang, content_type, transcript_format, request.stream()
+        )
+        logger.info(
+            f"Ingested {result.rows} {lang} segments for audio file {audio_file_id} "
+            f"({result.rows_per_second} rows/s)"
+        )
+        return result
+    except HTTPException:
+        raise
+    except TranscriptParseError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error ingesting transcript for audio file {audio_file_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/audio-files/{audio_file_id}/transcribe", response_model=TranscriptionJob, status_code=202)
+async def transcribe_audio_file(
+    audio_file_id: int,
+    lang: str = Query(..., max_length=10, description="Language code, e.g. ja"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Queue local speech-to-text for one language; poll /transcription-jobs/{job_id} for its progress."""
+    try:
+        job = await db.run_sync(submit_transcription, audio_file_id, lang)
+        if not job:
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        return job
+    except HTTPException:
+        raise
+    except TranscriptionUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error queuing transcription of audio file {audio_file_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/transcription-jobs/{job_id}", response_model=TranscriptionJob)
+async def get_transcription_job_status(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    try:
+        job = await db.run_sync(get_transcription_job, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Transcription job not found")
+        return job
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error getting transcription job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/audio-files/series/{series_name}", response_model=List[AudioFile])
-async def get_audio_files_by_series_name(series_name: str, db: Session = Depends(get_db)):
+async def get_audio_files_by_series_name(series_name: str, db: AsyncSession = Depends(get_async_db)):
     try:
-        check_database_connection()
-        return get_audio_files_by_series(db, series_name)
+        return await get_audio_files_by_series(db, series_name)
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error getting audio files for series {series_name}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/audio-files/{audio_file_id}/status")
-async def update_status(audio_file_id: int, status: str, db: Session = Depends(get_db)):
+async def update_status(audio_file_id: int, status: str, db: AsyncSession = Depends(get_async_db)):
     try:
-        check_database_connection()
-        audio_file = update_audio_file_status(db, audio_file_id, status)
+        audio_file = await update_audio_file_status(db, audio_file_id, status)
         if not audio_file:
             raise HTTPException(status_code=404, detail="Audio file not found")
         return {"message": "Status updated successfully", "audio_file": audio_file}
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error updating status for audio file {audio_file_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/audio-files/{audio_file_id}")
-async def remove_audio_file(audio_file_id: int, db: Session = Depends(get_db)):
+async def remove_audio_file(audio_file_id: int, db: AsyncSession = Depends(get_async_db)):
     try:
-        check_database_connection()
-        success = delete_audio_file(db, audio_file_id)
+        success = await delete_audio_file(db, audio_file_id)
         if not success:
             raise HTTPException(status_code=404, detail="Audio file not found")
         return {"message": "Audio file deleted successfully"}
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error deleting audio file {audio_file_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/audio-files/{audio_file_id}/check-status")
-async def check_audio_file_status(audio_file_id: int, db: Session = Depends(get_db)):
+async def check_audio_file_status(audio_file_id: int, db: AsyncSession = Depends(get_async_db)):
     """Check and update the status of a specific audio file."""
     try:
-        check_database_connection()
-        audio_file = update_audio_file_status_from_disk(db, audio_file_id)
+        audio_file = await update_audio_file_status_from_disk(db, audio_file_id)
         if not audio_file:
             raise HTTPException(status_code=404, detail="Audio file not found")
         return {"message": "Status checked successfully", "audio_file": audio_file}
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error checking status for audio file {audio_file_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/audio-files/check-all-status")
-async def check_all_audio_files_status_endpoint(db: Session = Depends(get_db)):
+async def check_all_audio_files_status_endpoint(db: AsyncSession = Depends(get_async_db)):
     """Check and update the status of all audio files."""
     try:
-        check_database_connection()
-        audio_files = check_all_audio_files_status(db)
+        audio_files = await check_all_audio_files_status(db)
         return {"message": "All statuses checked successfully", "audio_files": audio_files}
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error checking all audio files status: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/audio-files/{audio_file_id}/re-download")
-async def re_download_audio_file(audio_file_id: int, db: Session = Depends(get_db)):
-    """Re-download an audio file using its original URL."""
+@router.post("/audio-files/{audio_file_id}/re-download", response_model=DownloadJob, status_code=202)
+async def re_download_audio_file(audio_file_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Queue a download of an audio file from its original URL.
+
+    Returns the job at once (poll ``GET /jobs/{id}``); the file is
+    ``downloading`` until the job completes or fails.
+    """
     try:
-        check_database_connection()
-        audio_file = re_download_audio(audio_file_id, db)
-        if not audio_file:
+        db_audio_file = await get_audio_file_row(db, audio_file_id)
+        if not db_audio_file:
             raise HTTPException(status_code=404, detail="Audio file not found")
-        return {
-            "message": "Audio file re-downloaded successfully", 
-            "audio_file": audio_file
-        }
+        job = await submit_redownload(db, db_audio_file)
+        if job is None:
+            raise HTTPException(status_code=409, detail="Audio file is already being downloaded")
+        return job
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error re-downloading audio file {audio_file_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/audio-files/{audio_file_id}/hls/master.m3u8")
+async def get_hls_master_playlist(audio_file_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Redirect to the immutable HLS master playlist of the file's current content."""
+    try:
+        db_audio_file = await get_audio_file_row(db, audio_file_id)
+        if not db_audio_file:
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        if not has_renditions(db_audio_file.content_hash):
+            raise HTTPException(status_code=404, detail="HLS renditions not available")
+        url = request.url_for("get_hls_file", content_hash=db_audio_file.content_hash, path=MASTER_PLAYLIST)
+        # The file may be re-downloaded with new content: keep the redirect short-lived
+        return RedirectResponse(str(url), status_code=307, headers={"Cache-Control": "no-cache"})
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error getting HLS playlist for audio file {audio_file_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/audio-files/{audio_file_id}/hls", status_code=202)
+async def generate_hls_renditions(audio_file_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Queue HLS transcoding for a file (e.g. one downloaded before renditions were enabled)."""
+    try:
+        db_audio_file = await get_audio_file_row(db, audio_file_id)
+        if not db_audio_file:
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        if db_audio_file.status != 'downloaded' or not db_audio_file.content_hash:
+            raise HTTPException(status_code=409, detail="Audio file is not in content-addressed storage; re-download it first")
+        if has_renditions(db_audio_file.content_hash):
+            return {"status": "ready"}
+        hls_transcoder.submit(db_audio_file.file_path, db_audio_file.content_hash)
+        return {"status": "queued"}
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error queuing HLS renditions for audio file {audio_file_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/hls/{content_hash}/{path:path}", name="get_hls_file")
+async def get_hls_file(content_hash: str, path: str):
+    """Serve an HLS playlist or segment; they are content-addressed and never change."""
+    file_path = rendition_file(content_hash, path)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return FileResponse(
+        file_path,
+        media_type=media_type_for(file_path),
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+@router.get("/audio-files/{audio_file_id}/waveform")
+async def get_waveform(audio_file_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Serve the precomputed waveform peaks (int8 .npy array of (min, max) pairs)."""
+    try:
+        db_audio_file = await get_audio_file_row(db, audio_file_id)
+        if not db_audio_file:
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        if not has_waveform(db_audio_file.content_hash):
+            raise HTTPException(status_code=404, detail="Waveform not available")
+        # The peaks only change when the stored audio does
+        headers = {"ETag": f'"{db_audio_file.content_hash}"', "Cache-Control": WAVEFORM_CACHE_CONTROL}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(
+            waveform_path(db_audio_file.content_hash),
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error getting waveform for audio file {audio_file_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/audio-files/{audio_file_id}/waveform", status_code=202)
+async def generate_waveform(audio_file_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Queue waveform and loudness analysis for a file (e.g. one downloaded before it existed)."""
+    try:
+        db_audio_file = await get_audio_file_row(db, audio_file_id)
+        if not db_audio_file:
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        if db_audio_file.status != 'downloaded' or not db_audio_file.content_hash:
+            raise HTTPException(status_code=409, detail="Audio file is not in content-addressed storage; re-download it first")
+        if has_waveform(db_audio_file.content_hash) and db_audio_file.loudness_lufs is not None:
+            return {"status": "ready"}
+        waveform_analyzer.submit(db_audio_file.file_path, db_audio_file.content_hash)
+        return {"status": "queued"}
+    except HTTPException:
+        raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Error queuing waveform analysis for audio file {audio_file_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/stream/{filename}")
-async def stream_audio(filename: str, request: Request, db: Session = Depends(get_db)):
+async def stream_audio(filename: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Stream audio file with support for range requests (seeking)"""
     try:
-        check_database_connection()
-        # Get audio file from database
-        audio_file = get_audio_file_by_filename(db, filename)
+        # Cached per filename: repeated seeks skip the database and stat()
+        audio_file = await resolve_audio_file(db, filename)
         if not audio_file:
             raise HTTPException(status_code=404, detail="Audio file not found")
         
-        # Check if file is actually available
-        if audio_file.status != 'downloaded':
-            raise HTTPException(status_code=404, detail="Audio file not available for streaming")
-        
-        file_path = Path(audio_file.file_path)
-        
-        if not file_path.exists() or not file_path.is_file():
-            raise HTTPException(status_code=404, detail="Audio file not found")
-        
-        # Get file size
-        file_size = file_path.stat().st_size
-        
-        # Check if this is a range request
-        range_header = request.headers.get("range")
-        
-        if range_header:
-            # Parse range header (e.g., "bytes=0-1023")
-            try:
-                range_match = range_header.replace("bytes=", "").split("-")
-                start = int(range_match[0]) if range_match[0] else 0
-                end = int(range_match[1]) if range_match[1] else file_size - 1
-                
-                if start >= file_size:
-                    raise HTTPException(status_code=416, detail="Range Not Satisfiable")
-                
-                if end >= file_size:
-                    end = file_size - 1
-                    
-                chunk_size = end - start + 1
-                
-                def generate_chunk():
-                    with open(file_path, "rb") as file:
-                        file.seek(start)
-                        remaining = chunk_size
-                        while remaining > 0:
-                            read_size = min(remaining, 8192)  # 8KB chunks
-                            chunk = file.read(read_size)
-                            if not chunk:
-                                break
-                            remaining -= len(chunk)
-                            yield chunk
-                
-                headers = {
-                    "Content-Range": f"bytes {start}-{end}/{file_size}",
-                    "Accept-Ranges": "bytes",
-                    "Content-Length": str(chunk_size),
-                    "Content-Type": "audio/mpeg",
-                }
-                
-                return StreamingResponse(
-                    generate_chunk(),
-                    status_code=206,
-                    headers=headers
+        if audio_file.status == 'evicted':
+            # Deleted by the storage quota: restore it and let the player retry
+            db_audio_file = await get_audio_file_row(db, audio_file.id)
+            job = await submit_restore(db, db_audio_file) if db_audio_file else None
+            # Identical audio downloaded since is relinked at once
+            audio_file = await resolve_audio_file(db, filename)
+            if not audio_file or audio_file.status != 'downloaded':
+                storage_manager.record_miss(restore_queued=job is not None)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Audio file is being restored",
+                    headers={"Retry-After": str(STORAGE_RESTORE_RETRY_AFTER)},
                 )
-            except (ValueError, IndexError):
-                # Invalid range header, serve full file
-                pass
-        
-        # Serve full file
-        def generate_file():
-            with open(file_path, "rb") as file:
-                while True:
-                    chunk = file.read(8192)  # 8KB chunks
-                    if not chunk:
-                        break
-                    yield chunk
+        if audio_file.status == 'downloading':
+            raise HTTPException(
+                status_code=503,
+                detail="Audio file is being downloaded",
+                headers={"Retry-After": str(STORAGE_RESTORE_RETRY_AFTER)},
+            )
         
-        headers = {
-            "Content-Length": str(file_size),
-            "Accept-Ranges": "bytes",
-            "Content-Type": "audio/mpeg",
-        }
+        # Check if file is actually available
+        if audio_file.status != 'downloaded' or audio_file.stat is None:
+            raise HTTPException(status_code=404, detail="Audio file not available for streaming")
         
-        return StreamingResponse(generate_file(), headers=headers)
+        storage_manager.record_play(audio_file.id)
+        return audio_file_response(request, audio_file)
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error streaming audio file {filename}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/download/{filename}")
-async def download_audio_file(filename: str, db: Session = Depends(get_db)):
+async def download_audio_file(filename: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Download audio file (for backward compatibility)"""
     try:
-        check_database_connection()
-        # Get audio file from database
-        audio_file = get_audio_file_by_filename(db, filename)
+        audio_file = await resolve_audio_file(db, filename)
         if not audio_file:
             raise HTTPException(status_code=404, detail="Audio file not found")
         
         # Check if file is actually available
-        if audio_file.status != 'downloaded':
+        if audio_file.status != 'downloaded' or audio_file.stat is None:
             raise HTTPException(status_code=404, detail="Audio file not available for download")
         
-        file_path = Path(audio_file.file_path)
-        
-        if not file_path.exists() or not file_path.is_file():
-            raise HTTPException(status_code=404, detail="Audio file not found")
-        
-        return FileResponse(
-            file_path,
-            media_type="audio/mpeg",
-            filename=filename
+        return audio_file_response(
+            request,
+            audio_file,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
         )
     except HTTPException:
         raise
+    except DATABASE_ERRORS:
+        raise HTTPException(status_code=503, detail=DATABASE_UNAVAILABLE)
     except Exception as e:
         logger.error(f"Error downloading audio file {filename}: {e}")
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,190 @@
+"""
+Full-text search over transcripts and titles.
+
+On PostgreSQL the ``search_vector`` columns and GIN indexes created by
+migration 0007 are queried with ``tsquery`` and ranked with ``ts_rank``.
+English and French use their stemming configurations; Japanese is indexed as
+character bigrams and searched as a bigram phrase, which matches any
+substring. Other databases (and PostgreSQL databases the migration has not
+reached yet) fall back to an unranked LIKE scan.
+"""
+import logging
+import os
+from typing import List, Optional
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from src.models import AudioFileDB, TranscriptionDB, SearchHit
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "20"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+
+# Languages written without spaces, indexed as character bigrams
+NGRAM_LANGUAGES = ("ja", "zh", "ko")
+SEARCH_SCOPES = ("all", "titles", "transcripts")
+
+_fts_available: Optional[bool] = None
+
+async def full_text_search_available(db: AsyncSession) -> bool:
+    """True when the database has the search columns of migration 0007 (checked once)."""
+    global _fts_available
+    if _fts_available is None:
+        if db.get_bind().dialect.name != "postgresql":
+            _fts_available = False
+        else:
+            result = await db.execute(text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'transcriptions' AND column_name = 'search_vector'"
+            ))
+            _fts_available = result.first() is not None
+            if not _fts_available:
+                logger.warning("Full-text search columns missing; run `alembic upgrade head`. Using LIKE search.")
+    return _fts_available
+
+def ngram_tsquery_sql(query: str) -> str:
+    """SQL expression matching :q as a phrase of character bigrams."""
+    if len("".join(query.split())) == 1:
+        # A single character has no bigram: match bigrams starting with it
+        return "to_tsquery('simple', quote_literal(lower(:q)) || ':*')"
+    return "phraseto_tsquery('simple', castlang_ngrams(:q))"
+
+def tsquery_sql(query: str, language: Optional[str]) -> str:
+    """SQL expression building the tsquery for :q, matching how transcriptions.search_vector was built."""
+    ngram_query = ngram_tsquery_sql(query)
+    if language in NGRAM_LANGUAGES:
+        return ngram_query
+    if language:
+        return "websearch_to_tsquery(castlang_ts_config(:lang), :q)"
+    # Any language: each row only matches the variant built with its own configuration
+    return (
+        "(websearch_to_tsquery('english', :q) || websearch_to_tsquery('french', :q) "
+        f"|| websearch_to_tsquery('simple', :q) || {ngram_query})"
+    )
+
+def title_tsquery_sql(query: str) -> str:
+    """SQL expression building the tsquery for :q against audio_files.search_vector."""
+    # Titles are indexed unstemmed ('simple') plus bigrams, whatever the language
+    # searched: a stemmed query ("podcasts" -> podcast) would miss them
+    return f"(websearch_to_tsquery('simple', :q) || {ngram_tsquery_sql(query)})"
+
+async def search_postgres(db: AsyncSession, query: str, language: Optional[str], scope: str, limit: int) -> List[SearchHit]:
+    params = {"q": query, "lang": language, "limit": limit}
+    tsquery = tsquery_sql(query, language)
+    hits: List[SearchHit] = []
+    if scope in ("all", "transcripts"):
+        language_filter = "AND t.language = :lang" if language else ""
+        result = await db.execute(text(f"""
+            WITH query AS (SELECT {tsquery} AS q)
+            SELECT t.audio_file_id, a.filename, a.title, t.id AS transcription_id, t.language,
+                   t.content_type, t.content, t.start_time_seconds, t.end_time_seconds, m.rank
+            FROM (
+                -- Every match is ranked: the top hits are the best ones, not the first found
+                SELECT t.id, ts_rank(t.search_vector, query.q) AS rank
+                FROM transcriptions t, query
+                WHERE t.search_vector @@ query.q {language_filter}
+                ORDER BY rank DESC, t.id
+                LIMIT :limit
+            ) m
+            JOIN transcriptions t ON t.id = m.id
+            JOIN audio_files a ON a.id = t.audio_file_id
+            ORDER BY m.rank DESC, t.id
+        """), params)
+        hits.extend(SearchHit(match="transcript", **row) for row in result.mappings())
+    if scope in ("all", "titles"):
+        result = await db.execute(text(f"""
+            WITH query AS (SELECT {title_tsquery_sql(query)} AS q)
+            SELECT a.id AS audio_file_id, a.filename, a.title, ts_rank(a.search_vector, query.q) AS rank
+            FROM audio_files a, query
+            WHERE a.search_vector @@ query.q
+            ORDER BY rank DESC, a.id
+            LIMIT :limit
+        """), params)
+        hits.extend(SearchHit(match="title", **row) for row in result.mappings())
+    hits.sort(key=lambda hit: hit.rank, reverse=True)
+    return hits[:limit]
+
+def like_pattern(query: str) -> str:
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+async def search_like(db: AsyncSession, query: str, language: Optional[str], scope: str, limit: int) -> List[SearchHit]:
+    pattern = like_pattern(query)
+    hits: List[SearchHit] = []
+    if scope in ("all", "titles"):
+        result = await db.execute(
+            select(AudioFileDB.id, AudioFileDB.filename, AudioFileDB.title)
+            .where(AudioFileDB.title.ilike(pattern, escape="\\"))
+            .order_by(AudioFileDB.id)
+            .limit(limit)
+        )
+        hits.extend(
+            SearchHit(match="title", audio_file_id=row.id, filename=row.filename, title=row.title, rank=0.0)
+            for row in result
+        )
+    if scope in ("all", "transcripts"):
+        statement = (
+            select(TranscriptionDB, AudioFileDB.filename, AudioFileDB.title)
+            .join(AudioFileDB, AudioFileDB.id == TranscriptionDB.audio_file_id)
+            .where(TranscriptionDB.content.ilike(pattern, escape="\\"))
+        )
+        if language:
+            statement = statement.where(TranscriptionDB.language == language)
+        result = await db.execute(
+            statement.order_by(TranscriptionDB.audio_file_id, TranscriptionDB.start_time_seconds)
+            .limit(limit - len(hits))
+        )
+        hits.extend(
+            SearchHit(
+                match="transcript",
+                audio_file_id=segment.audio_file_id,
+                filename=filename,
+                title=title,
+                transcription_id=segment.id,
+                language=segment.language,
+                content_type=segment.content_type,
+                content=segment.content,
+                start_time_seconds=segment.start_time_seconds,
+                end_time_seconds=segment.end_time_seconds,
+                rank=0.0,
+            )
+            for segment, filename, title in result
+        )
+    return hits
+
+async def search(
+    db: AsyncSession,
+    query: str,
+    language: Optional[str] = None,
+    scope: str = "all",
+    limit: int = SEARCH_DEFAULT_LIMIT,
+) -> List[SearchHit]:
+    """
+    Search transcript segments and audio file titles.
+
+    Args:
+        db (AsyncSession): Database session
+        query (str): Search text (web-search syntax for space-delimited languages)
+        language (str): Only search segments of this language
+        scope (str): 'all', 'titles' or 'transcripts'
+        limit (int): Maximum number of hits
+
+    Returns:
+        list: Hits ordered by rank, each with the audio file and, for
+            transcript matches, the segment and its timestamps
+
+    Raises:
+        ValueError: If the scope is unknown
+    """
+    if scope not in SEARCH_SCOPES:
+        raise ValueError(f"scope must be one of {', '.join(SEARCH_SCOPES)}")
+    query = query.strip()
+    if not query:
+        return []
+    if await full_text_search_available(db):
+        return await search_postgres(db, query, language, scope, limit)
+    return await search_like(db, query, language, scope, limit)
@@ -0,0 +1,95 @@
+"""
+Compact, streamed encodings of large list responses.
+
+Classic JSON responses build one Pydantic model per row and let FastAPI
+validate and serialize the whole list in memory. The formats below skip
+both: rows are selected as plain column tuples and encoded a batch at a time
+while the response is sent, with orjson when it is installed and the
+standard ``json`` module otherwise. Values are encoded as in the classic
+responses (datetimes in ISO 8601), so a client can switch formats without
+changing how it reads fields.
+
+- ``json-stream``: the classic JSON array, streamed;
+- ``ndjson``: one JSON object per line (``application/x-ndjson``);
+- ``columnar``: one array per field, ``{"id": [...], "title": [...]}``,
+  the smallest output for wide pages.
+"""
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterator, List, Sequence
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Load environment variables
+load_dotenv()
+
+# Rows encoded per chunk of a streamed response
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+STREAM_FORMATS = ("json-stream", "ndjson", "columnar")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MEDIA_TYPES = {
+    "json-stream": "application/json",
+    "ndjson": NDJSON_MEDIA_TYPE,
+    "columnar": "application/json",
+}
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value: Any) -> bytes:
+    """Encode a value as compact JSON."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+def _batches(rows: Sequence[Sequence[Any]], size: int) -> Iterator[Sequence[Sequence[Any]]]:
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def encode_rows(
+    stream_format: str,
+    names: List[str],
+    rows: Sequence[Sequence[Any]],
+    batch_size: int = STREAM_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """
+    Encode rows in one of ``STREAM_FORMATS``, one chunk per batch of rows.
+
+    Args:
+        stream_format (str): ``json-stream``, ``ndjson`` or ``columnar``
+        names (list): Field names; each row holds their values first, in order
+        rows (sequence): Row tuples, which may carry extra trailing columns
+        batch_size (int): Rows per chunk
+
+    Yields:
+        bytes: Chunks of the response body
+    """
+    if stream_format == "columnar":
+        # Field by field: every chunk is one complete array
+        yield b"{"
+        for index, name in enumerate(names):
+            yield (b"," if index else b"") + dumps(name) + b":" + dumps([row[index] for row in rows])
+        yield b"}"
+    elif stream_format == "ndjson":
+        for batch in _batches(rows, batch_size):
+            yield b"".join(dumps(dict(zip(names, row))) + b"\n" for row in batch)
+    elif stream_format == "json-stream":
+        yield b"["
+        for index, batch in enumerate(_batches(rows, batch_size)):
+            # Drop the brackets of each batch's array and join them with commas
+            encoded = dumps([dict(zip(names, row)) for row in batch])[1:-1]
+            yield (b"," if index else b"") + encoded
+        yield b"]"
+    else:
+        raise ValueError(f"Unknown format: {stream_format}")
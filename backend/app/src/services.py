@@ -1,25 +1,74 @@
 import yt_dlp
 import os
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from glob import escape as glob_escape
 import re
-from typing import List, Optional
+import json
+import base64
+import time
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+from sqlalchemy import select, tuple_, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from src.models import AudioFile, AudioFileDB, TranscriptionDB
-from src.database import get_db
+from starlette.concurrency import run_in_threadpool
+from src.models import AudioFile, AudioFileDB, Transcription, TranscriptionDB, DownloadJob, DownloadJobDB
+from src.database import SessionLocal
+from src.disk_status import reconciler, disk_status, stat_regular_file, SKIPPED_STATUSES
+from src.file_cache import audio_file_cache, ResolvedAudioFile
+from src.storage import (
+    DOWNLOADS_DIR, StoredBlob, blob_lock_name, blob_path, hash_file, remove_blob, remove_staging_directory,
+    staging_directory, store_file,
+)
+from src.hls import HLS_ENABLED, hls_transcoder, content_hash_of, remove_renditions
+from src.waveform import WAVEFORM_ENABLED, waveform_analyzer, remove_waveform
+from src.transcriber import TRANSCRIBE_ON_DOWNLOAD, queue_transcription
+from src.transcript_index import TranscriptIndex, transcript_index_cache
+from src import extraction_cache
+from src.storage_quota import storage_manager
+from src.metrics import DOWNLOAD_PHASE_SECONDS, DOWNLOADS, timed
+from src.events import publish_audio_file, publish_deleted, publish_job
+from src.sync import record_deletion
+from src.locks import advisory_lock
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 # Configuration from environment variables
-DOWNLOADS_DIR = Path(os.getenv("DOWNLOADS_DIR", "downloads"))
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
 # yt-dlp configuration
 AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "bestaudio/best")
 AUDIO_CODEC = os.getenv("AUDIO_CODEC", "mp3")
 AUDIO_QUALITY = os.getenv("AUDIO_QUALITY", "192")
+# Extraction cache entries are only reused with the settings that produced them
+AUDIO_SETTINGS = (AUDIO_FORMAT, AUDIO_CODEC, AUDIO_QUALITY)
+# Retries of a dropped connection within one download attempt, with exponential backoff
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "10"))
+DOWNLOAD_RETRY_SLEEP_MAX = float(os.getenv("DOWNLOAD_RETRY_SLEEP_MAX", "30"))
+
+# Batch ingestion configuration
+INGEST_EXPAND_WORKERS = int(os.getenv("INGEST_EXPAND_WORKERS", "4"))
+INGEST_MAX_ENTRIES = int(os.getenv("INGEST_MAX_ENTRIES", "5000"))
+# Rows per IN (...) list when deduplicating a batch against the library
+INGEST_LOOKUP_CHUNK = 500
+
+# Listing configuration
+AUDIO_FILES_PAGE_SIZE = int(os.getenv("AUDIO_FILES_PAGE_SIZE", "100"))
+AUDIO_FILES_MAX_PAGE_SIZE = int(os.getenv("AUDIO_FILES_MAX_PAGE_SIZE", "1000"))
+# Page size limit of the streamed formats, which skip per-row models
+AUDIO_FILES_MAX_STREAM_PAGE_SIZE = int(os.getenv("AUDIO_FILES_MAX_STREAM_PAGE_SIZE", "50000"))
+
+# Columns usable as keyset sort keys (each backed by a "<column>, id" index)
+AUDIO_FILE_SORT_COLUMNS = {
+    "created_at": AudioFileDB.created_at,
+    "updated_at": AudioFileDB.updated_at,
+    "id": AudioFileDB.id,
+}
+AUDIO_FILE_FIELDS = tuple(AudioFile.model_fields)
 
 def sanitize_filename(filename: str) -> str:
     # Replace non-ASCII characters with their closest ASCII equivalent or remove them
@@ -30,184 +79,847 @@ def sanitize_filename(filename: str) -> str:
     # Ensure the filename isn't too long
     return sanitized[:100]
 
-def check_file_exists(file_path: str) -> bool:
-    """Check if the audio file exists on disk."""
-    return Path(file_path).exists() and Path(file_path).is_file()
+async def get_audio_file_row(db: AsyncSession, audio_file_id: int) -> Optional[AudioFileDB]:
+    result = await db.execute(select(AudioFileDB).where(AudioFileDB.id == audio_file_id))
+    return result.scalar_one_or_none()
+
+async def sync_status_from_disk(db: AsyncSession, db_audio_file: AudioFileDB, st: Optional[os.stat_result]):
+    """Set an already-loaded audio file's status from the stat() result of its file, committing only on change."""
+    if db_audio_file.status in SKIPPED_STATUSES:
+        return
+    new_status = disk_status(st, db_audio_file.file_size_bytes)
+    if db_audio_file.status != new_status:
+        db_audio_file.status = new_status
+        await db.commit()
+        await db.refresh(db_audio_file)
+        audio_file_cache.invalidate(db_audio_file.id)
+        publish_audio_file("audio_file.updated", db_audio_file)
 
-def update_audio_file_status_from_disk(db: Session, audio_file_id: int) -> Optional[AudioFile]:
-    """Update audio file status based on whether the file exists on disk."""
-    db_audio_file = db.query(AudioFileDB).filter(AudioFileDB.id == audio_file_id).first()
+async def update_audio_file_status_from_disk(db: AsyncSession, audio_file_id: int) -> Optional[AudioFile]:
+    """Update audio file status based on its file on disk (missing, or truncated)."""
+    db_audio_file = await get_audio_file_row(db, audio_file_id)
     if db_audio_file:
-        file_exists = check_file_exists(db_audio_file.file_path)
-        new_status = 'downloaded' if file_exists else 'file_missing'
-        
-        if db_audio_file.status != new_status:
-            db_audio_file.status = new_status
-            db.commit()
-            db.refresh(db_audio_file)
-        
+        await sync_status_from_disk(db, db_audio_file, stat_regular_file(db_audio_file.file_path))
         return AudioFile.from_orm(db_audio_file)
     return None
 
-def check_all_audio_files_status(db: Session) -> List[AudioFile]:
+def reconcile_all_audio_files() -> int:
+    """Run a forced full disk reconciliation pass on its own session."""
+    db = SessionLocal()
+    try:
+        return reconciler.reconcile(db, force=True)
+    finally:
+        db.close()
+
+async def check_all_audio_files_status(db: AsyncSession) -> List[AudioFile]:
     """Check and update status of all audio files based on disk presence."""
-    db_audio_files = db.query(AudioFileDB).all()
-    updated_files = []
-    
-    for db_audio_file in db_audio_files:
-        file_exists = check_file_exists(db_audio_file.file_path)
-        new_status = 'downloaded' if file_exists else 'file_missing'
-        
-        if db_audio_file.status != new_status:
-            db_audio_file.status = new_status
-        
-        updated_files.append(AudioFile.from_orm(db_audio_file))
+    # Forced full pass: stats every file and bulk-updates the changed statuses.
+    # It stats the whole library, so it runs in a worker thread.
+    await run_in_threadpool(reconcile_all_audio_files)
     
-    db.commit()
-    return updated_files
+    result = await db.execute(select(AudioFileDB))
+    return [AudioFile.from_orm(audio_file) for audio_file in result.scalars()]
 
-def re_download_audio(audio_file_id: int, db: Session) -> Optional[AudioFile]:
-    """Re-download an audio file using its original URL."""
-    db_audio_file = db.query(AudioFileDB).filter(AudioFileDB.id == audio_file_id).first()
-    if not db_audio_file:
-        return None
-    
+def unique_safe_filename(db: Session, safe_filename: str, video_id: Optional[str], audio_file_id: Optional[int]) -> str:
+    """Disambiguate a sanitized title already used by another audio file (filenames are unique)."""
+    def taken(name: str) -> bool:
+        query = db.query(AudioFileDB.id).filter(AudioFileDB.filename == f"{name}.mp3")
+        if audio_file_id is not None:
+            query = query.filter(AudioFileDB.id != audio_file_id)
+        return query.first() is not None
+
+    if not taken(safe_filename):
+        return safe_filename
+    if video_id:
+        candidate = f"{safe_filename[:100 - len(video_id) - 1]}_{sanitize_filename(video_id)}"
+        if not taken(candidate):
+            return candidate
+    suffix = 2
+    while taken(f"{safe_filename[:95]}_{suffix}"):
+        suffix += 1
+    return f"{safe_filename[:95]}_{suffix}"
+
+def release_file(db: Session, file_path: str) -> bool:
+    """Delete a stored file unless an audio file or the extraction cache still points to it."""
+    with advisory_lock(blob_lock_name(file_path)):
+        # Evicted rows keep their path for the restore but no longer hold the file
+        in_use = db.query(AudioFileDB.id).filter(AudioFileDB.file_path == file_path, AudioFileDB.status != 'evicted')
+        if in_use.first():
+            return False
+        if not extraction_cache.is_cached_file(db, file_path):
+            remove_renditions(content_hash_of(file_path))
+            remove_waveform(content_hash_of(file_path))
+            return remove_blob(file_path)
+    # Kept for re-linking until the cache evicts it (which takes the lock itself)
+    extraction_cache.enforce_budget(db)
+    return False
+
+def release_file_in_new_session(file_path: str) -> bool:
+    """release_file for async callers (run it in a thread)."""
+    db = SessionLocal()
     try:
-        # Update status to downloading
-        db_audio_file.status = 'downloading'
+        return release_file(db, file_path)
+    finally:
+        db.close()
+
+def downloaded_file_path(info: dict, temp_dir: str) -> Path:
+    """Return the post-processed audio file yt-dlp produced for this video."""
+    if info.get("_type") in ("playlist", "multi_video"):
+        raise ValueError("URL resolves to a playlist; use POST /ingest to download its entries")
+    for download in info.get("requested_downloads") or []:
+        filepath = download.get("filepath")
+        if filepath and Path(filepath).is_file():
+            return Path(filepath)
+    matches = sorted(Path(temp_dir).glob(f"{glob_escape(info.get('id', ''))}.{AUDIO_CODEC}"))
+    if not matches:
+        raise FileNotFoundError(f"yt-dlp produced no {AUDIO_CODEC} file for {info.get('id')}")
+    return matches[0]
+
+def link_audio_file(
+    db: Session,
+    url: str,
+    info: dict,
+    blob: StoredBlob,
+    existing_audio_file: Optional[AudioFileDB] = None,
+) -> Tuple[AudioFileDB, Optional[str]]:
+    """
+    Point a new or existing audio file row at a stored file and commit it.
+
+    Call it holding the blob's lock, so the file cannot be deleted in between.
+
+    Returns:
+        tuple: ``(row, file the row pointed to before)``
+    """
+    destination_path = blob.path
+    file_size = blob.size
+    # A new blob was hashed as it was stored; a deduplicated one is left to the integrity scrubber
+    verified_at = None if blob.deduplicated else datetime.utcnow()
+
+    # Create a sanitized filename for the downloads folder
+    safe_filename = unique_safe_filename(
+        db,
+        sanitize_filename(info.get("title") or "audio"),
+        info.get("id"),
+        existing_audio_file.id if existing_audio_file else None,
+    )
+
+    previous_path = None
+    if existing_audio_file:
+        # Update existing record
+        previous_path = existing_audio_file.file_path
+        existing_audio_file.filename = f"{safe_filename}.mp3"
+        existing_audio_file.video_id = info.get("id")
+        existing_audio_file.title = info.get("title")
+        existing_audio_file.episode_number = info.get("episode_number")
+        existing_audio_file.series_name = info.get("series")
+        existing_audio_file.duration_seconds = info.get("duration")
+        existing_audio_file.file_size_bytes = file_size
+        existing_audio_file.file_path = str(destination_path)
+        existing_audio_file.content_hash = blob.content_hash
+        existing_audio_file.verified_at = verified_at
+        existing_audio_file.status = 'downloaded'
+
         db.commit()
-        
-        # Download the audio file and update the existing record
-        audio_file = download_audio(db_audio_file.original_url, db, existing_audio_file=db_audio_file)
-        
-        if audio_file:
-            return audio_file
-        
-    except Exception as e:
-        # Update status to failed
-        db_audio_file.status = 'download_failed'
+        db.refresh(existing_audio_file)
+        saved = existing_audio_file
+    else:
+        # Create new database record
+        saved = AudioFileDB(
+            filename=f"{safe_filename}.mp3",
+            original_url=url,
+            video_id=info.get("id"),
+            title=info.get("title"),
+            episode_number=info.get("episode_number"),
+            series_name=info.get("series"),
+            duration_seconds=info.get("duration"),
+            file_size_bytes=file_size,
+            file_path=str(destination_path),
+            content_hash=blob.content_hash,
+            verified_at=verified_at,
+            status='downloaded'
+        )
+
+        db.add(saved)
         db.commit()
-        raise e
-    
-    return None
+        db.refresh(saved)
+
+    return saved, previous_path
+
+def announce_audio_file(
+    db: Session,
+    saved: AudioFileDB,
+    blob: StoredBlob,
+    created: bool,
+    previous_path: Optional[str],
+) -> AudioFile:
+    """Release the file a row no longer uses, publish the row and queue its post-processing."""
+    if previous_path and previous_path != str(blob.path):
+        release_file(db, previous_path)
+    if not created:
+        reconciler.invalidate(saved.id)
+        audio_file_cache.invalidate(saved.id)
+    publish_audio_file("audio_file.created" if created else "audio_file.updated", saved)
+    if HLS_ENABLED:
+        hls_transcoder.submit(str(blob.path), blob.content_hash)
+    if WAVEFORM_ENABLED:
+        waveform_analyzer.submit(str(blob.path), blob.content_hash)
+    if TRANSCRIBE_ON_DOWNLOAD:
+        queue_transcription(db, saved.id, TRANSCRIBE_ON_DOWNLOAD)
+    return AudioFile.from_orm(saved)
+
+def relink_cached_file(
+    db: Session,
+    url: str,
+    cached: extraction_cache.CachedExtraction,
+    existing_audio_file: Optional[AudioFileDB] = None,
+) -> Optional[AudioFile]:
+    """Point a row at a file found in the extraction cache; None when it was deleted since the lookup."""
+    blob = cached.blob
+    with advisory_lock(blob_lock_name(blob.path)):
+        stat = stat_regular_file(str(blob.path))
+        if stat is None or stat.st_size != blob.size:
+            return None
+        saved, previous_path = link_audio_file(db, url, cached.info, blob, existing_audio_file)
+    # The release locks the previous file: never while holding this one
+    return announce_audio_file(db, saved, blob, existing_audio_file is None, previous_path)
 
-def download_audio(url: str, db: Session, existing_audio_file: Optional[AudioFileDB] = None) -> AudioFile:
-    # Create a temporary directory to store the audio file
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Configure yt-dlp options
-        ydl_opts = {
-            'format': AUDIO_FORMAT,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': AUDIO_CODEC,
-                'preferredquality': AUDIO_QUALITY,
-            }],
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-        }
+def download_retry_sleep(n: int) -> float:
+    """Backoff before yt-dlp's ``n``-th retry (from 0) of a request or fragment; yt-dlp passes ``n`` by keyword."""
+    return min(2.0 ** n, DOWNLOAD_RETRY_SLEEP_MAX)
+
+def download_lock_name(url: str) -> str:
+    """Lock serializing downloads of a video, whatever URL form names it."""
+    key = extraction_cache.url_video_key(url)
+    return f"download:{key[0]}:{key[1]}" if key else f"download:{url}"
+
+def download_audio(
+    url: str,
+    db: Session,
+    existing_audio_file: Optional[AudioFileDB] = None,
+    progress_hook: Optional[Callable[[dict], None]] = None,
+) -> AudioFile:
+    # Same video with the same settings: re-link the stored file without touching the network
+    cached = extraction_cache.lookup_url(db, url, AUDIO_SETTINGS)
+    if cached:
+        saved = relink_cached_file(db, url, cached, existing_audio_file)
+        if saved:
+            DOWNLOADS.inc("extraction_cache")
+            return saved
+
+    # Time spent in post-processors (the FFmpeg audio extraction), set by the hook below
+    postprocessing = {"seconds": 0.0}
+
+    def postprocessor_hook(d: dict):
+        if d.get("status") == "started":
+            postprocessing["started"] = time.perf_counter()
+        elif d.get("status") == "finished" and "started" in postprocessing:
+            postprocessing["seconds"] += time.perf_counter() - postprocessing.pop("started")
+
+    # Stage the download on the downloads filesystem so storing it is a rename. The
+    # directory belongs to the video: yt-dlp continues the .part file of a failed attempt
+    staging = staging_directory(download_lock_name(url))
+    # Configure yt-dlp options
+    ydl_opts = {
+        'format': AUDIO_FORMAT,
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': AUDIO_CODEC,
+            'preferredquality': AUDIO_QUALITY,
+        }],
+        'outtmpl': os.path.join(staging, '%(id)s.%(ext)s'),
+        # A playlist URL would download every entry; batches go through POST /ingest
+        'noplaylist': True,
+        'postprocessor_hooks': [postprocessor_hook],
+        'continuedl': True,
+        # Connection drops are retried in place, resuming from the bytes already written
+        'retries': DOWNLOAD_RETRIES,
+        'fragment_retries': DOWNLOAD_RETRIES,
+        'retry_sleep_functions': {'http': download_retry_sleep, 'fragment': download_retry_sleep},
+    }
+    if progress_hook:
+        ydl_opts['progress_hooks'] = [progress_hook]
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        # Resolve the video id first: a cached video needs no download or transcode
+        with timed(DOWNLOAD_PHASE_SECONDS, "extract"):
+            info = ydl.extract_info(url, download=False, process=False)
+        if info.get("_type") in ("playlist", "multi_video"):
+            raise ValueError("URL resolves to a playlist; use POST /ingest to download its entries")
+        cached = extraction_cache.lookup_info(db, info, AUDIO_SETTINGS)
+        if cached:
+            saved = relink_cached_file(db, url, cached, existing_audio_file)
+            if saved:
+                DOWNLOADS.inc("extraction_cache")
+                remove_staging_directory(staging)
+                return saved
+        # End the lookup's transaction: no connection is held for the download
+        db.commit()
 
         # Download and extract audio
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            audio_file = list(Path(temp_dir).glob("*.mp3"))[0]
-            
-            # Create a sanitized filename for the downloads folder
-            safe_filename = sanitize_filename(info.get("title", "audio"))
-            destination_path = DOWNLOADS_DIR / f"{safe_filename}.mp3"
-            
-            # Copy the file to the downloads directory
-            with open(audio_file, "rb") as src, open(destination_path, "wb") as dst:
-                dst.write(src.read())
-
-            # Get file size
-            file_size = destination_path.stat().st_size
-            
-            if existing_audio_file:
-                # Update existing record
-                existing_audio_file.filename = f"{safe_filename}.mp3"
-                existing_audio_file.title = info.get("title")
-                existing_audio_file.episode_number = info.get("episode_number")
-                existing_audio_file.series_name = info.get("series")
-                existing_audio_file.duration_seconds = info.get("duration")
-                existing_audio_file.file_size_bytes = file_size
-                existing_audio_file.file_path = str(destination_path)
-                existing_audio_file.status = 'downloaded'
-                
-                db.commit()
-                db.refresh(existing_audio_file)
-                return AudioFile.from_orm(existing_audio_file)
-            else:
-                # Create new database record
-                db_audio_file = AudioFileDB(
-                    filename=f"{safe_filename}.mp3",
-                    original_url=url,
-                    title=info.get("title"),
-                    episode_number=info.get("episode_number"),
-                    series_name=info.get("series"),
-                    duration_seconds=info.get("duration"),
-                    file_size_bytes=file_size,
-                    file_path=str(destination_path),
-                    status='downloaded'
-                )
-                
-                db.add(db_audio_file)
-                db.commit()
-                db.refresh(db_audio_file)
+        started = time.perf_counter()
+        info = ydl.process_ie_result(info, download=True)
+        DOWNLOAD_PHASE_SECONDS.observe(time.perf_counter() - started - postprocessing["seconds"], "download")
+        DOWNLOAD_PHASE_SECONDS.observe(postprocessing["seconds"], "transcode")
+        audio_file = downloaded_file_path(info, str(staging))
+
+        # Move the file into content-addressed storage (deduplicates identical audio). A file
+        # it is deduplicated onto must not be evicted before the row points at it
+        extension = audio_file.suffix.lstrip(".") or AUDIO_CODEC
+        with timed(DOWNLOAD_PHASE_SECONDS, "copy"):
+            content_hash = hash_file(audio_file)
+            with advisory_lock(blob_lock_name(blob_path(content_hash, extension))):
+                blob = store_file(audio_file, extension, content_hash)
+                linked, previous_path = link_audio_file(db, url, info, blob, existing_audio_file)
+        remove_staging_directory(staging)
+        DOWNLOADS.inc("network")
+        saved = announce_audio_file(db, linked, blob, existing_audio_file is None, previous_path)
+        extraction_cache.remember(db, info, blob, AUDIO_SETTINGS)
+        # Large batches should not wait for the background pass to make room
+        storage_manager.enforce(db)
+        return saved
+
+async def get_downloaded_audio_files(db: AsyncSession) -> List[AudioFile]:
+    # Statuses are kept current by the background disk-status reconciler
+    result = await db.execute(select(AudioFileDB))
+    return [AudioFile.from_orm(audio_file) for audio_file in result.scalars()]
 
-                return AudioFile.from_orm(db_audio_file)
+def encode_cursor(sort: str, value: Any, audio_file_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, value, audio_file_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, audio_file_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the requested sort order")
+    try:
+        # Converted here so a tampered cursor is a client error, not a failing query
+        value = int(value) if sort.lstrip("-") == "id" else datetime.fromisoformat(value)
+        return value, int(audio_file_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
 
-def get_downloaded_audio_files(db: Session) -> List[AudioFile]:
-    # First check and update all file statuses
-    check_all_audio_files_status(db)
+async def list_audio_files_page(
+    db: AsyncSession,
+    limit: int = AUDIO_FILES_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
+    status: Optional[List[str]] = None,
+    series_name: Optional[str] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    as_rows: bool = False,
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Return one keyset-paginated page of audio files.
     
-    # Then return the updated list
-    db_audio_files = db.query(AudioFileDB).all()
-    return [AudioFile.from_orm(audio_file) for audio_file in db_audio_files]
+    Args:
+        db (AsyncSession): Database session
+        limit (int): Maximum number of rows in the page
+        cursor (str): Opaque cursor returned with the previous page
+        sort (str): Sort key, prefixed with '-' for descending order
+        status (list): Only return files with one of these statuses
+        series_name (str): Only return files of this series
+        min_duration (int): Minimum duration in seconds
+        max_duration (int): Maximum duration in seconds
+        fields (list): Project the rows onto these fields only
+        as_rows (bool): With ``fields``, return column tuples holding the
+            fields first, in order, instead of dicts
+    
+    Returns:
+        tuple: The page (AudioFile models, or dicts or tuples when ``fields``
+            is set) and the cursor of the next page, or None on the last page
+    
+    Raises:
+        ValueError: On an unknown sort key or field, or an invalid cursor
+    """
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    if sort_key not in AUDIO_FILE_SORT_COLUMNS:
+        raise ValueError(f"Unknown sort key: {sort_key}")
+    sort_column = AUDIO_FILE_SORT_COLUMNS[sort_key]
+
+    if fields:
+        unknown = [field for field in fields if field not in AUDIO_FILE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        # The sort column and id are always loaded to build the next cursor
+        columns = {field: getattr(AudioFileDB, field) for field in fields}
+        columns.setdefault("id", AudioFileDB.id)
+        columns.setdefault(sort_key, sort_column)
+        query = select(*[column.label(name) for name, column in columns.items()])
+    else:
+        query = select(AudioFileDB)
+
+    if status:
+        query = query.where(AudioFileDB.status.in_(status))
+    if series_name is not None:
+        query = query.where(AudioFileDB.series_name == series_name)
+    if min_duration is not None:
+        query = query.where(AudioFileDB.duration_seconds >= min_duration)
+    if max_duration is not None:
+        query = query.where(AudioFileDB.duration_seconds <= max_duration)
+
+    if sort_key == "id":
+        key, order = AudioFileDB.id, [AudioFileDB.id.desc() if descending else AudioFileDB.id]
+    else:
+        key = tuple_(sort_column, AudioFileDB.id)
+        order = [sort_column.desc(), AudioFileDB.id.desc()] if descending else [sort_column, AudioFileDB.id]
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        bound = last_id if sort_key == "id" else tuple_(value, last_id)
+        query = query.where(key < bound if descending else key > bound)
+
+    # Fetch one extra row to know whether another page follows
+    result = await db.execute(query.order_by(*order).limit(limit + 1))
+    rows = result.all() if fields else result.scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, sort_key), last.id)
 
-def get_audio_file_by_id(db: Session, audio_file_id: int) -> Optional[AudioFile]:
+    if fields and as_rows:
+        return rows, next_cursor
+    if fields:
+        return [{field: getattr(row, field) for field in fields} for row in rows], next_cursor
+    return [AudioFile.from_orm(row) for row in rows], next_cursor
+
+async def get_audio_file_by_id(db: AsyncSession, audio_file_id: int) -> Optional[AudioFile]:
     # Check and update status before returning
-    updated_file = update_audio_file_status_from_disk(db, audio_file_id)
-    if updated_file:
-        return updated_file
-    
-    db_audio_file = db.query(AudioFileDB).filter(AudioFileDB.id == audio_file_id).first()
-    if db_audio_file:
-        return AudioFile.from_orm(db_audio_file)
-    return None
+    return await update_audio_file_status_from_disk(db, audio_file_id)
 
-def get_audio_file_by_filename(db: Session, filename: str) -> Optional[AudioFile]:
-    db_audio_file = db.query(AudioFileDB).filter(AudioFileDB.filename == filename).first()
+async def get_audio_file_by_filename(db: AsyncSession, filename: str) -> Optional[AudioFile]:
+    result = await db.execute(select(AudioFileDB).where(AudioFileDB.filename == filename))
+    db_audio_file = result.scalar_one_or_none()
     if db_audio_file:
         # Check and update status
-        update_audio_file_status_from_disk(db, db_audio_file.id)
+        await sync_status_from_disk(db, db_audio_file, stat_regular_file(db_audio_file.file_path))
         return AudioFile.from_orm(db_audio_file)
     return None
 
-def update_audio_file_status(db: Session, audio_file_id: int, status: str) -> Optional[AudioFile]:
-    db_audio_file = db.query(AudioFileDB).filter(AudioFileDB.id == audio_file_id).first()
+async def resolve_audio_file(db: AsyncSession, filename: str) -> Optional[ResolvedAudioFile]:
+    """
+    Resolve a filename to its path, stat result and status for streaming.
+    
+    Served from the in-process cache when possible; on a miss the row is
+    loaded with one indexed query, the file is stat()ed once and the status
+    is corrected if the disk disagrees.
+    """
+    resolved = audio_file_cache.get(filename)
+    if resolved:
+        return resolved
+    
+    result = await db.execute(select(AudioFileDB).where(AudioFileDB.filename == filename))
+    db_audio_file = result.scalar_one_or_none()
+    if not db_audio_file:
+        return None
+    
+    st = stat_regular_file(db_audio_file.file_path)
+    await sync_status_from_disk(db, db_audio_file, st)
+    return audio_file_cache.put(
+        db_audio_file.id,
+        db_audio_file.filename,
+        db_audio_file.file_path,
+        db_audio_file.status,
+        st,
+    )
+
+async def update_audio_file_status(db: AsyncSession, audio_file_id: int, status: str) -> Optional[AudioFile]:
+    db_audio_file = await get_audio_file_row(db, audio_file_id)
     if db_audio_file:
         db_audio_file.status = status
-        db.commit()
-        db.refresh(db_audio_file)
+        await db.commit()
+        await db.refresh(db_audio_file)
+        audio_file_cache.invalidate(audio_file_id)
+        publish_audio_file("audio_file.updated", db_audio_file)
         return AudioFile.from_orm(db_audio_file)
     return None
 
-def delete_audio_file(db: Session, audio_file_id: int) -> bool:
-    db_audio_file = db.query(AudioFileDB).filter(AudioFileDB.id == audio_file_id).first()
+async def delete_audio_file(db: AsyncSession, audio_file_id: int) -> bool:
+    db_audio_file = await get_audio_file_row(db, audio_file_id)
     if db_audio_file:
-        # Delete the physical file
-        file_path = Path(db_audio_file.file_path)
-        if file_path.exists():
-            file_path.unlink()
+        file_path = db_audio_file.file_path
         
-        # Delete from database
-        db.delete(db_audio_file)
-        db.commit()
+        # Delete from database, leaving a tombstone for GET /sync
+        await db.delete(db_audio_file)
+        await record_deletion(db, audio_file_id)
+        await db.commit()
+        
+        # Delete the physical file once no other audio file shares the blob
+        await run_in_threadpool(release_file_in_new_session, file_path)
+        reconciler.invalidate(audio_file_id)
+        audio_file_cache.invalidate(audio_file_id)
+        transcript_index_cache.invalidate(audio_file_id)
+        publish_deleted(audio_file_id)
         return True
     return False
 
-def get_audio_files_by_series(db: Session, series_name: str) -> List[AudioFile]:
-    # Check and update all file statuses first
-    check_all_audio_files_status(db)
+async def get_transcript_window(
+    db: AsyncSession,
+    audio_file_id: int,
+    language: str,
+    start: float = 0.0,
+    end: float = float("inf"),
+    content_type: Optional[str] = None,
+) -> Optional[List[Transcription]]:
+    """
+    Get the transcription segments of one language overlapping a time window.
+    
+    The transcript is loaded once per (file, language) with an indexed query
+    and kept as an in-memory interval index, so repeated lookups from a
+    playing client never reach the database.
+    
+    Args:
+        db (AsyncSession): Database session
+        audio_file_id (int): Audio file ID
+        language (str): Language code
+        start (float): Window start in seconds
+        end (float): Window end in seconds
+        content_type (str): Only 'transcription' or 'translation' segments
+    
+    Returns:
+        list: Segments in start-time order, or None if the audio file does not exist
+    """
+    index = transcript_index_cache.get(audio_file_id, language)
+    if index is None:
+        result = await db.execute(
+            select(TranscriptionDB)
+            .where(TranscriptionDB.audio_file_id == audio_file_id)
+            .where(TranscriptionDB.language == language)
+            .order_by(TranscriptionDB.start_time_seconds, TranscriptionDB.segment_order)
+        )
+        segments = [Transcription.from_orm(row) for row in result.scalars()]
+        if not segments and await get_audio_file_row(db, audio_file_id) is None:
+            return None
+        index = transcript_index_cache.put(audio_file_id, language, TranscriptIndex(segments))
+    return index.window(start, end, content_type)
+
+async def get_audio_files_by_series(db: AsyncSession, series_name: str) -> List[AudioFile]:
+    result = await db.execute(
+        select(AudioFileDB).where(AudioFileDB.series_name == series_name).order_by(AudioFileDB.episode_number)
+    )
+    return [AudioFile.from_orm(audio_file) for audio_file in result.scalars()] 
+
+def get_source_host(url: str) -> str:
+    """Return the normalized host of a URL, used to apply per-source download limits."""
+    host = (urlparse(url).hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    if host == "youtu.be":
+        host = "youtube.com"
+    return host
+
+async def create_download_job(db: AsyncSession, url: str) -> DownloadJobDB:
+    db_job = DownloadJobDB(url=url, source_host=get_source_host(url), status='queued', progress=0.0)
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    publish_job("job.created", db_job)
+    return db_job
+
+async def get_download_job(db: AsyncSession, job_id: int) -> Optional[DownloadJob]:
+    result = await db.execute(select(DownloadJobDB).where(DownloadJobDB.id == job_id))
+    db_job = result.scalar_one_or_none()
+    if db_job:
+        return DownloadJob.from_orm(db_job)
+    return None
+
+def update_download_job(db: Session, job_id: int, **fields) -> Optional[DownloadJobDB]:
+    db_job = db.query(DownloadJobDB).filter(DownloadJobDB.id == job_id).first()
+    if db_job:
+        for key, value in fields.items():
+            setattr(db_job, key, value)
+        db.commit()
+        publish_job("job.updated", db_job)
+    return db_job
+
+def claim_download_job(db: Session, job_id: int) -> Optional[DownloadJobDB]:
+    """Move a queued job to downloading; None if another worker claimed it first."""
+    result = db.execute(
+        update(DownloadJobDB)
+        .where(DownloadJobDB.id == job_id, DownloadJobDB.status == 'queued')
+        .values(
+            status='downloading',
+            started_at=datetime.utcnow(),
+            error=None,
+            attempts=DownloadJobDB.attempts + 1,
+            next_attempt_at=None,
+        )
+    )
+    db.commit()
+    if result.rowcount != 1:
+        return None
+    db_job = db.query(DownloadJobDB).filter(DownloadJobDB.id == job_id).first()
+    publish_job("job.updated", db_job)
+    return db_job
+
+def defer_download_job(db: Session, job_id: int, next_attempt_at: datetime, reason: str) -> bool:
+    """Put a queued job back in retrying until ``next_attempt_at`` without counting an attempt."""
+    result = db.execute(
+        update(DownloadJobDB)
+        .where(DownloadJobDB.id == job_id, DownloadJobDB.status == 'queued')
+        .values(status='retrying', error=reason, next_attempt_at=next_attempt_at)
+    )
+    db.commit()
+    if result.rowcount != 1:
+        return False
+    db_job = db.query(DownloadJobDB).filter(DownloadJobDB.id == job_id).first()
+    publish_job("job.updated", db_job)
+    return True
+
+def get_unfinished_download_jobs(db: Session) -> List[DownloadJobDB]:
+    """Return jobs that were queued or running when the process last stopped."""
+    return (
+        db.query(DownloadJobDB)
+        .filter(DownloadJobDB.status.in_(ACTIVE_JOB_STATUSES))
+        .order_by(DownloadJobDB.id)
+        .all()
+    )
+
+def queue_due_retries(db: Session, now: datetime) -> List[DownloadJobDB]:
+    """Move retrying jobs whose backoff has elapsed back to queued; each is moved by one worker only."""
+    due = (
+        db.query(DownloadJobDB.id)
+        .filter(DownloadJobDB.status == 'retrying', DownloadJobDB.next_attempt_at <= now)
+        .order_by(DownloadJobDB.next_attempt_at)
+        .all()
+    )
+    queued = []
+    for (job_id,) in due:
+        result = db.execute(
+            update(DownloadJobDB)
+            .where(DownloadJobDB.id == job_id, DownloadJobDB.status == 'retrying')
+            .values(status='queued')
+        )
+        db.commit()
+        if result.rowcount == 1:
+            db_job = db.query(DownloadJobDB).filter(DownloadJobDB.id == job_id).first()
+            publish_job("job.updated", db_job)
+            queued.append(db_job)
+    return queued
+
+PERMANENT_HTTP_STATUSES = (400, 401, 404, 410)
+
+def is_retryable_download_error(error: Exception) -> bool:
+    """Whether a failed download may succeed later: network trouble, not an unsupported or unavailable video."""
+    if isinstance(error, ValueError):
+        return False
+    if isinstance(error, yt_dlp.utils.DownloadError) and error.exc_info:
+        cause = error.exc_info[1]
+        # Expected extractor errors: private, removed or geo-blocked videos, unsupported URLs
+        if isinstance(cause, yt_dlp.utils.ExtractorError):
+            if cause.expected:
+                return False
+            cause = cause.cause
+        # The URL is wrong or gone; 403 is left retryable, YouTube answers it to expired stream URLs
+        if isinstance(cause, yt_dlp.networking.exceptions.HTTPError) and cause.status in PERMANENT_HTTP_STATUSES:
+            return False
+    return True
+
+# Jobs still to run; retrying jobs wait for the retry scheduler
+ACTIVE_JOB_STATUSES = ('queued', 'downloading', 'processing', 'retrying')
+
+def entry_url(entry: dict) -> Optional[str]:
+    """Return the absolute URL of a yt-dlp (possibly flat) entry."""
+    url = entry.get("webpage_url") or entry.get("url")
+    if url and not urlparse(url).scheme:
+        if entry.get("ie_key") == "Youtube":
+            return f"https://www.youtube.com/watch?v={url}"
+        return None
+    return url
+
+def is_playlist_entry(entry: dict) -> bool:
+    """Flat entries that point to another playlist (e.g. the tabs of a channel)."""
+    ie_key = entry.get("ie_key") or ""
+    return ie_key.endswith("Tab") or "Playlist" in ie_key
+
+def flatten_entries(ydl: yt_dlp.YoutubeDL, info: dict, depth: int = 0) -> List[dict]:
+    if info.get("_type") not in ("playlist", "multi_video"):
+        url = entry_url(info)
+        if not url:
+            return []
+        return [{"url": url, "video_id": info.get("id"), "title": info.get("title")}]
+
+    entries = []
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        if entry.get("_type") == "url" and is_playlist_entry(entry):
+            if depth >= 2 or not entry_url(entry):
+                continue
+            entry = ydl.extract_info(entry_url(entry), download=False)
+        entries.extend(flatten_entries(ydl, entry, depth + 1))
+        if len(entries) >= INGEST_MAX_ENTRIES:
+            break
+    return entries[:INGEST_MAX_ENTRIES]
+
+def expand_url(url: str) -> List[dict]:
+    """
+    List the videos behind a video, playlist or channel URL without downloading.
+    
+    Uses yt-dlp's flat extraction, so a playlist costs one page fetch instead
+    of one full extraction per video.
+    
+    Args:
+        url (str): Video, playlist or channel URL
+    
+    Returns:
+        list: Entries as ``{"url", "video_id", "title"}`` dicts
+    """
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'skip_download': True,
+        'quiet': True,
+        'no_warnings': True,
+        'playlistend': INGEST_MAX_ENTRIES,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return flatten_entries(ydl, info)
+
+def expand_urls(urls: List[str]) -> Tuple[List[dict], List[str]]:
+    """Expand several URLs concurrently; returns the entries and one error message per failed URL."""
+    entries, errors = [], []
+    if not urls:
+        return entries, errors
+    workers = max(1, min(INGEST_EXPAND_WORKERS, len(urls)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-expand") as executor:
+        futures = [executor.submit(expand_url, url) for url in urls]
+        for url, future in zip(urls, futures):
+            try:
+                entries.extend(future.result())
+            except Exception as e:
+                errors.append(f"{url}: {e}")
+    return entries[:INGEST_MAX_ENTRIES], errors
+
+async def find_known_entries(db: AsyncSession, entries: List[dict]) -> Tuple[set, set]:
+    """Return the video ids and URLs already in the library or in an active download job."""
+    video_ids = [entry["video_id"] for entry in entries if entry["video_id"]]
+    urls = [entry["url"] for entry in entries]
+    known_ids, known_urls = set(), set()
+    for offset in range(0, max(len(video_ids), len(urls)), INGEST_LOOKUP_CHUNK):
+        ids_chunk = video_ids[offset:offset + INGEST_LOOKUP_CHUNK]
+        urls_chunk = urls[offset:offset + INGEST_LOOKUP_CHUNK]
+        result = await db.execute(
+            select(AudioFileDB.video_id, AudioFileDB.original_url).where(
+                or_(AudioFileDB.video_id.in_(ids_chunk), AudioFileDB.original_url.in_(urls_chunk))
+            )
+        )
+        for video_id, original_url in result:
+            known_ids.add(video_id)
+            known_urls.add(original_url)
+        result = await db.execute(
+            select(DownloadJobDB.url)
+            .where(DownloadJobDB.url.in_(urls_chunk))
+            .where(DownloadJobDB.status.in_(ACTIVE_JOB_STATUSES))
+        )
+        known_urls.update(result.scalars())
+    return known_ids, known_urls
+
+def placeholder_filename(entry: dict, attempt: int) -> str:
+    # Titles in non-Latin scripts sanitize to an empty string
+    base = sanitize_filename(entry["title"] or "") or sanitize_filename(entry["video_id"] or "") or "audio"
+    if attempt == 0:
+        return f"{base}.mp3"
+    suffix = sanitize_filename(entry["video_id"]) if attempt == 1 and entry["video_id"] else str(attempt)
+    return f"{base[:100 - len(suffix) - 1]}_{suffix}.mp3"
+
+async def placeholder_filenames(db: AsyncSession, entries: List[dict]) -> List[str]:
+    """Pick a unique filename per entry with one lookup query per collision round."""
+    filenames: List[Optional[str]] = [None] * len(entries)
+    used = set()
+    pending = list(range(len(entries)))
+    attempt = 0
+    while pending:
+        candidates = {index: placeholder_filename(entries[index], attempt) for index in pending}
+        names = list(set(candidates.values()))
+        taken = set()
+        for offset in range(0, len(names), INGEST_LOOKUP_CHUNK):
+            result = await db.execute(
+                select(AudioFileDB.filename).where(
+                    AudioFileDB.filename.in_(names[offset:offset + INGEST_LOOKUP_CHUNK])
+                )
+            )
+            taken.update(result.scalars())
+        pending = []
+        for index, name in candidates.items():
+            if name in taken or name in used:
+                pending.append(index)
+            else:
+                filenames[index] = name
+                used.add(name)
+        attempt += 1
+    return filenames
+
+async def create_ingest_jobs(db: AsyncSession, entries: List[dict]) -> Tuple[List[DownloadJobDB], List[str]]:
+    """
+    Deduplicate expanded entries and queue the new ones in a single transaction.
+    
+    Every new entry gets a ``not_downloaded`` audio file row and a queued
+    download job pointing at it, inserted in bulk and committed together.
+    
+    Args:
+        db (AsyncSession): Database session
+        entries (list): Entries returned by expand_urls
+    
+    Returns:
+        tuple: (created download jobs, URLs skipped as already known)
+    """
+    unique, seen = [], set()
+    for entry in entries:
+        key = entry["video_id"] or entry["url"]
+        if key not in seen:
+            seen.add(key)
+            unique.append(entry)
+    
+    known_ids, known_urls = await find_known_entries(db, unique)
+    new_entries, skipped = [], []
+    for entry in unique:
+        if (entry["video_id"] and entry["video_id"] in known_ids) or entry["url"] in known_urls:
+            skipped.append(entry["url"])
+        else:
+            new_entries.append(entry)
+    if not new_entries:
+        return [], skipped
     
-    db_audio_files = db.query(AudioFileDB).filter(AudioFileDB.series_name == series_name).order_by(AudioFileDB.episode_number).all()
-    return [AudioFile.from_orm(audio_file) for audio_file in db_audio_files] 
\ No newline at end of file
+    filenames = await placeholder_filenames(db, new_entries)
+    audio_files = [
+        AudioFileDB(
+            filename=filename,
+            original_url=entry["url"],
+            video_id=entry["video_id"],
+            title=entry["title"],
+            file_path=str(DOWNLOADS_DIR / filename),
+            status='not_downloaded',
+        )
+        for entry, filename in zip(new_entries, filenames)
+    ]
+    db.add_all(audio_files)
+    await db.flush()
+    db_jobs = [
+        DownloadJobDB(
+            url=audio_file.original_url,
+            source_host=get_source_host(audio_file.original_url),
+            status='queued',
+            progress=0.0,
+            audio_file_id=audio_file.id,
+        )
+        for audio_file in audio_files
+    ]
+    db.add_all(db_jobs)
+    await db.commit()
+    for audio_file in audio_files:
+        publish_audio_file("audio_file.created", audio_file)
+    for db_job in db_jobs:
+        publish_job("job.created", db_job)
+    return db_jobs, skipped
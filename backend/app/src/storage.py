@@ -0,0 +1,193 @@
+"""
+Content-addressed audio storage.
+
+Finished downloads are stored as ``<DOWNLOADS_DIR>/<aa>/<sha256>.<ext>``, so
+identical audio is kept once and two videos sharing a title can never
+overwrite each other. Files are hashed and copied in fixed-size chunks and
+moved into place with an atomic rename, which keeps memory use constant
+whatever the episode length. A file is linked to audio files and deleted
+under its ``blob_lock_name`` lock, so a download deduplicated onto a stored
+file never races the eviction or scrubber deleting it.
+
+Downloads are staged in one directory per video under ``STAGING_DIR``, named
+after the video rather than the attempt, so a failed download leaves its
+``.part`` files for the next attempt (or a re-download) to continue from.
+The directory is removed once the file is stored; directories nobody has
+touched for ``DOWNLOAD_STAGING_TTL`` seconds are swept.
+"""
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+DOWNLOADS_DIR = Path(os.getenv("DOWNLOADS_DIR", "downloads"))
+# yt-dlp works in here; keeping it on the downloads filesystem makes the final move a rename
+STAGING_DIR = Path(os.getenv("STAGING_DIR", str(DOWNLOADS_DIR / ".staging")))
+STORAGE_CHUNK_SIZE = int(os.getenv("STORAGE_CHUNK_SIZE", str(1024 * 1024)))
+# Seconds before an untouched staging directory (an abandoned partial download) is deleted
+DOWNLOAD_STAGING_TTL = float(os.getenv("DOWNLOAD_STAGING_TTL", str(2 * 24 * 3600)))
+
+@dataclass(frozen=True)
+class StoredBlob:
+    path: Path
+    content_hash: str
+    size: int
+    deduplicated: bool
+
+def staging_directory(key: str) -> Path:
+    """
+    Working directory of a video's download, on the same filesystem as the blobs.
+
+    Args:
+        key (str): Identity of the video; the same key always gets the same directory
+
+    Returns:
+        Path: The directory, created if needed, with any partial download of earlier attempts
+    """
+    path = STAGING_DIR / hashlib.sha256(key.encode()).hexdigest()[:32]
+    path.mkdir(parents=True, exist_ok=True)
+    # Touch it: the sweep measures idleness from the latest activity
+    os.utime(path)
+    return path
+
+def remove_staging_directory(path: Path) -> None:
+    shutil.rmtree(path, ignore_errors=True)
+
+def latest_mtime(path: Path) -> float:
+    """Newest modification time of a directory and everything in it."""
+    latest = path.stat().st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+            except FileNotFoundError:
+                pass
+    return latest
+
+def sweep_staging(max_age: float = DOWNLOAD_STAGING_TTL) -> int:
+    """
+    Delete staging directories of downloads abandoned for ``max_age`` seconds.
+
+    A download in progress keeps writing its ``.part`` file, so it is never
+    idle for that long.
+
+    Returns:
+        int: Number of directories deleted
+    """
+    if not STAGING_DIR.is_dir():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in STAGING_DIR.iterdir():
+        try:
+            if path.is_dir() and latest_mtime(path) < cutoff:
+                remove_staging_directory(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+def hash_file(path: Path) -> str:
+    """SHA-256 of a file, read in STORAGE_CHUNK_SIZE chunks."""
+    digest = hashlib.sha256()
+    buffer = bytearray(STORAGE_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as file:
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+def blob_path(content_hash: str, extension: str) -> Path:
+    return DOWNLOADS_DIR / content_hash[:2] / f"{content_hash}.{extension}"
+
+def copy_file_chunked(src: Path, dst_file) -> None:
+    """Copy src into an open file with copy_file_range when available, chunks otherwise."""
+    with open(src, "rb") as src_file:
+        size = os.fstat(src_file.fileno()).st_size
+        if hasattr(os, "copy_file_range"):
+            try:
+                copied = 0
+                while copied < size:
+                    sent = os.copy_file_range(src_file.fileno(), dst_file.fileno(), size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                if copied == size:
+                    return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+            # Unsupported here: restart with a plain chunked copy
+            src_file.seek(0)
+            dst_file.seek(0)
+            dst_file.truncate()
+        shutil.copyfileobj(src_file, dst_file, STORAGE_CHUNK_SIZE)
+
+def move_into_place(src: Path, destination: Path) -> None:
+    """Atomically move src to destination, copying first when they are on different filesystems."""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(src, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # Copy into a temporary file next to the destination, then rename it over
+    fd, tmp_name = tempfile.mkstemp(dir=destination.parent, prefix=f".{destination.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            copy_file_chunked(src, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_name, destination)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+    src.unlink()
+
+def blob_lock_name(path) -> str:
+    """Lock held while a stored file is linked to audio files or deleted (see src.locks)."""
+    return f"blob:{os.fspath(path)}"
+
+def store_file(src: Path, extension: str = "mp3", content_hash: Optional[str] = None) -> StoredBlob:
+    """
+    Move a finished audio file into content-addressed storage.
+
+    Args:
+        src (Path): File to store; it is consumed (moved or deleted)
+        extension (str): Extension of the stored blob
+        content_hash (str, optional): SHA-256 of src when the caller already hashed it
+
+    Returns:
+        StoredBlob: Blob path, SHA-256, size and whether identical audio was already stored
+    """
+    content_hash = content_hash or hash_file(src)
+    size = src.stat().st_size
+    destination = blob_path(content_hash, extension)
+    if destination.is_file() and destination.stat().st_size == size:
+        src.unlink()
+        return StoredBlob(destination, content_hash, size, deduplicated=True)
+    move_into_place(src, destination)
+    return StoredBlob(destination, content_hash, size, deduplicated=False)
+
+def remove_blob(path: str) -> bool:
+    """Delete a stored file, ignoring files that are already gone."""
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,280 @@
+"""
+Storage quota for downloaded audio.
+
+``/stream`` records when each audio file was last played. Plays are buffered
+in memory and written in one batch per ``STORAGE_QUOTA_INTERVAL`` by a
+background thread, which then checks the quota. When stored audio exceeds
+``STORAGE_QUOTA_BYTES``:
+
+1. files kept only by the extraction cache are deleted first (least recently
+   used first);
+2. then the least recently played files (or, never played, downloaded) are
+   deleted and their audio files marked ``evicted``. Rows sharing a stored
+   file are evicted together.
+
+An evicted audio file keeps its metadata and transcripts. The next play
+queues a restore job and answers ``503`` with ``Retry-After`` until the file
+is back.
+"""
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src.database import SessionLocal
+from src.models import AudioFileDB, ExtractionCacheDB, StorageStats, StorageUsage
+from src.storage import DOWNLOADS_DIR, blob_lock_name, remove_blob
+from src.hls import content_hash_of, remove_renditions
+from src.waveform import remove_waveform
+from src.disk_status import reconciler
+from src.file_cache import audio_file_cache
+from src.locks import advisory_lock, try_advisory_lock
+from src.events import publish_status
+from src import extraction_cache
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Budget for all stored audio; 0 disables eviction
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", "0"))
+# Seconds between play-timestamp flushes and quota checks
+STORAGE_QUOTA_INTERVAL = float(os.getenv("STORAGE_QUOTA_INTERVAL", "30"))
+# Files played or downloaded more recently than this are never evicted
+STORAGE_EVICT_MIN_IDLE = float(os.getenv("STORAGE_EVICT_MIN_IDLE", "3600"))
+# Retry-After of /stream while an evicted file is being restored
+STORAGE_RESTORE_RETRY_AFTER = int(os.getenv("STORAGE_RESTORE_RETRY_AFTER", "10"))
+
+class StorageManager:
+    """Buffers play timestamps, enforces the quota and counts stream hits and misses."""
+
+    def __init__(self, quota_bytes: int, interval: float, min_idle: float):
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.min_idle = min_idle
+        self._plays: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.since = datetime.utcnow()
+        self.hits = 0
+        self.misses = 0
+        self.restores = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="storage-quota", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+        # Keep the plays of the last interval
+        db = SessionLocal()
+        try:
+            self.flush_plays(db)
+        except Exception as e:
+            logger.error(f"Flushing play timestamps failed: {e}")
+        finally:
+            db.close()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        try:
+            self.enforce_now()
+        except Exception as e:
+            logger.error(f"Storage quota pass failed: {e}")
+
+    def enforce_now(self) -> int:
+        """Write buffered plays, then evict until the quota is met, in a session of its own."""
+        db = SessionLocal()
+        try:
+            self.flush_plays(db)
+            return self.enforce(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def record_play(self, audio_file_id: int):
+        """Count a stream served from disk (called on every /stream request, kept in memory)."""
+        with self._lock:
+            self._plays[audio_file_id] = datetime.utcnow()
+            self.hits += 1
+
+    def record_miss(self, restore_queued: bool):
+        with self._lock:
+            self.misses += 1
+            if restore_queued:
+                self.restores += 1
+
+    def flush_plays(self, db: Session) -> int:
+        """Write buffered play timestamps in one batch."""
+        with self._lock:
+            plays, self._plays = self._plays, {}
+        if not plays:
+            return 0
+        table = AudioFileDB.__table__
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("audio_file_id"))
+            # Plays must not bump updated_at or change_version, which track metadata changes
+            .values(
+                last_played_at=bindparam("played_at"),
+                updated_at=table.c.updated_at,
+                change_version=table.c.change_version,
+            ),
+            [{"audio_file_id": audio_file_id, "played_at": played_at} for audio_file_id, played_at in plays.items()],
+        )
+        db.commit()
+        return len(plays)
+
+    def eviction_candidates(self, db: Session) -> List[Tuple[str, int]]:
+        """Stored files of downloaded audio files, least recently used first, as (path, size)."""
+        rows = db.execute(
+            select(
+                AudioFileDB.file_path,
+                func.max(AudioFileDB.file_size_bytes),
+                func.max(AudioFileDB.last_played_at),
+                func.max(AudioFileDB.updated_at),
+            )
+            .where(AudioFileDB.status == 'downloaded', AudioFileDB.file_size_bytes.isnot(None))
+            .group_by(AudioFileDB.file_path)
+        )
+        # Last used: played, or (re-)downloaded, whichever is later
+        cutoff = datetime.utcnow() - timedelta(seconds=self.min_idle)
+        candidates = []
+        for file_path, size, played_at, updated_at in rows:
+            last_used = max(filter(None, (played_at, updated_at)), default=datetime.min)
+            if last_used < cutoff:
+                candidates.append((last_used, file_path, size))
+        candidates.sort()
+        return [(file_path, size) for _, file_path, size in candidates]
+
+    def evict_file(self, db: Session, file_path: str) -> List[int]:
+        """Delete a stored file and mark every audio file using it as evicted."""
+        # Downloads deduplicated onto the file and restores link it under the same lock,
+        # so no row can start using it between the update and the unlink
+        with advisory_lock(blob_lock_name(file_path)):
+            ids = [
+                audio_file_id for (audio_file_id,) in
+                db.query(AudioFileDB.id).filter(AudioFileDB.file_path == file_path, AudioFileDB.status == 'downloaded')
+            ]
+            if not ids:
+                return []
+            db.execute(
+                update(AudioFileDB)
+                .where(AudioFileDB.id.in_(ids), AudioFileDB.status == 'downloaded')
+                .values(status='evicted')
+            )
+            # The file is gone: cache entries pointing to it would only be dropped on lookup
+            db.query(ExtractionCacheDB).filter(ExtractionCacheDB.file_path == file_path).delete(synchronize_session=False)
+            db.commit()
+            remove_renditions(content_hash_of(file_path))
+            remove_waveform(content_hash_of(file_path))
+            remove_blob(file_path)
+        for audio_file_id in ids:
+            reconciler.invalidate(audio_file_id)
+            audio_file_cache.invalidate(audio_file_id)
+        publish_status(ids, 'evicted')
+        return ids
+
+    def enforce(self, db: Session) -> int:
+        """
+        Evict stored audio until it fits the quota.
+
+        Args:
+            db (Session): Database session
+
+        Returns:
+            int: Number of stored files deleted
+        """
+        if self.quota_bytes <= 0:
+            return 0
+        # Rank files with the plays still buffered in memory
+        self.flush_plays(db)
+        with try_advisory_lock("storage-quota") as acquired:
+            # Another worker is already evicting
+            return self._evict(db) if acquired else 0
+
+    def _evict(self, db: Session) -> int:
+        excess = extraction_cache.storage_used(db) - self.quota_bytes
+        if excess <= 0:
+            return 0
+        evicted, freed = extraction_cache.evict_cache_only(db, excess)
+        excess -= freed
+        for file_path, size in self.eviction_candidates(db) if excess > 0 else []:
+            if excess <= 0:
+                break
+            ids = self.evict_file(db, file_path)
+            if ids:
+                logger.info(f"Evicted {file_path} ({size} bytes, audio files {ids})")
+                excess -= size
+                evicted += 1
+                with self._lock:
+                    self.evictions += 1
+                    self.evicted_bytes += size
+        if excess > 0:
+            logger.warning(f"Storage quota exceeded by {excess} bytes; remaining files were used too recently to evict")
+        return evicted
+
+    def usage(self, db: Session) -> StorageUsage:
+        evicted = select(AudioFileDB.file_path, func.max(AudioFileDB.file_size_bytes).label("size")).where(
+            AudioFileDB.status == 'evicted'
+        ).group_by(AudioFileDB.file_path).subquery()
+        counts = dict(
+            db.query(AudioFileDB.status, func.count(AudioFileDB.id))
+            .filter(AudioFileDB.status.in_(('downloaded', 'evicted')))
+            .group_by(AudioFileDB.status)
+            .all()
+        )
+        DOWNLOADS_DIR.mkdir(parents=True, exist_ok=True)
+        return StorageUsage(
+            quota_bytes=self.quota_bytes,
+            used_bytes=extraction_cache.storage_used(db),
+            cache_only_bytes=extraction_cache.cache_only_used(db),
+            disk_free_bytes=shutil.disk_usage(DOWNLOADS_DIR).free,
+            downloaded_files=counts.get('downloaded', 0),
+            evicted_files=counts.get('evicted', 0),
+            evicted_bytes=db.execute(select(func.coalesce(func.sum(evicted.c.size), 0))).scalar(),
+        )
+
+    def stats(self, db: Session) -> StorageStats:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            restores, evictions, evicted_bytes = self.restores, self.evictions, self.evicted_bytes
+        return StorageStats(
+            since=self.since,
+            stream_hits=hits,
+            stream_misses=misses,
+            hit_rate=round(hits / (hits + misses), 4) if hits + misses else None,
+            restores=restores,
+            evictions=evictions,
+            evicted_bytes=evicted_bytes,
+            metadata_cache_hits=audio_file_cache.hits,
+            metadata_cache_misses=audio_file_cache.misses,
+            extraction_cache_hits=db.execute(
+                select(func.coalesce(func.sum(ExtractionCacheDB.hit_count), 0))
+            ).scalar(),
+        )
+
+storage_manager = StorageManager(
+    quota_bytes=STORAGE_QUOTA_BYTES,
+    interval=STORAGE_QUOTA_INTERVAL,
+    min_idle=STORAGE_EVICT_MIN_IDLE,
+)
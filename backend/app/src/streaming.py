@@ -0,0 +1,310 @@
+"""
+Audio streaming engine.
+
+``AudioFileResponse`` serves full files, single byte ranges and
+multipart/byteranges responses. When the ASGI server supports the
+``http.response.zerocopysend`` extension the kernel copies the bytes with
+sendfile(); otherwise the file is memory-mapped and sent in large chunks
+sliced off the event loop.
+
+The file is opened before the response is built, so a file removed after
+its row was resolved fails the request cleanly instead of after the status
+line has been sent.
+"""
+import mmap
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from typing import BinaryIO, List, Mapping, Optional, Tuple
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from dotenv import load_dotenv
+from src.metrics import STREAM_BYTES, STREAM_RESPONSES
+
+# Load environment variables
+load_dotenv()
+
+# Streaming configuration
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(1024 * 1024)))
+STREAM_MAX_RANGES = int(os.getenv("STREAM_MAX_RANGES", "32"))
+# Lets browsers, CDNs and reverse proxies reuse audio bytes; ETags revalidate them
+AUDIO_CACHE_CONTROL = os.getenv("AUDIO_CACHE_CONTROL", "public, max-age=86400")
+
+ByteRange = Tuple[int, int]  # inclusive (start, end)
+
+class RangeNotSatisfiable(Exception):
+    """Raised when none of the requested byte ranges overlap the file."""
+
+    def __init__(self, file_size: int):
+        super().__init__(f"Range Not Satisfiable for a {file_size} byte file")
+        self.file_size = file_size
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[List[ByteRange]]:
+    """
+    Parse an HTTP Range header into sorted, merged byte ranges.
+
+    Supports ``bytes=a-b``, open-ended ``bytes=a-``, suffix ``bytes=-n``
+    and comma-separated lists of those.
+
+    Args:
+        range_header (str): Value of the Range header, or None
+        file_size (int): Size of the file in bytes
+
+    Returns:
+        list: Inclusive (start, end) ranges, or None when the whole file
+            should be served (no header, malformed header, too many ranges)
+
+    Raises:
+        RangeNotSatisfiable: If no requested range overlaps the file
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    specs = [item.strip() for item in spec.split(",") if item.strip()]
+    if not specs or len(specs) > STREAM_MAX_RANGES:
+        return None
+    for item in specs:
+        first, dash, last = item.partition("-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length < 0:
+                    return None
+                if length == 0:
+                    continue
+                ranges.append((max(0, file_size - length), file_size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, file_size - 1 if end is None else min(end, file_size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(file_size)
+
+    # Merge overlapping and adjacent ranges
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def make_etag(st: os.stat_result) -> str:
+    """Strong ETag derived from the file identity (inode, mtime, size)."""
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def cache_headers(st: os.stat_result) -> dict:
+    """Validator and caching headers for an audio file."""
+    return {
+        "ETag": make_etag(st),
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": AUDIO_CACHE_CONTROL,
+    }
+
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match list (or ``*``) names ``etag``, using the weak comparison."""
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: a W/ prefix on either side does not prevent a match
+    etag = etag.removeprefix("W/")
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def is_not_modified(request_headers: Headers, st: os.stat_result) -> bool:
+    """Evaluate If-None-Match, then If-Modified-Since, as RFC 9110 orders them."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, make_etag(st))
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(st.st_mtime) <= since
+    return False
+
+def if_range_matches(request_headers: Headers, st: os.stat_result) -> bool:
+    """Return False when If-Range names another version of the file, so the full file is sent."""
+    if_range = request_headers.get("if-range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Strong comparison only: weak tags never match
+        return if_range == make_etag(st)
+    since = _parse_http_date(if_range)
+    return since is not None and int(st.st_mtime) == since
+
+def conditional_audio_response(
+    request_headers: Headers,
+    path: str,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """
+    Build the response for a GET on an audio file, honouring conditional requests.
+
+    The file is opened and fstat()ed here, so validators and lengths describe
+    the bytes that will actually be sent.
+
+    Args:
+        request_headers (Headers): Headers of the incoming request
+        path (str): Path of the audio file
+        headers (dict): Extra response headers (e.g. Content-Disposition)
+
+    Returns:
+        Response: 304 when the client copy is current, otherwise an
+            AudioFileResponse for the whole file or the requested ranges
+
+    Raises:
+        FileNotFoundError: If the file no longer exists
+        OSError: If the file cannot be opened
+        RangeNotSatisfiable: If no requested range overlaps the file
+    """
+    file = open(path, "rb")
+    try:
+        st = os.fstat(file.fileno())
+        response_headers = cache_headers(st)
+        if is_not_modified(request_headers, st):
+            STREAM_RESPONSES.inc("not_modified")
+            file.close()
+            return Response(status_code=304, headers=response_headers)
+
+        ranges = None
+        if if_range_matches(request_headers, st):
+            ranges = parse_range_header(request_headers.get("range"), st.st_size)
+    except BaseException:
+        file.close()
+        raise
+    STREAM_RESPONSES.inc("full" if ranges is None else "range" if len(ranges) == 1 else "multirange")
+    response_headers.update(headers or {})
+    return AudioFileResponse(file, st.st_size, ranges=ranges, headers=response_headers)
+
+class AudioFileResponse(Response):
+    """
+    File response with zero-copy, single-range and multipart range support.
+
+    Takes ownership of an already opened file and closes it once the body
+    has been sent.
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        file_size: int,
+        ranges: Optional[List[ByteRange]] = None,
+        media_type: str = "audio/mpeg",
+        headers: Optional[Mapping[str, str]] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ):
+        self.file = file
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.media_type = media_type
+        self.background = None
+        self.parts: List[Tuple[bytes, int, int]] = []  # (part header, start, end)
+        self.boundary = None
+
+        response_headers = dict(headers or {})
+        response_headers["Accept-Ranges"] = "bytes"
+        if ranges is None:
+            self.status_code = 200
+            self.parts = [(b"", 0, file_size - 1)]
+            response_headers["Content-Length"] = str(file_size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self.parts = [(b"", start, end)]
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            response_headers["Content-Length"] = str(end - start + 1)
+        else:
+            self.status_code = 206
+            self.boundary = secrets.token_hex(16)
+            for start, end in ranges:
+                part_header = (
+                    f"--{self.boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+                ).encode("latin-1")
+                self.parts.append((part_header, start, end))
+            self.closing = f"--{self.boundary}--\r\n".encode("latin-1")
+            content_length = sum(len(part_header) + (end - start + 1) + 2 for part_header, start, end in self.parts)
+            response_headers["Content-Length"] = str(content_length + len(self.closing))
+            response_headers["Content-Type"] = f"multipart/byteranges; boundary={self.boundary}"
+        self.init_headers(response_headers)
+
+    def _frames(self) -> List[Tuple[bytes, int, int, bytes]]:
+        """Return (prefix, start, end, suffix) for every part of the body."""
+        if self.boundary is None:
+            return [(b"", start, end, b"") for _, start, end in self.parts]
+        frames = [(part_header, start, end, b"\r\n") for part_header, start, end in self.parts]
+        last_header, last_start, last_end, last_suffix = frames[-1]
+        frames[-1] = (last_header, last_start, last_end, last_suffix + self.closing)
+        return frames
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        with self.file as file:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method") == "HEAD" or self.file_size == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await self._send_zerocopy(file.fileno(), send)
+            else:
+                await self._send_mmap(file.fileno(), send)
+
+    async def _send_zerocopy(self, fd: int, send: Send) -> None:
+        for prefix, start, end, suffix in self._frames():
+            if prefix:
+                await send({"type": "http.response.body", "body": prefix, "more_body": True})
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": fd,
+                "offset": start,
+                "count": end - start + 1,
+                "more_body": True,
+            })
+            STREAM_BYTES.inc("sendfile", amount=end - start + 1)
+            if suffix:
+                await send({"type": "http.response.body", "body": suffix, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_mmap(self, fd: int, send: Send) -> None:
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            for prefix, start, end, suffix in self._frames():
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                position = start
+                while position <= end:
+                    stop = min(position + self.chunk_size, end + 1)
+                    # Slicing may fault pages in from disk: keep it off the event loop
+                    chunk = await anyio.to_thread.run_sync(mapped.__getitem__, slice(position, stop))
+                    position = stop
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    STREAM_BYTES.inc("mmap", amount=len(chunk))
+                if suffix:
+                    await send({"type": "http.response.body", "body": suffix, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,123 @@
+"""
+Incremental (delta) sync of the audio library for offline clients.
+
+Every write to an audio file stamps its row with a change version (see
+``next_change_version``), and deleting one leaves a tombstone stamped the
+same way. ``GET /sync?since=<token>`` returns the rows and tombstones at or
+above the token's version through the ``(change_version, id)`` indexes, so a
+sync costs what changed rather than the size of the library.
+
+A pass over the changes may take several pages. Its first page takes a
+watermark before reading: a version below which every write is already
+committed and visible. When the pass is done the client gets the watermark
+as its next token. Rows written while the pass was running can be returned
+again by the next pass, so clients apply changes as upserts.
+
+Play timestamps are not changes: ``/stream`` writes them without stamping a
+version.
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import delete, func, literal_column, select, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from src.models import AudioFile, AudioFileDB, AudioFileTombstoneDB, SyncResponse
+
+# Load environment variables
+load_dotenv()
+
+# Changes per /sync page when the request does not set a limit
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+# Upper bound of the limit query parameter of /sync
+SYNC_MAX_PAGE_SIZE = int(os.getenv("SYNC_MAX_PAGE_SIZE", "5000"))
+
+def encode_sync_token(version: int, after_id: int, watermark: Optional[int] = None) -> str:
+    payload = json.dumps([version, after_id, watermark], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_sync_token(token: str) -> Tuple[int, int, Optional[int]]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        version, after_id, watermark = json.loads(base64.urlsafe_b64decode(padded))
+        return int(version), int(after_id), None if watermark is None else int(watermark)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid sync token")
+
+async def current_watermark(db: AsyncSession) -> int:
+    """Return a version below which every change is committed and visible to new reads."""
+    if db.get_bind().dialect.name == "postgresql":
+        # Transactions that have not committed yet all have ids at or above xmin
+        query = select(literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))
+    else:
+        versions = union_all(
+            select(func.max(AudioFileDB.change_version).label("version")),
+            select(func.max(AudioFileTombstoneDB.change_version)),
+        ).subquery()
+        query = select(func.coalesce(func.max(versions.c.version), 0) + 1)
+    return int((await db.execute(query)).scalar())
+
+async def record_deletion(db: AsyncSession, audio_file_id: int):
+    """Add the tombstone of a deleted audio file; commit it with the delete."""
+    # SQLite can reuse the id of a deleted row, so an older tombstone may exist
+    await db.execute(delete(AudioFileTombstoneDB).where(AudioFileTombstoneDB.audio_file_id == audio_file_id))
+    db.add(AudioFileTombstoneDB(audio_file_id=audio_file_id, deleted_at=datetime.utcnow()))
+
+async def get_changes(db: AsyncSession, since: Optional[str] = None, limit: int = SYNC_PAGE_SIZE) -> SyncResponse:
+    """
+    Return one page of the audio files created, updated or deleted since a token.
+
+    Args:
+        db (AsyncSession): Database session
+        since (str): Token returned by the previous sync; None returns the whole library
+        limit (int): Maximum number of changes (rows and deletions) in the page
+
+    Returns:
+        SyncResponse: The changes and the token to pass next
+
+    Raises:
+        ValueError: On an invalid token
+    """
+    version, after_id, watermark = decode_sync_token(since) if since else (-1, -1, None)
+    if watermark is None:
+        # First page of a pass: the watermark must be read before the changes
+        watermark = await current_watermark(db)
+
+    rows = (await db.execute(
+        select(AudioFileDB)
+        .where(tuple_(AudioFileDB.change_version, AudioFileDB.id) > tuple_(version, after_id))
+        .order_by(AudioFileDB.change_version, AudioFileDB.id)
+        .limit(limit + 1)
+    )).scalars().all()
+    tombstones = (await db.execute(
+        select(AudioFileTombstoneDB.change_version, AudioFileTombstoneDB.audio_file_id)
+        .where(
+            tuple_(AudioFileTombstoneDB.change_version, AudioFileTombstoneDB.audio_file_id) > tuple_(version, after_id),
+            # The id was reused by a row created after the delete
+            ~select(AudioFileDB.id).where(AudioFileDB.id == AudioFileTombstoneDB.audio_file_id).exists(),
+        )
+        .order_by(AudioFileTombstoneDB.change_version, AudioFileTombstoneDB.audio_file_id)
+        .limit(limit + 1)
+    )).all()
+
+    # Merge both streams in (change_version, id) order
+    changes = sorted(
+        [(row.change_version, row.id, row) for row in rows]
+        + [(change_version, audio_file_id, None) for change_version, audio_file_id in tombstones],
+        key=lambda change: change[:2],
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if has_more:
+        last_version, last_id, _ = changes[-1]
+        token = encode_sync_token(last_version, last_id, watermark)
+    else:
+        token = encode_sync_token(watermark, -1)
+    return SyncResponse(
+        changes=[AudioFile.from_orm(row) for _, _, row in changes if row is not None],
+        deleted=[audio_file_id for _, audio_file_id, row in changes if row is None],
+        token=token,
+        has_more=has_more,
+    )
@@ -0,0 +1,548 @@
+"""
+Local speech-to-text transcription.
+
+``POST /audio-files/{id}/transcribe`` (or ``TRANSCRIBE_ON_DOWNLOAD`` after
+every download) queues a transcription job for one language. The job splits
+the stored audio into windows of ``TRANSCRIBE_CHUNK_SECONDS`` overlapping by
+``TRANSCRIBE_CHUNK_OVERLAP`` and hands them to a pool of
+``TRANSCRIBE_WORKERS`` CPU processes. Each process decodes only its window
+with FFmpeg (16 kHz mono float PCM) and runs the engine on it.
+
+Every finished window is saved in ``transcription_chunks`` as soon as it
+completes, so a job interrupted by a crash, a restart or a failed window only
+runs the missing windows when it is queued again. Once all windows are done,
+their segments are merged: each overlap is split in the middle and a segment
+belongs to the window holding its midpoint, so speech near a window edge is
+taken from the window that heard it in full. The merged segments replace the
+language's ``transcriptions`` rows in one transaction.
+
+Engines are pluggable (``TRANSCRIBE_ENGINE``):
+
+- ``stub``: deterministic, needs nothing but NumPy. One segment per non-silent
+  5 s slot, labelled with its level; for tests and development.
+- ``faster-whisper``: Whisper on the CPU (``pip install faster-whisper``),
+  model ``TRANSCRIBE_MODEL``.
+- ``package.module:Class``: any ``TranscriptionEngine`` subclass.
+"""
+import importlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src.database import SessionLocal
+from src.models import AudioFileDB, TranscriptionChunkDB, TranscriptionDB, TranscriptionJob, TranscriptionJobDB
+from src.hls import FFMPEG_BINARY
+from src.locks import try_advisory_lock
+from src.transcript_ingest import to_decimal
+from src.transcript_index import transcript_index_cache
+from src.events import publish_transcript, publish_transcription_job
+from src.metrics import histogram, PHASE_BUCKETS
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIBE_ENGINE = os.getenv("TRANSCRIBE_ENGINE", "stub")
+# Whisper model name or path, for the faster-whisper engine
+TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL", "small")
+# Engine processes; each transcribes one window at a time
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", str(os.cpu_count() or 1)))
+# CPU threads of the engine in each process
+TRANSCRIBE_THREADS = int(os.getenv("TRANSCRIBE_THREADS", "1"))
+# Jobs whose windows are fed to the process pool at the same time
+TRANSCRIBE_JOBS = int(os.getenv("TRANSCRIBE_JOBS", "1"))
+TRANSCRIBE_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "30"))
+TRANSCRIBE_CHUNK_OVERLAP = float(os.getenv("TRANSCRIBE_CHUNK_OVERLAP", "5"))
+# Language to transcribe after every download (empty: only on request)
+TRANSCRIBE_ON_DOWNLOAD = os.getenv("TRANSCRIBE_ON_DOWNLOAD", "")
+
+SAMPLE_RATE = 16000
+STUB_SLOT_SECONDS = 5.0
+STUB_SILENCE_DB = -60.0
+DURATION = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+ACTIVE_STATUSES = ('queued', 'running')
+
+TRANSCRIPTION_CHUNK_SECONDS = histogram(
+    "castlang_transcription_chunk_seconds",
+    "Time to decode and transcribe one window, by engine.",
+    ("engine",),
+    PHASE_BUCKETS,
+)
+
+class TranscriptionUnavailable(Exception):
+    """Raised when an audio file cannot be transcribed (it is not downloaded)."""
+
+@dataclass
+class EngineSegment:
+    start: float  # seconds from the start of the window
+    end: float
+    text: str
+    confidence: Optional[float] = None
+
+class TranscriptionEngine:
+    """Speech-to-text on one window; instantiated once per worker process."""
+
+    def transcribe(self, samples: np.ndarray, language: str, offset: float) -> List[EngineSegment]:
+        """
+        Transcribe a window of audio.
+
+        Args:
+            samples (np.ndarray): 16 kHz mono float32 PCM
+            language (str): Language code, e.g. ja
+            offset (float): Position of the window in the file, in seconds
+
+        Returns:
+            list: Segments with times relative to the window
+        """
+        raise NotImplementedError
+
+class StubEngine(TranscriptionEngine):
+    """Deterministic stand-in: one segment per non-silent slot of a fixed 5 s grid."""
+
+    def transcribe(self, samples: np.ndarray, language: str, offset: float) -> List[EngineSegment]:
+        # Slots are aligned on the file, not the window, so overlapping windows
+        # agree and the output does not depend on the chunking
+        slot = int(STUB_SLOT_SECONDS * SAMPLE_RATE)
+        window_end = offset + len(samples) / SAMPLE_RATE
+        segments = []
+        first = math.floor(offset / STUB_SLOT_SECONDS)
+        for number in range(first, math.ceil(window_end / STUB_SLOT_SECONDS)):
+            start = max(number * STUB_SLOT_SECONDS, offset)
+            end = min((number + 1) * STUB_SLOT_SECONDS, window_end)
+            begin = int(round((start - offset) * SAMPLE_RATE))
+            values = samples[begin:begin + min(slot, int(round((end - start) * SAMPLE_RATE)))]
+            if not len(values):
+                continue
+            rms = float(np.sqrt(np.mean(np.square(values, dtype=np.float64))))
+            level = 20 * math.log10(rms) if rms > 0 else -math.inf
+            if level < STUB_SILENCE_DB:
+                continue
+            segments.append(EngineSegment(start - offset, end - offset, f"[{language}] slot {number}: {level:.1f} dBFS"))
+        return segments
+
+class FasterWhisperEngine(TranscriptionEngine):
+    """Whisper through CTranslate2 on the CPU (int8)."""
+
+    def __init__(self):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError("TRANSCRIBE_ENGINE=faster-whisper needs the faster-whisper package (pip install faster-whisper)")
+        self.model = WhisperModel(TRANSCRIBE_MODEL, device="cpu", compute_type="int8", cpu_threads=TRANSCRIBE_THREADS)
+
+    def transcribe(self, samples: np.ndarray, language: str, offset: float) -> List[EngineSegment]:
+        # Each window stands alone: no text carried over from a previous window
+        segments, _ = self.model.transcribe(samples, language=language, beam_size=5, condition_on_previous_text=False)
+        return [
+            EngineSegment(segment.start, segment.end, segment.text.strip(), round(min(1.0, math.exp(segment.avg_logprob)), 2))
+            for segment in segments
+            if segment.text.strip()
+        ]
+
+ENGINES = {
+    "stub": StubEngine,
+    "faster-whisper": FasterWhisperEngine,
+}
+
+_engines: Dict[str, TranscriptionEngine] = {}
+
+def engine_id() -> str:
+    """Name recorded on jobs: finished windows are only reused with the same engine and model."""
+    return f"{TRANSCRIBE_ENGINE}/{TRANSCRIBE_MODEL}" if TRANSCRIBE_ENGINE == "faster-whisper" else TRANSCRIBE_ENGINE
+
+def get_engine(spec: str) -> TranscriptionEngine:
+    """The process's instance of an engine, loaded (with its model) on first use."""
+    engine = _engines.get(spec)
+    if engine is None:
+        if spec in ENGINES:
+            engine_class = ENGINES[spec]
+        elif ":" in spec:
+            module, _, name = spec.partition(":")
+            engine_class = getattr(importlib.import_module(module), name)
+        else:
+            raise ValueError(f"Unknown transcription engine: {spec}")
+        engine = _engines[spec] = engine_class()
+    return engine
+
+@dataclass
+class Chunk:
+    index: int
+    start: float
+    end: float
+
+def plan_chunks(duration: float, chunk_seconds: float, overlap_seconds: float) -> List[Chunk]:
+    """Windows of ``chunk_seconds`` every ``chunk_seconds - overlap_seconds``, the last one ending with the file."""
+    step = chunk_seconds - overlap_seconds
+    if step <= 0:
+        raise ValueError("TRANSCRIBE_CHUNK_OVERLAP must be shorter than TRANSCRIBE_CHUNK_SECONDS")
+    chunks, start = [], 0.0
+    while True:
+        end = min(start + chunk_seconds, duration)
+        chunks.append(Chunk(len(chunks), start, end))
+        if end >= duration:
+            return chunks
+        start += step
+
+def merge_segments(chunks: List[Chunk], results: Dict[int, list], overlap_seconds: float) -> List[list]:
+    """
+    Merge the segments of overlapping windows.
+
+    Args:
+        chunks (list): The planned windows
+        results (dict): Segments ``[start, end, text, confidence]`` (file times) by window index
+        overlap_seconds (float): Overlap between consecutive windows
+
+    Returns:
+        list: Segments in time order, each taken from the window holding its midpoint
+    """
+    merged = []
+    for chunk in chunks:
+        keep_from = chunk.start + overlap_seconds / 2 if chunk.index else -math.inf
+        keep_to = chunks[chunk.index + 1].start + overlap_seconds / 2 if chunk.index + 1 < len(chunks) else math.inf
+        for segment in results.get(chunk.index, []):
+            if keep_from <= (segment[0] + segment[1]) / 2 < keep_to:
+                merged.append(segment)
+    merged.sort(key=lambda segment: (segment[0], segment[1]))
+    return merged
+
+def probe_duration(source: Path) -> Optional[float]:
+    """Duration from FFmpeg's input header (no decoding)."""
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-i", str(source)],
+        capture_output=True,
+    )
+    match = DURATION.search(result.stderr.decode(errors="replace"))
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def decode_window(source: Path, start: float, duration: Optional[float]) -> np.ndarray:
+    """Decode ``duration`` seconds (to the end when None) from ``start`` as 16 kHz mono float32."""
+    command = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-nostdin", "-ss", f"{start:.3f}"]
+    if duration is not None:
+        command += ["-t", f"{duration:.3f}"]
+    command += [
+        "-i", str(source), "-map", "0:a:0", "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "f32le", "-acodec", "pcm_f32le", "pipe:1",
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='replace')[-500:]}")
+    return np.frombuffer(result.stdout, dtype="<f4")
+
+def transcribe_chunk(source_path: str, start: float, duration: Optional[float], language: str, spec: str) -> Tuple[List[list], float]:
+    """Process pool task: decode and transcribe one window; returns its segments in file time and the seconds taken."""
+    started = time.perf_counter()
+    samples = decode_window(Path(source_path), start, duration)
+    segments = get_engine(spec).transcribe(samples, language, start)
+    return [
+        [round(start + segment.start, 3), round(start + segment.end, 3), segment.text, segment.confidence]
+        for segment in segments
+    ], time.perf_counter() - started
+
+def update_transcription_job(db: Session, job_id: int, **fields) -> Optional[TranscriptionJobDB]:
+    db_job = db.query(TranscriptionJobDB).filter(TranscriptionJobDB.id == job_id).first()
+    if db_job:
+        for key, value in fields.items():
+            setattr(db_job, key, value)
+        db.commit()
+        publish_transcription_job("transcription_job.updated", db_job)
+    return db_job
+
+def claim_transcription_job(db: Session, job_id: int) -> Optional[TranscriptionJobDB]:
+    """Move a queued job to running; None if another worker claimed it first."""
+    result = db.execute(
+        update(TranscriptionJobDB)
+        .where(TranscriptionJobDB.id == job_id, TranscriptionJobDB.status == 'queued')
+        .values(status='running', started_at=datetime.utcnow(), finished_at=None, error=None)
+    )
+    db.commit()
+    if result.rowcount != 1:
+        return None
+    db_job = db.query(TranscriptionJobDB).filter(TranscriptionJobDB.id == job_id).first()
+    publish_transcription_job("transcription_job.updated", db_job)
+    return db_job
+
+def write_transcript(db: Session, audio_file_id: int, language: str, segments: List[list]):
+    """Replace the transcription segments of one language of an audio file (one transaction)."""
+    now = datetime.utcnow()
+    db.execute(
+        delete(TranscriptionDB)
+        .where(TranscriptionDB.audio_file_id == audio_file_id)
+        .where(TranscriptionDB.language == language)
+        .where(TranscriptionDB.content_type == 'transcription')
+    )
+    if segments:
+        db.execute(insert(TranscriptionDB), [
+            {
+                "audio_file_id": audio_file_id,
+                "language": language,
+                "content_type": "transcription",
+                "content": text,
+                "confidence_score": to_decimal(confidence, "0.01"),
+                "start_time_seconds": to_decimal(start, "0.001"),
+                "end_time_seconds": to_decimal(end, "0.001"),
+                "segment_order": order,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for order, (start, end, text, confidence) in enumerate(segments)
+        ])
+
+class TranscriptionManager:
+    """Runs transcription jobs, spreading their windows over a process pool."""
+
+    def __init__(self, max_jobs: int, max_workers: int):
+        self.max_jobs = max_jobs
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, job_id: int):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="transcription")
+            self._executor.submit(self._run, job_id)
+
+    def process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._process_pool is None or getattr(self._process_pool, "_broken", False):
+                # spawn: never fork a process holding threads and pooled DB connections
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._process_pool
+
+    def _run(self, job_id: int):
+        try:
+            run_transcription_job(job_id, self.process_pool())
+        except Exception as e:
+            logger.error(f"Transcription job {job_id} crashed: {e}")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            process_pool, self._process_pool = self._process_pool, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if process_pool:
+            process_pool.shutdown(wait=False, cancel_futures=True)
+
+transcription_manager = TranscriptionManager(max_jobs=TRANSCRIBE_JOBS, max_workers=TRANSCRIBE_WORKERS)
+
+def run_transcription_job(job_id: int, process_pool: ProcessPoolExecutor):
+    """Transcribe the windows a job is missing, then merge and store its transcript."""
+    db = SessionLocal()
+    futures = {}
+    try:
+        with try_advisory_lock(f"transcription:{job_id}") as acquired:
+            if not acquired:
+                return
+            db_job = claim_transcription_job(db, job_id)
+            if db_job is None:
+                return
+            audio_file = db.query(AudioFileDB).filter(AudioFileDB.id == db_job.audio_file_id).first()
+            if audio_file is None or audio_file.status != 'downloaded':
+                raise RuntimeError("The audio file is not downloaded")
+            if (db_job.content_hash, db_job.engine) != (audio_file.content_hash, engine_id()):
+                # Re-downloaded or another engine since the last run: start over
+                db.execute(delete(TranscriptionChunkDB).where(TranscriptionChunkDB.job_id == job_id))
+                db_job.content_hash, db_job.engine = audio_file.content_hash, engine_id()
+                db.commit()
+
+            source = Path(audio_file.file_path)
+            duration = probe_duration(source) or audio_file.duration_seconds
+            if not duration:
+                raise RuntimeError("Could not read the duration of the audio file")
+            chunks = plan_chunks(duration, db_job.chunk_seconds, db_job.overlap_seconds)
+            results = {
+                row.chunk_index: json.loads(row.segments)
+                for row in db.query(TranscriptionChunkDB).filter(TranscriptionChunkDB.job_id == job_id)
+                if row.chunk_index < len(chunks)
+            }
+            pending = [chunk for chunk in chunks if chunk.index not in results]
+            if results:
+                logger.info(f"Transcription job {job_id}: resuming with {len(results)} of {len(chunks)} windows done")
+            update_transcription_job(
+                db, job_id,
+                chunks_total=len(chunks),
+                chunks_done=len(results),
+                progress=round(len(results) * 100.0 / len(chunks), 1),
+            )
+
+            language, spec = db_job.language, TRANSCRIBE_ENGINE
+            for chunk in pending:
+                # The last window reads to the end, whatever the probed duration said
+                length = chunk.end - chunk.start if chunk.index + 1 < len(chunks) else None
+                future = process_pool.submit(transcribe_chunk, str(source), chunk.start, length, language, spec)
+                futures[future] = chunk
+            for future in as_completed(futures):
+                chunk = futures[future]
+                segments, seconds = future.result()
+                TRANSCRIPTION_CHUNK_SECONDS.observe(seconds, engine_id())
+                results[chunk.index] = segments
+                # Saved with the progress, so a crash never redoes this window
+                db.add(TranscriptionChunkDB(
+                    job_id=job_id,
+                    chunk_index=chunk.index,
+                    start_seconds=chunk.start,
+                    end_seconds=chunk.end,
+                    segments=json.dumps(segments, ensure_ascii=False),
+                ))
+                update_transcription_job(
+                    db, job_id,
+                    chunks_done=len(results),
+                    progress=round(len(results) * 100.0 / len(chunks), 1),
+                )
+
+            merged = merge_segments(chunks, results, db_job.overlap_seconds)
+            write_transcript(db, audio_file.id, language, merged)
+            db.execute(delete(TranscriptionChunkDB).where(TranscriptionChunkDB.job_id == job_id))
+            db.commit()
+            transcript_index_cache.invalidate(audio_file.id, language)
+            publish_transcript(audio_file.id, language, "transcription")
+            update_transcription_job(
+                db, job_id,
+                status='completed',
+                progress=100.0,
+                segments=len(merged),
+                finished_at=datetime.utcnow(),
+            )
+            logger.info(f"Transcription job {job_id}: {len(merged)} {language} segments for audio file {audio_file.id}")
+    except Exception as e:
+        logger.error(f"Transcription job {job_id} failed: {e}")
+        for future in futures:
+            future.cancel()
+        db.rollback()
+        update_transcription_job(db, job_id, status='failed', error=str(e), finished_at=datetime.utcnow())
+    finally:
+        db.close()
+
+def queue_transcription(db: Session, audio_file_id: int, language: str) -> TranscriptionJob:
+    """
+    Queue the transcription of an audio file in one language.
+
+    A queued or running job for the same file and language is returned as is;
+    a failed one is queued again and resumes from its finished windows. A
+    unique index keeps concurrent requests from queueing the same job twice.
+
+    Args:
+        db (Session): Database session
+        audio_file_id (int): Downloaded audio file
+        language (str): Language code, e.g. ja
+
+    Returns:
+        TranscriptionJob: The queued (or already active) job
+    """
+    db_job = (
+        db.query(TranscriptionJobDB)
+        .filter(
+            TranscriptionJobDB.audio_file_id == audio_file_id,
+            TranscriptionJobDB.language == language,
+            TranscriptionJobDB.status != 'completed',
+        )
+        .order_by(TranscriptionJobDB.id.desc())
+        .first()
+    )
+    if db_job is not None and db_job.status in ACTIVE_STATUSES:
+        return TranscriptionJob.from_orm(db_job)
+    try:
+        if db_job is not None:
+            db_job = update_transcription_job(db, db_job.id, status='queued', error=None, finished_at=None)
+        else:
+            db_job = TranscriptionJobDB(
+                audio_file_id=audio_file_id,
+                language=language,
+                status='queued',
+                progress=0.0,
+                engine=engine_id(),
+                chunk_seconds=TRANSCRIBE_CHUNK_SECONDS,
+                overlap_seconds=TRANSCRIBE_CHUNK_OVERLAP,
+                chunks_done=0,
+            )
+            db.add(db_job)
+            db.commit()
+            db.refresh(db_job)
+            publish_transcription_job("transcription_job.created", db_job)
+    except IntegrityError:
+        # Another request queued the same transcription first: return its job
+        db.rollback()
+        db_job = (
+            db.query(TranscriptionJobDB)
+            .filter(
+                TranscriptionJobDB.audio_file_id == audio_file_id,
+                TranscriptionJobDB.language == language,
+                TranscriptionJobDB.status.in_(ACTIVE_STATUSES),
+            )
+            .one()
+        )
+        return TranscriptionJob.from_orm(db_job)
+    transcription_manager.enqueue(db_job.id)
+    return TranscriptionJob.from_orm(db_job)
+
+def submit_transcription(db: Session, audio_file_id: int, language: str) -> Optional[TranscriptionJob]:
+    """
+    Queue the transcription of an audio file requested through the API.
+
+    Returns:
+        TranscriptionJob: The job, or None if the audio file does not exist
+
+    Raises:
+        TranscriptionUnavailable: If the audio file is not downloaded
+    """
+    status = db.query(AudioFileDB.status).filter(AudioFileDB.id == audio_file_id).scalar()
+    if status is None:
+        return None
+    if status != 'downloaded':
+        raise TranscriptionUnavailable(f"Audio file is {status}, not downloaded")
+    return queue_transcription(db, audio_file_id, language)
+
+def get_transcription_job(db: Session, job_id: int) -> Optional[TranscriptionJob]:
+    db_job = db.query(TranscriptionJobDB).filter(TranscriptionJobDB.id == job_id).first()
+    return TranscriptionJob.from_orm(db_job) if db_job else None
+
+def recover_transcription_jobs():
+    """
+    Re-queue jobs interrupted by a restart; they resume from their finished windows.
+
+    Like download jobs, a running job is only reset when no worker holds its lock.
+    """
+    db = SessionLocal()
+    try:
+        with try_advisory_lock("recover-transcription-jobs") as acquired:
+            if not acquired:
+                return
+            db_jobs = (
+                db.query(TranscriptionJobDB)
+                .filter(TranscriptionJobDB.status.in_(ACTIVE_STATUSES))
+                .order_by(TranscriptionJobDB.id)
+                .all()
+            )
+            for db_job in db_jobs:
+                if db_job.status != 'queued':
+                    with try_advisory_lock(f"transcription:{db_job.id}") as idle:
+                        if not idle:
+                            continue
+                        update_transcription_job(db, db_job.id, status='queued')
+                transcription_manager.enqueue(db_job.id)
+    finally:
+        db.close()
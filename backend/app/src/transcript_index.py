@@ -0,0 +1,119 @@
+"""
+In-memory interval index over transcription segments.
+
+A player showing synchronized subtitles asks for the segments of a short time
+window every second or so. Each ``(audio_file_id, language)`` transcript is
+loaded once into sorted start/end arrays, so a window lookup is two bisects
+plus the matching segments instead of a database query over the transcript.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from src.models import Transcription
+
+# Load environment variables
+load_dotenv()
+
+TRANSCRIPT_INDEX_CACHE_SIZE = int(os.getenv("TRANSCRIPT_INDEX_CACHE_SIZE", "256"))
+TRANSCRIPT_INDEX_TTL = float(os.getenv("TRANSCRIPT_INDEX_TTL", "300"))
+
+TranscriptKey = Tuple[int, str]  # (audio_file_id, language)
+
+class TranscriptIndex:
+    """Segments of one transcript sorted by start time, queryable by time window."""
+
+    def __init__(self, segments: Sequence[Transcription]):
+        # Segments without timing cover the whole file
+        timed = [
+            (
+                segment.start_time_seconds if segment.start_time_seconds is not None else 0.0,
+                segment.end_time_seconds if segment.end_time_seconds is not None else float("inf"),
+                segment,
+            )
+            for segment in segments
+        ]
+        timed.sort(key=lambda item: (item[0], item[2].segment_order or 0))
+        self.segments = [segment for _, _, segment in timed]
+        self.starts = [float(start) for start, _, _ in timed]
+        self.ends = [float(end) for _, end, _ in timed]
+        # Running maximum of end times: non-decreasing, so it can be bisected
+        # even when segments overlap
+        self.max_ends = []
+        running = float("-inf")
+        for end in self.ends:
+            running = max(running, end)
+            self.max_ends.append(running)
+        self.expires_at = time.monotonic() + TRANSCRIPT_INDEX_TTL
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def window(self, start: float, end: float, content_type: Optional[str] = None) -> List[Transcription]:
+        """
+        Return the segments overlapping ``[start, end]`` in start-time order.
+
+        Args:
+            start (float): Window start in seconds
+            end (float): Window end in seconds
+            content_type (str): Only segments of this content type
+
+        Returns:
+            list: Matching segments
+        """
+        # Segments before `first` all end before the window starts,
+        # segments from `stop` on all start after it ends
+        first = bisect_left(self.max_ends, start)
+        stop = bisect_right(self.starts, end)
+        return [
+            self.segments[i]
+            for i in range(first, stop)
+            if self.ends[i] >= start and (content_type is None or self.segments[i].content_type == content_type)
+        ]
+
+class TranscriptIndexCache:
+    """Thread-safe LRU of transcript indexes with TTL."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[TranscriptKey, TranscriptIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, audio_file_id: int, language: str) -> Optional[TranscriptIndex]:
+        key = (audio_file_id, language)
+        with self._lock:
+            index = self._entries.get(key)
+            if index is None:
+                return None
+            if index.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return index
+
+    def put(self, audio_file_id: int, language: str, index: TranscriptIndex) -> TranscriptIndex:
+        if self.max_size <= 0 or TRANSCRIPT_INDEX_TTL <= 0:
+            return index
+        key = (audio_file_id, language)
+        with self._lock:
+            self._entries[key] = index
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return index
+
+    def invalidate(self, audio_file_id: int, language: Optional[str] = None):
+        """Drop the indexes of a file (or of one of its languages) after its segments change."""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == audio_file_id and (language is None or key[1] == language):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+transcript_index_cache = TranscriptIndexCache(max_size=TRANSCRIPT_INDEX_CACHE_SIZE)
@@ -0,0 +1,242 @@
+"""
+Bulk transcription ingest.
+
+Transcripts are uploaded as JSONL, SRT or WebVTT and parsed while the request
+body streams in. Segments are written in batches, with PostgreSQL ``COPY``
+when the async engine runs on asyncpg and a batched ``executemany`` INSERT
+otherwise, inside one transaction that first deletes the file's existing
+segments for that language. Readers see either the old or the new transcript.
+"""
+import codecs
+import json
+import os
+import re
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, List, Optional
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from src.models import TranscriptionDB, TranscriptIngestResult
+from src.transcript_index import transcript_index_cache
+from src.events import publish_transcript
+
+# Load environment variables
+load_dotenv()
+
+# Segments buffered before each COPY / executemany round-trip
+TRANSCRIPT_INGEST_BATCH_SIZE = int(os.getenv("TRANSCRIPT_INGEST_BATCH_SIZE", "5000"))
+
+TRANSCRIPT_FORMATS = ("jsonl", "srt", "vtt")
+COLUMNS = (
+    "audio_file_id", "language", "content_type", "content", "confidence_score",
+    "start_time_seconds", "end_time_seconds", "segment_order", "created_at", "updated_at",
+)
+
+# 01:02:03,456 (SRT) / 01:02:03.456 or 02:03.456 (VTT)
+TIMESTAMP = r"(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})"
+CUE_TIMING = re.compile(rf"^\s*{TIMESTAMP}\s*-->\s*{TIMESTAMP}")
+
+class TranscriptParseError(ValueError):
+    """Raised for malformed transcript input; carries the offending line number."""
+
+    def __init__(self, line_number: int, message: str):
+        super().__init__(f"Line {line_number}: {message}")
+        self.line_number = line_number
+
+class Segment:
+    __slots__ = ("start", "end", "text", "confidence")
+
+    def __init__(self, start: Optional[float], end: Optional[float], text: str, confidence: Optional[float] = None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.confidence = confidence
+
+def detect_format(content_type: Optional[str], filename: Optional[str] = None) -> Optional[str]:
+    """Guess the transcript format from a Content-Type header or a file name."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("text/vtt",):
+        return "vtt"
+    if content_type in ("application/x-subrip", "text/srt", "application/srt"):
+        return "srt"
+    if content_type in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines"):
+        return "jsonl"
+    if filename:
+        extension = filename.rsplit(".", 1)[-1].lower()
+        if extension in TRANSCRIPT_FORMATS:
+            return extension
+    return None
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a UTF-8 byte stream into lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+def parse_timestamp(hours: Optional[str], minutes: str, seconds: str, millis: str) -> float:
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, "0")) / 1000
+
+def parse_cue_timing(line: str) -> Optional[tuple]:
+    match = CUE_TIMING.match(line)
+    if not match:
+        return None
+    groups = match.groups()
+    return parse_timestamp(*groups[:4]), parse_timestamp(*groups[4:])
+
+async def parse_jsonl(lines: AsyncIterator[str]) -> AsyncIterator[Segment]:
+    """One JSON object per line: ``start``, ``end``, ``text`` and optional ``confidence``."""
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            text = item.get("text", item.get("content"))
+            start = item.get("start", item.get("start_time_seconds"))
+            end = item.get("end", item.get("end_time_seconds"))
+            confidence = item.get("confidence", item.get("confidence_score"))
+            if not isinstance(text, str):
+                raise ValueError("missing 'text'")
+            yield Segment(
+                float(start) if start is not None else None,
+                float(end) if end is not None else None,
+                text,
+                float(confidence) if confidence is not None else None,
+            )
+        except (ValueError, TypeError, AttributeError) as e:
+            raise TranscriptParseError(line_number, str(e))
+
+async def parse_cues(lines: AsyncIterator[str], webvtt: bool) -> AsyncIterator[Segment]:
+    """SRT and WebVTT cues: an optional identifier, a timing line, then text until a blank line."""
+    line_number = 0
+    timing = None
+    text_lines: List[str] = []
+    skipping = False  # inside a WebVTT NOTE/STYLE/REGION block or the header
+    async for line in lines:
+        line_number += 1
+        if webvtt and line_number == 1:
+            if not line.startswith("WEBVTT"):
+                raise TranscriptParseError(line_number, "missing WEBVTT header")
+            skipping = True
+            continue
+        if not line.strip():
+            if timing is not None:
+                yield Segment(timing[0], timing[1], "\n".join(text_lines))
+            timing, text_lines, skipping = None, [], False
+            continue
+        if skipping:
+            continue
+        if timing is None:
+            if webvtt and line.split(" ", 1)[0] in ("NOTE", "STYLE", "REGION"):
+                skipping = True
+                continue
+            parsed = parse_cue_timing(line)
+            if parsed is not None:
+                timing = parsed
+            elif not line.strip().isdigit() and not webvtt:
+                raise TranscriptParseError(line_number, f"expected a cue number or timing, got {line[:40]!r}")
+            continue
+        text_lines.append(line)
+    if timing is not None:
+        yield Segment(timing[0], timing[1], "\n".join(text_lines))
+
+def parse_segments(lines: AsyncIterator[str], transcript_format: str) -> AsyncIterator[Segment]:
+    if transcript_format == "jsonl":
+        return parse_jsonl(lines)
+    if transcript_format in ("srt", "vtt"):
+        return parse_cues(lines, webvtt=transcript_format == "vtt")
+    raise ValueError(f"Unsupported transcript format: {transcript_format}")
+
+def to_decimal(value: Optional[float], places: str) -> Optional[Decimal]:
+    return Decimal(str(value)).quantize(Decimal(places)) if value is not None else None
+
+async def write_batch(db: AsyncSession, rows: List[tuple], use_copy: bool):
+    if use_copy:
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            TranscriptionDB.__tablename__, records=rows, columns=COLUMNS,
+        )
+    else:
+        await db.execute(insert(TranscriptionDB), [dict(zip(COLUMNS, row)) for row in rows])
+
+async def ingest_transcript(
+    db: AsyncSession,
+    audio_file_id: int,
+    language: str,
+    content_type: str,
+    transcript_format: str,
+    chunks: AsyncIterator[bytes],
+) -> TranscriptIngestResult:
+    """
+    Replace the segments of one language and content type of an audio file with an uploaded transcript.
+
+    Args:
+        db (AsyncSession): Database session
+        audio_file_id (int): Audio file ID (must exist)
+        language (str): Language code of the transcript
+        content_type (str): 'transcription' or 'translation'
+        transcript_format (str): 'jsonl', 'srt' or 'vtt'
+        chunks (AsyncIterator[bytes]): Request body stream
+
+    Returns:
+        TranscriptIngestResult: Row count, elapsed time and rows per second
+
+    Raises:
+        TranscriptParseError: If the transcript is malformed (nothing is written)
+    """
+    started = time.perf_counter()
+    bind = db.get_bind()
+    use_copy = bind.dialect.name == "postgresql" and bind.dialect.driver == "asyncpg"
+    now = datetime.utcnow()
+    count = 0
+    batch: List[tuple] = []
+    try:
+        await db.execute(
+            delete(TranscriptionDB)
+            .where(TranscriptionDB.audio_file_id == audio_file_id)
+            .where(TranscriptionDB.language == language)
+            .where(TranscriptionDB.content_type == content_type)
+        )
+        async for segment in parse_segments(iter_lines(chunks), transcript_format):
+            batch.append((
+                audio_file_id, language, content_type, segment.text,
+                to_decimal(segment.confidence, "0.01"),
+                to_decimal(segment.start, "0.001"),
+                to_decimal(segment.end, "0.001"),
+                count, now, now,
+            ))
+            count += 1
+            if len(batch) >= TRANSCRIPT_INGEST_BATCH_SIZE:
+                await write_batch(db, batch, use_copy)
+                batch = []
+        if batch:
+            await write_batch(db, batch, use_copy)
+        await db.commit()
+        publish_transcript(audio_file_id, language, content_type)
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        transcript_index_cache.invalidate(audio_file_id, language)
+
+    seconds = time.perf_counter() - started
+    return TranscriptIngestResult(
+        audio_file_id=audio_file_id,
+        language=language,
+        content_type=content_type,
+        format=transcript_format,
+        rows=count,
+        seconds=round(seconds, 3),
+        rows_per_second=round(count / seconds, 1) if seconds > 0 else float(count),
+    )
@@ -0,0 +1,277 @@
+"""
+Waveform peaks and loudness analysis.
+
+After a download the stored audio is decoded once with FFmpeg into 48 kHz
+stereo float PCM, streamed through NumPy in fixed-size chunks:
+
+- min/max peaks are taken per 10 ms window, reduced to at most
+  ``WAVEFORM_BINS`` pairs and saved as an ``int8`` ``.npy`` array of shape
+  ``(bins, 2)`` (a few KB), keyed by content hash like the stored audio;
+- integrated loudness follows ITU-R BS.1770 (K-weighting, 400 ms blocks with
+  75% overlap, absolute and relative gates). The K-weighting filter is applied
+  in the frequency domain on 100 ms sub-blocks, so no per-sample Python loop
+  or SciPy is needed. The result, in LUFS, is stored on the audio file rows.
+
+The player draws the seek bar from the peaks instead of decoding the MP3.
+"""
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Set, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from src.database import SessionLocal
+from src.models import AudioFileDB
+from src.storage import DOWNLOADS_DIR
+from src.hls import CONTENT_HASH, FFMPEG_BINARY
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WAVEFORM_ENABLED = os.getenv("WAVEFORM_ENABLED", "true").lower() == "true"
+WAVEFORM_DIR = Path(os.getenv("WAVEFORM_DIR", str(DOWNLOADS_DIR / "waveforms")))
+WAVEFORM_BINS = int(os.getenv("WAVEFORM_BINS", "2000"))
+WAVEFORM_WORKERS = int(os.getenv("WAVEFORM_WORKERS", "1"))
+WAVEFORM_CACHE_CONTROL = os.getenv("WAVEFORM_CACHE_CONTROL", "public, max-age=86400")
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+PEAK_WINDOW = SAMPLE_RATE // 100       # 10 ms
+SUB_BLOCK = SAMPLE_RATE // 10          # 100 ms, a quarter of a gating block
+CHUNK_SUB_BLOCKS = 100                 # 10 s of PCM per read (~3.7 MB)
+
+# BS.1770 K-weighting at 48 kHz: high shelf, then high pass (b, a)
+K_WEIGHTING = (
+    ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+    ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]),
+)
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+def waveform_path(content_hash: str) -> Path:
+    return WAVEFORM_DIR / content_hash[:2] / f"{content_hash}.npy"
+
+def has_waveform(content_hash: Optional[str]) -> bool:
+    return bool(content_hash) and waveform_path(content_hash).is_file()
+
+def remove_waveform(content_hash: Optional[str]):
+    if content_hash and CONTENT_HASH.match(content_hash):
+        try:
+            os.unlink(waveform_path(content_hash))
+        except FileNotFoundError:
+            pass
+
+def k_weighting_power(block_size: int) -> np.ndarray:
+    """
+    Per-bin weights turning the rfft of a block into its K-weighted mean square.
+
+    Combines |H(f)|^2 of both K-weighting stages with the one-sided Parseval
+    factors, so ``(abs(rfft(x)) ** 2 * weights).sum()`` equals
+    ``mean(k_weighted(x) ** 2)``.
+    """
+    z = np.exp(-1j * np.pi * np.fft.rfftfreq(block_size, d=1.0) * 2)
+    response = np.ones_like(z)
+    for b, a in K_WEIGHTING:
+        response *= np.polyval(b[::-1], z) / np.polyval(a[::-1], z)
+    weights = np.abs(response) ** 2 * 2
+    weights[0] /= 2
+    if block_size % 2 == 0:
+        weights[-1] /= 2
+    return weights / block_size ** 2
+
+def integrated_loudness(sub_block_energy: np.ndarray) -> Optional[float]:
+    """
+    Gated integrated loudness (LUFS) from the K-weighted energies of 100 ms sub-blocks.
+
+    Args:
+        sub_block_energy (np.ndarray): Channel-summed mean squares, one per sub-block
+
+    Returns:
+        float: Integrated loudness, or None for silence or audio under 400 ms
+    """
+    if len(sub_block_energy) < 4:
+        return None
+    # 400 ms gating blocks with 75% overlap: four consecutive sub-blocks
+    cumulative = np.concatenate(([0.0], np.cumsum(sub_block_energy)))
+    blocks = (cumulative[4:] - cumulative[:-4]) / 4
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(loudness > ABSOLUTE_GATE) & (loudness > relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+def reduce_peaks(minimums: np.ndarray, maximums: np.ndarray, bins: int) -> np.ndarray:
+    """Merge consecutive peak windows into at most ``bins`` (min, max) int8 pairs."""
+    if len(minimums) > bins:
+        edges = np.linspace(0, len(minimums), bins + 1).astype(np.int64)[:-1]
+        minimums = np.minimum.reduceat(minimums, edges)
+        maximums = np.maximum.reduceat(maximums, edges)
+    peaks = np.stack((minimums, maximums), axis=1)
+    return np.round(np.clip(peaks, -1.0, 1.0) * 127).astype(np.int8)
+
+def decode_command(source: Path):
+    return [
+        FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-nostdin", "-i", str(source),
+        "-map", "0:a:0", "-vn", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE),
+        "-f", "f32le", "-acodec", "pcm_f32le", "pipe:1",
+    ]
+
+def analyze_audio(source: Path) -> Tuple[np.ndarray, Optional[float]]:
+    """
+    Decode an audio file once and compute its peaks and integrated loudness.
+
+    Memory use is bounded by one chunk of PCM plus the per-window results.
+
+    Args:
+        source (Path): Audio file
+
+    Returns:
+        tuple: ``(peaks, loudness)`` with peaks as an int8 ``(bins, 2)`` array
+            of (min, max) and loudness in LUFS (None for silence)
+
+    Raises:
+        RuntimeError: If FFmpeg fails to decode the file
+    """
+    frame_bytes = CHANNELS * 4
+    chunk = bytearray(CHUNK_SUB_BLOCKS * SUB_BLOCK * frame_bytes)
+    weights = k_weighting_power(SUB_BLOCK)
+    minimums, maximums, energies = [], [], []
+
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(decode_command(source), stdout=subprocess.PIPE, stderr=errors)
+        try:
+            while True:
+                # Fill the buffer completely so chunks stay aligned on sub-blocks
+                view, filled = memoryview(chunk), 0
+                while filled < len(chunk):
+                    read = process.stdout.readinto(view[filled:])
+                    if not read:
+                        break
+                    filled += read
+                frames = filled // frame_bytes
+                if not frames:
+                    break
+                pcm = np.frombuffer(chunk, dtype="<f4", count=frames * CHANNELS).reshape(frames, CHANNELS)
+                # Pad the final chunk with silence to whole sub-blocks
+                padded_frames = -(-frames // SUB_BLOCK) * SUB_BLOCK
+                if padded_frames != frames:
+                    pcm = np.concatenate((pcm, np.zeros((padded_frames - frames, CHANNELS), dtype=pcm.dtype)))
+
+                peak_frames = -(-frames // PEAK_WINDOW) * PEAK_WINDOW
+                windows = pcm[:peak_frames].reshape(-1, PEAK_WINDOW * CHANNELS)
+                minimums.append(windows.min(axis=1))
+                maximums.append(windows.max(axis=1))
+
+                spectrum = np.fft.rfft(pcm.reshape(-1, SUB_BLOCK, CHANNELS), axis=1)
+                power = spectrum.real ** 2 + spectrum.imag ** 2
+                energies.append(np.einsum("bfc,f->b", power, weights))
+                if filled < len(chunk):
+                    break
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            raise RuntimeError(f"ffmpeg exited with {returncode}: {errors.read().decode(errors='replace')[-500:]}")
+
+    if not minimums:
+        return np.zeros((0, 2), dtype=np.int8), None
+    peaks = reduce_peaks(np.concatenate(minimums), np.concatenate(maximums), WAVEFORM_BINS)
+    return peaks, integrated_loudness(np.concatenate(energies))
+
+def save_waveform(content_hash: str, peaks: np.ndarray) -> Path:
+    """Write the peaks sidecar atomically."""
+    destination = waveform_path(content_hash)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=destination.parent, prefix=f".{content_hash[:12]}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            np.save(tmp_file, peaks, allow_pickle=False)
+        os.replace(tmp_name, destination)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+    return destination
+
+def record_loudness(content_hash: str, loudness: Optional[float]):
+    """Store the loudness on every audio file row sharing the stored audio."""
+    db = SessionLocal()
+    try:
+        db.query(AudioFileDB).filter(AudioFileDB.content_hash == content_hash).update(
+            {AudioFileDB.loudness_lufs: round(loudness, 2) if loudness is not None else None},
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def stored_loudness(content_hash: str) -> Tuple[bool, Optional[float]]:
+    """(True, loudness) if any row sharing the audio was analyzed, (False, None) otherwise."""
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(AudioFileDB.loudness_lufs)
+            .filter(AudioFileDB.content_hash == content_hash, AudioFileDB.loudness_lufs.isnot(None))
+            .first()
+        )
+        return (True, row[0]) if row else (False, None)
+    finally:
+        db.close()
+
+class WaveformAnalyzer:
+    """Bounded queue of waveform analyses, deduplicated by content hash."""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def submit(self, source_path: str, content_hash: Optional[str]) -> bool:
+        """Queue the analysis of a stored file; False if one is already running."""
+        if not content_hash:
+            return False
+        with self._lock:
+            if content_hash in self._in_flight:
+                return False
+            self._in_flight.add(content_hash)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="waveform")
+            self._executor.submit(self._run, Path(source_path), content_hash)
+        return True
+
+    def _run(self, source: Path, content_hash: str):
+        try:
+            if has_waveform(content_hash):
+                # Identical audio was analyzed before: only copy its loudness to new rows
+                analyzed, loudness = stored_loudness(content_hash)
+                if analyzed:
+                    record_loudness(content_hash, loudness)
+                    return
+            peaks, loudness = analyze_audio(source)
+            save_waveform(content_hash, peaks)
+            record_loudness(content_hash, loudness)
+            logger.info(f"Waveform ready for {content_hash[:12]} ({len(peaks)} bins, {loudness} LUFS)")
+        except Exception as e:
+            logger.error(f"Waveform analysis failed for {content_hash[:12]}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(content_hash)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+waveform_analyzer = WaveformAnalyzer(max_workers=WAVEFORM_WORKERS)
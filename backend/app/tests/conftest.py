@@ -0,0 +1,41 @@
+"""
+Shared fixtures.
+
+The modules under test read their configuration from the environment when
+they are imported, so the tests point them at a throwaway SQLite database and
+downloads directory before importing anything from ``src``.
+"""
+import os
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix="castlang-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'castlang.sqlite')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["DOWNLOADS_DIR"] = os.path.join(_workdir, "downloads")
+
+import pytest
+from src.database import SessionLocal, engine
+from src.models import Base
+
+Base.metadata.create_all(bind=engine)
+
+@pytest.fixture
+def db():
+    """A session on an empty database."""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(table.delete())
+        session.commit()
+        session.close()
+
+@pytest.fixture(scope="session")
+def postgres_url():
+    """URL of a scratch PostgreSQL database (TEST_POSTGRES_URL) for PostgreSQL-only features."""
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    return url
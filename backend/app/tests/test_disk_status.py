@@ -0,0 +1,64 @@
+from src.disk_status import DiskStatusReconciler
+from src.models import AudioFileDB
+
+def reconciler(ttl: float = 0, batch_size: int = 100) -> DiskStatusReconciler:
+    return DiskStatusReconciler(ttl=ttl, interval=60, batch_size=batch_size, full_sync_interval=3600)
+
+def add_audio_file(db, tmp_path, name: str, status: str = "downloaded") -> AudioFileDB:
+    path = tmp_path / name
+    path.write_bytes(b"audio")
+    audio_file = AudioFileDB(
+        filename=name, original_url=f"https://example.com/{name}", file_path=str(path),
+        file_size_bytes=5, status=status,
+    )
+    db.add(audio_file)
+    db.commit()
+    return audio_file
+
+def statuses(db, *audio_files):
+    for audio_file in audio_files:
+        db.refresh(audio_file)
+    return [audio_file.status for audio_file in audio_files]
+
+def test_deleted_and_truncated_files_change_status_in_bulk(db, tmp_path):
+    intact, deleted, truncated = (add_audio_file(db, tmp_path, name) for name in ("a.mp3", "b.mp3", "c.mp3"))
+    checker = reconciler()
+    assert checker.reconcile(db) == 0
+
+    (tmp_path / "b.mp3").unlink()
+    (tmp_path / "c.mp3").write_bytes(b"au")
+    assert checker.reconcile(db) == 2
+    assert statuses(db, intact, deleted, truncated) == ["downloaded", "file_missing", "corrupted"]
+
+    # Back on disk: downloaded again
+    (tmp_path / "b.mp3").write_bytes(b"audio")
+    assert checker.reconcile(db) == 1
+    assert statuses(db, deleted) == ["downloaded"]
+
+def test_statuses_owned_elsewhere_are_kept(db, tmp_path):
+    evicted = add_audio_file(db, tmp_path, "a.mp3", status="evicted")
+    (tmp_path / "a.mp3").unlink()
+    assert reconciler().reconcile(db) == 0
+    assert statuses(db, evicted) == ["evicted"]
+
+def test_passes_check_a_batch_of_stale_files(db, tmp_path):
+    first, second = (add_audio_file(db, tmp_path, name) for name in ("a.mp3", "b.mp3"))
+    checker = reconciler(ttl=3600, batch_size=1)
+    (tmp_path / "a.mp3").unlink()
+    (tmp_path / "b.mp3").unlink()
+
+    # One file per pass, then none until the TTL expires
+    assert [checker.reconcile(db) for _ in range(3)] == [1, 1, 0]
+    assert statuses(db, first, second) == ["file_missing", "file_missing"]
+
+def test_rows_written_after_a_pass_are_picked_up_past_the_watermark(db, tmp_path):
+    checker = reconciler()
+    add_audio_file(db, tmp_path, "a.mp3")
+    checker.reconcile(db)
+
+    later = add_audio_file(db, tmp_path, "b.mp3")
+    (tmp_path / "b.mp3").unlink()
+    assert checker.reconcile(db) == 1
+    assert statuses(db, later) == ["file_missing"]
+    # A forced pass re-checks everything at once
+    assert checker.reconcile(db, force=True) == 0
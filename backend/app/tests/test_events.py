@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+from src.events import NOTIFY_PAYLOAD_LIMIT, RESYNC, Event, EventBus, event_bus, new_event, notify_payloads, resync_event
+from src.file_cache import audio_file_cache
+from src.transcript_index import TranscriptIndex, transcript_index_cache
+
+def event(number: int, size: int = 10) -> Event:
+    return Event(f"id-{number}", "audio_file.updated", {"id": number, "title": "x" * size})
+
+def decode(payloads):
+    return [Event(**item) for payload in payloads for item in json.loads(payload)]
+
+def test_notify_payloads_pack_events_in_order_within_the_limit():
+    events = [event(number, size=500) for number in range(100)]
+    payloads = notify_payloads(events)
+    assert len(payloads) > 1
+    assert all(len(payload.encode()) <= NOTIFY_PAYLOAD_LIMIT for payload in payloads)
+    assert decode(payloads) == events
+
+def test_notify_payloads_fill_each_payload():
+    payloads = notify_payloads([event(number, size=500) for number in range(100)])
+    sizes = [len(payload.encode()) for payload in payloads]
+    # Every payload but the last had no room for one more event
+    assert all(size > NOTIFY_PAYLOAD_LIMIT - 600 for size in sizes[:-1])
+
+def test_notify_payloads_drop_events_too_large_for_notify():
+    events = [event(1), event(2, size=NOTIFY_PAYLOAD_LIMIT), event(3)]
+    assert decode(notify_payloads(events)) == [events[0], events[2]]
+
+def test_notify_payloads_count_bytes_not_characters():
+    # Three bytes per character in UTF-8
+    events = [Event(f"id-{number}", "audio_file.updated", {"title": "語" * 1000}) for number in range(10)]
+    payloads = notify_payloads(events)
+    assert all(len(payload.encode()) <= NOTIFY_PAYLOAD_LIMIT for payload in payloads)
+    assert decode(payloads) == events
+
+def test_notify_payloads_empty():
+    assert notify_payloads([]) == []
+
+def test_subscribers_get_the_types_they_asked_for_and_replay_after_last_event_id():
+    bus = EventBus(channel="test", replay_size=10, client_queue_size=10)
+
+    async def scenario():
+        first = new_event("job.updated", {"id": 1})
+        bus._deliver([first, new_event("audio_file.updated", {"id": 2})])
+        replayed = bus.subscribe(last_event_id=first.id)
+        jobs_only = bus.subscribe(types={"job"})
+        unknown = bus.subscribe(last_event_id="gone")
+        bus._deliver([new_event("audio_file.deleted", {"id": 2}), new_event("job.created", {"id": 3})])
+        await asyncio.sleep(0)
+        drain = lambda subscriber: [subscriber.queue.get_nowait().type for _ in range(subscriber.queue.qsize())]
+        return drain(replayed), drain(jobs_only), drain(unknown)
+
+    replayed, jobs_only, unknown = asyncio.run(scenario())
+    assert replayed == ["audio_file.updated", "audio_file.deleted", "job.created"]
+    assert jobs_only == ["job.created"]
+    assert unknown[0] == RESYNC
+
+def test_slow_subscribers_are_told_to_resync():
+    bus = EventBus(channel="test", replay_size=10, client_queue_size=2)
+
+    async def scenario():
+        subscriber = bus.subscribe()
+        bus._deliver([new_event("job.updated", {"id": number}) for number in range(5)])
+        await asyncio.sleep(0)
+        return [subscriber.queue.get_nowait().type for _ in range(subscriber.queue.qsize())]
+
+    assert asyncio.run(scenario()) == [RESYNC]
+
+def test_delivered_events_invalidate_the_caches_of_this_process():
+    st = os.stat(__file__)
+    audio_file_cache.put(1, "one.mp3", "/blobs/one", "downloaded", st)
+    audio_file_cache.put(2, "two.mp3", "/blobs/two", "downloaded", st)
+    transcript_index_cache.put(1, "en", TranscriptIndex([]))
+    # As received from another worker through LISTEN
+    event_bus._deliver([Event("1-2-3", "audio_file.updated", {"id": 1, "status": "evicted"}), Event("1-2-4", "job.updated", {"id": 2})])
+    assert audio_file_cache.get("one.mp3") is None
+    assert audio_file_cache.get("two.mp3") is not None
+    assert transcript_index_cache.get(1, "en") is not None
+
+    event_bus._deliver([Event("1-2-5", "audio_file.deleted", {"id": 1})])
+    assert transcript_index_cache.get(1, "en") is None
+
+    transcript_index_cache.put(1, "en", TranscriptIndex([]))
+    transcript_index_cache.put(1, "fr", TranscriptIndex([]))
+    event_bus._deliver([Event("1-2-6", "transcript.updated", {"audio_file_id": 1, "language": "en", "content_type": "translation"})])
+    assert transcript_index_cache.get(1, "en") is None
+    assert transcript_index_cache.get(1, "fr") is not None
+
+    transcript_index_cache.put(1, "en", TranscriptIndex([]))
+    event_bus._deliver([resync_event()])
+    assert audio_file_cache.get("two.mp3") is None
+    assert transcript_index_cache.get(1, "en") is None
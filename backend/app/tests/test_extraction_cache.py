@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+import pytest
+from src import extraction_cache
+from src.models import AudioFileDB, ExtractionCacheDB
+from src.storage import blob_path
+
+@pytest.fixture(autouse=True)
+def budget(monkeypatch):
+    monkeypatch.setattr(extraction_cache, "EXTRACTION_CACHE_ENABLED", True)
+    monkeypatch.setattr(extraction_cache, "EXTRACTION_CACHE_MAX_BYTES", 10)
+
+def cached_file(db, content_hash: str, size: int, last_used_at: datetime):
+    path = blob_path(content_hash, "mp3")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\0" * size)
+    db.add(ExtractionCacheDB(
+        cache_key=content_hash, extractor="youtube", video_id=content_hash[:11], info="{}",
+        file_path=str(path), content_hash=content_hash, size_bytes=size, last_used_at=last_used_at,
+    ))
+    db.commit()
+    return path
+
+def test_files_of_audio_files_do_not_count_towards_the_budget(db):
+    now = datetime.utcnow()
+    library = cached_file(db, "1" * 64, 100, now - timedelta(days=1))
+    db.add(AudioFileDB(filename="episode.mp3", original_url="https://example.com", file_path=str(library),
+                       file_size_bytes=100, status="downloaded"))
+    db.commit()
+    cache_only = cached_file(db, "2" * 64, 8, now - timedelta(days=2))
+
+    assert extraction_cache.cache_only_used(db) == 8
+    assert extraction_cache.enforce_budget(db) == 0
+    assert library.exists() and cache_only.exists()
+
+def test_cache_only_files_over_the_budget_are_evicted_least_recently_used_first(db):
+    now = datetime.utcnow()
+    older = cached_file(db, "3" * 64, 8, now - timedelta(days=2))
+    newer = cached_file(db, "4" * 64, 8, now - timedelta(days=1))
+
+    assert extraction_cache.enforce_budget(db) == 1
+    assert (older.exists(), newer.exists()) == (False, True)
+    assert extraction_cache.cache_only_used(db) == 8
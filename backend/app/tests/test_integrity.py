@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+from datetime import datetime
+from src.database import SessionLocal
+from src.integrity import RateLimiter, mark_corrupted, mark_verified, verify_file
+from src.locks import advisory_lock
+from src.models import AudioFileDB, ExtractionCacheDB
+from src.storage import blob_lock_name, blob_path
+
+def stored_file(content_hash: str, data: bytes = b"audio"):
+    path = blob_path(content_hash, "mp3")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+def add_audio_file(db, filename: str, path, status: str = "downloaded") -> AudioFileDB:
+    audio_file = AudioFileDB(
+        filename=filename,
+        original_url=f"https://example.com/{filename}",
+        file_path=str(path),
+        file_size_bytes=path.stat().st_size if path.exists() else None,
+        status=status,
+    )
+    db.add(audio_file)
+    db.commit()
+    return audio_file
+
+def test_a_download_linked_while_the_file_is_marked_corrupted_is_marked_too(db):
+    path = stored_file("c" * 64)
+    first = add_audio_file(db, "first.mp3", path)
+
+    def run():
+        session = SessionLocal()
+        try:
+            mark_corrupted(session, str(path))
+        finally:
+            session.close()
+
+    # A download deduplicated onto the damaged file links it while the scrubber marks it
+    with advisory_lock(blob_lock_name(path)):
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive() and path.exists()
+        second = add_audio_file(db, "second.mp3", path)
+    thread.join(5)
+
+    db.refresh(first)
+    db.refresh(second)
+    assert (first.status, second.status) == ("corrupted", "corrupted")
+    assert not path.exists()
+
+def test_a_damaged_file_only_the_cache_points_to_is_deleted(db):
+    path = stored_file("d" * 64)
+    audio_file = add_audio_file(db, "episode.mp3", path, status="downloading")
+    db.add(ExtractionCacheDB(
+        cache_key="e" * 64,
+        extractor="youtube",
+        video_id="x",
+        info="{}",
+        file_path=str(path),
+        content_hash="d" * 64,
+        size_bytes=path.stat().st_size,
+    ))
+    db.commit()
+
+    assert mark_corrupted(db, str(path)) == []
+    db.refresh(audio_file)
+    assert audio_file.status == "downloading"
+    assert db.query(ExtractionCacheDB).count() == 0
+    assert not path.exists()
+
+class Unlimited:
+    """Read budget that never waits, calling ``on_read`` before each chunk."""
+
+    def __init__(self, on_read=None):
+        self.on_read = on_read
+
+    def consume(self, amount: int) -> bool:
+        if self.on_read:
+            self.on_read()
+        return True
+
+def test_verify_file(tmp_path):
+    data = b"audio" * 100
+    path = tmp_path / "episode.mp3"
+    path.write_bytes(data)
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    assert verify_file(str(path), len(data), content_hash, Unlimited()) == "ok"
+    # Files stored before hashes were recorded get the size check only
+    assert verify_file(str(path), len(data), None, Unlimited()) == "ok"
+    assert verify_file(str(path), len(data) + 1, content_hash, Unlimited()) == "corrupted"
+    assert verify_file(str(path), len(data), "0" * 64, Unlimited()) == "corrupted"
+    assert verify_file(str(tmp_path / "gone.mp3"), len(data), content_hash, Unlimited()) == "missing"
+
+def test_verify_file_skips_a_file_replaced_while_it_was_read(tmp_path):
+    path = tmp_path / "episode.mp3"
+    path.write_bytes(b"old audio")
+    replacement = tmp_path / "replacement.mp3"
+    replacement.write_bytes(b"new audio")
+
+    def replace():
+        if replacement.exists():
+            os.replace(replacement, path)
+
+    assert verify_file(str(path), 9, hashlib.sha256(b"old audio").hexdigest(), Unlimited(replace)) is None
+
+def test_verify_file_stops_with_the_scrubber(tmp_path):
+    path = tmp_path / "episode.mp3"
+    path.write_bytes(b"audio")
+    stop = threading.Event()
+    stop.set()
+    assert verify_file(str(path), 5, hashlib.sha256(b"audio").hexdigest(), RateLimiter(0, stop)) is None
+
+class RecordingStop:
+    """Stop event that records the waits instead of sleeping."""
+
+    def __init__(self, stopped: bool = False):
+        self.stopped = stopped
+        self.waits = []
+
+    def is_set(self) -> bool:
+        return self.stopped
+
+    def wait(self, timeout: float) -> bool:
+        self.waits.append(timeout)
+        return self.stopped
+
+def test_rate_limiter_waits_once_its_second_of_reads_is_spent():
+    stop = RecordingStop()
+    limiter = RateLimiter(1000, stop)
+    assert limiter.consume(1000)
+    assert stop.waits == []
+    assert limiter.consume(500)
+    assert len(stop.waits) == 1 and 0.4 < stop.waits[0] <= 0.5
+
+    stop.stopped = True
+    assert not limiter.consume(1000)
+    assert not RateLimiter(0, stop).consume(1000)
+
+def test_mark_verified_is_not_a_change(db):
+    path = stored_file("e" * 64)
+    audio_file = add_audio_file(db, "episode.mp3", path)
+    evicted = add_audio_file(db, "evicted.mp3", path, status="evicted")
+    updated_at, change_version = audio_file.updated_at, audio_file.change_version
+
+    verified_at = datetime(2024, 1, 1)
+    mark_verified(db, str(path), verified_at)
+    db.refresh(audio_file)
+    db.refresh(evicted)
+    assert (audio_file.verified_at, audio_file.updated_at, audio_file.change_version) == (verified_at, updated_at, change_version)
+    assert evicted.verified_at is None
+
+def test_mark_corrupted_marks_the_downloaded_rows_using_the_file(db):
+    path = stored_file("f" * 64)
+    first = add_audio_file(db, "first.mp3", path)
+    second = add_audio_file(db, "second.mp3", path)
+    evicted = add_audio_file(db, "evicted.mp3", path, status="evicted")
+
+    assert sorted(mark_corrupted(db, str(path))) == sorted([first.id, second.id])
+    for audio_file in (first, second, evicted):
+        db.refresh(audio_file)
+    assert (first.status, second.status, evicted.status) == ("corrupted", "corrupted", "evicted")
+    assert not path.exists()
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+from src import jobs
+from src.database import AsyncSessionLocal, async_engine
+from src.jobs import run_download_job, submit_redownload
+from src.locks import advisory_lock
+from src.models import AudioFileDB, DownloadJobDB
+from src.services import download_lock_name, queue_due_retries
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+def add_job(db, status="queued") -> DownloadJobDB:
+    db_job = DownloadJobDB(url=URL, source_host="youtube.com", status=status)
+    db.add(db_job)
+    db.commit()
+    return db_job
+
+def test_job_of_a_video_being_downloaded_is_deferred_without_an_attempt(db, monkeypatch):
+    monkeypatch.setattr(jobs, "download_audio", lambda *args, **kwargs: 1 / 0)
+    db_job = add_job(db)
+    # Another worker is downloading the same video under another URL form
+    with advisory_lock(download_lock_name("https://youtu.be/dQw4w9WgXcQ")):
+        run_download_job(db_job.id, URL)
+    db.refresh(db_job)
+    assert (db_job.status, db_job.attempts) == ("retrying", 0)
+    assert db_job.next_attempt_at > datetime.utcnow()
+
+    # Queued again by the retry scheduler once the delay has passed
+    assert [queued.id for queued in queue_due_retries(db, db_job.next_attempt_at)] == [db_job.id]
+
+def test_a_job_claimed_elsewhere_is_not_deferred(db):
+    db_job = add_job(db, status="downloading")
+    with advisory_lock(download_lock_name(URL)):
+        run_download_job(db_job.id, URL)
+    db.refresh(db_job)
+    assert (db_job.status, db_job.next_attempt_at) == ("downloading", None)
+
+def redownload(audio_file_id: int):
+    async def run():
+        try:
+            async with AsyncSessionLocal() as session:
+                db_audio_file = await session.get(AudioFileDB, audio_file_id)
+                return await submit_redownload(session, db_audio_file)
+        finally:
+            # Pooled aiosqlite connections belong to this event loop
+            await async_engine.dispose()
+    return asyncio.run(run())
+
+def test_redownload_queues_one_job_for_the_existing_row(db, monkeypatch):
+    queued = []
+    monkeypatch.setattr(jobs.job_manager, "enqueue", lambda job_id, url, host: queued.append(job_id))
+    audio_file = AudioFileDB(filename="episode.mp3", original_url=URL, file_path="/nonexistent/episode.mp3", status="download_failed")
+    db.add(audio_file)
+    db.commit()
+
+    job = redownload(audio_file.id)
+    assert (job.status, job.audio_file_id, queued) == ("queued", audio_file.id, [job.id])
+    db.refresh(audio_file)
+    assert audio_file.status == "downloading"
+
+    # Asked again while it downloads: the same job, nothing queued twice
+    assert redownload(audio_file.id).id == job.id
+    assert queued == [job.id]
@@ -0,0 +1,67 @@
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+import pytest
+from src.database import AsyncSessionLocal, async_engine
+from src.models import AudioFileDB
+from src.services import decode_cursor, encode_cursor, list_audio_files_page
+from tests.test_routes import call
+
+def list_pages(sort: str, limit: int):
+    async def run():
+        try:
+            async with AsyncSessionLocal() as db:
+                ids, cursor = [], None
+                while True:
+                    page, cursor = await list_audio_files_page(db, limit=limit, cursor=cursor, sort=sort)
+                    ids += [audio_file.id for audio_file in page]
+                    if cursor is None:
+                        return ids
+        finally:
+            # Pooled aiosqlite connections belong to this event loop
+            await async_engine.dispose()
+    return asyncio.run(run())
+
+@pytest.fixture
+def audio_files(db):
+    """Five rows, three of them sharing both timestamps."""
+    base = datetime(2024, 1, 1)
+    offsets = [2, 0, 0, 1, 0]
+    rows = [
+        AudioFileDB(
+            filename=f"{n}.mp3", original_url=f"https://example.com/{n}", file_path=f"/x/{n}.mp3",
+            created_at=base + timedelta(minutes=offset), updated_at=base + timedelta(minutes=-offset),
+        )
+        for n, offset in enumerate(offsets)
+    ]
+    db.add_all(rows)
+    db.commit()
+    return rows
+
+@pytest.mark.parametrize("sort", ["created_at", "-created_at", "updated_at", "-updated_at", "id", "-id"])
+def test_pages_follow_the_keyset_order_through_tied_timestamps(audio_files, sort):
+    key = sort.lstrip("-")
+    expected = sorted(audio_files, key=lambda row: (getattr(row, key), row.id), reverse=sort.startswith("-"))
+    assert list_pages(sort, limit=2) == [row.id for row in expected]
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 1, 1, 12, 30)
+    assert decode_cursor(encode_cursor("-created_at", created_at, 7), "-created_at") == (created_at, 7)
+    assert decode_cursor(encode_cursor("id", 7, 7), "id") == (7, 7)
+    with pytest.raises(ValueError, match="sort order"):
+        decode_cursor(encode_cursor("created_at", created_at, 7), "-created_at")
+
+def tampered(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    tampered({"sort": "created_at"}),
+    tampered(["created_at", 5, 1]),
+    tampered(["created_at", "yesterday", 1]),
+    tampered(["created_at", "2024-01-01T00:00:00", "x"]),
+])
+def test_a_malformed_cursor_is_a_client_error(audio_files, cursor):
+    response = call("GET", f"/audio-files?cursor={cursor}")
+    assert response.status_code == 400
@@ -0,0 +1,73 @@
+import asyncio
+import httpx
+import pytest
+from src import jobs, transcriber
+from src.database import async_engine
+from src.main import app
+from src.models import AudioFileDB
+from src.waveform import waveform_path
+
+def call(method: str, path: str, headers: dict = None):
+    async def run():
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                return await client.request(method, f"/api/v1{path}", headers=headers)
+        finally:
+            # Pooled aiosqlite connections belong to this event loop
+            await async_engine.dispose()
+    return asyncio.run(run())
+
+@pytest.fixture
+def audio_file(db):
+    db_audio_file = AudioFileDB(
+        filename="episode.mp3", original_url="https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        file_path="/nonexistent/episode.mp3", status="downloaded", file_size_bytes=1000,
+    )
+    db.add(db_audio_file)
+    db.commit()
+    return db_audio_file
+
+def test_storage_routes(audio_file):
+    usage = call("GET", "/admin/storage")
+    assert usage.status_code == 200
+    assert usage.json()["downloaded_files"] == 1
+    assert call("GET", "/admin/storage/stats").status_code == 200
+    enforced = call("POST", "/admin/storage/enforce")
+    assert enforced.status_code == 200
+    assert enforced.json()["evicted"] == 0
+
+def test_transcription_routes(audio_file, monkeypatch):
+    monkeypatch.setattr(transcriber.transcription_manager, "enqueue", lambda job_id: None)
+    queued = call("POST", f"/audio-files/{audio_file.id}/transcribe?lang=ja")
+    assert queued.status_code == 202
+    job = call("GET", f"/transcription-jobs/{queued.json()['id']}")
+    assert (job.status_code, job.json()["status"]) == (200, "queued")
+    assert call("GET", "/transcription-jobs/999").status_code == 404
+    assert call("POST", "/audio-files/999/transcribe?lang=ja").status_code == 404
+
+def test_transcribing_a_file_not_downloaded_conflicts(audio_file, db):
+    audio_file.status = "evicted"
+    db.commit()
+    assert call("POST", f"/audio-files/{audio_file.id}/transcribe?lang=ja").status_code == 409
+
+def test_redownload_answers_with_the_queued_job(audio_file, monkeypatch):
+    monkeypatch.setattr(jobs.job_manager, "enqueue", lambda job_id, url, host: None)
+    response = call("POST", f"/audio-files/{audio_file.id}/re-download")
+    assert response.status_code == 202
+    assert (response.json()["status"], response.json()["audio_file_id"]) == ("queued", audio_file.id)
+    assert call("POST", "/audio-files/999/re-download").status_code == 404
+
+def test_waveform_honours_if_none_match_lists(audio_file, db):
+    audio_file.content_hash = "f" * 64
+    db.commit()
+    path = waveform_path(audio_file.content_hash)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"peaks")
+    etag = f'"{audio_file.content_hash}"'
+
+    waveform = call("GET", f"/audio-files/{audio_file.id}/waveform")
+    assert (waveform.status_code, waveform.headers["etag"], waveform.content) == (200, etag, b"peaks")
+    for if_none_match in (etag, f'"other", W/{etag}', "*"):
+        response = call("GET", f"/audio-files/{audio_file.id}/waveform", {"If-None-Match": if_none_match})
+        assert response.status_code == 304
+    assert call("GET", f"/audio-files/{audio_file.id}/waveform", {"If-None-Match": '"other"'}).status_code == 200
@@ -0,0 +1,82 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from src import search as search_module
+from src.database import to_async_url
+from src.models import AudioFileDB, Base, TranscriptionDB
+from src.search import search, title_tsquery_sql, tsquery_sql
+
+MIGRATION = Path(__file__).resolve().parents[1] / "alembic" / "versions" / "0007_full_text_search.py"
+
+def test_title_query_is_never_stemmed():
+    assert "english" not in title_tsquery_sql("podcasts") and "castlang_ts_config" not in title_tsquery_sql("podcasts")
+    assert "castlang_ts_config(:lang)" in tsquery_sql("podcasts", "en")
+    assert "castlang_ngrams" in tsquery_sql("日本語", "ja")
+
+@pytest.fixture
+def pg(postgres_url, monkeypatch):
+    """Schema with the full-text search columns of migration 0007 on the test PostgreSQL database."""
+    engine = create_engine(postgres_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    spec = importlib.util.spec_from_file_location("migration_0007", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with engine.begin() as connection, Operations.context(MigrationContext.configure(connection)):
+        migration.upgrade()
+    monkeypatch.setattr(search_module, "_fts_available", None)
+    try:
+        yield engine
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+def run_search(postgres_url, *args, **kwargs):
+    async def scenario():
+        engine = create_async_engine(to_async_url(postgres_url))
+        try:
+            async with AsyncSession(engine) as db:
+                return await search(db, *args, **kwargs)
+        finally:
+            await engine.dispose()
+    return asyncio.run(scenario())
+
+def add_audio_file(connection, title):
+    return connection.execute(
+        insert(AudioFileDB).values(filename=f"{title}.mp3", original_url="https://example.com", file_path="/x", title=title)
+        .returning(AudioFileDB.id)
+    ).scalar()
+
+def test_inflected_words_match_titles_when_searching_a_language(pg, postgres_url):
+    with pg.begin() as connection:
+        audio_file_id = add_audio_file(connection, "Best podcasts of the year")
+        connection.execute(insert(TranscriptionDB).values(
+            audio_file_id=audio_file_id, language="en", content_type="transcription", content="We love podcasting",
+        ))
+    for scope in ("titles", "all"):
+        hits = run_search(postgres_url, "podcasts", language="en", scope=scope)
+        assert [(hit.match, hit.audio_file_id) for hit in hits if hit.match == "title"] == [("title", audio_file_id)]
+    # Transcripts stay stemmed: "podcasts" finds "podcasting" through the english configuration
+    assert [hit.match for hit in run_search(postgres_url, "podcasts", language="en", scope="transcripts")] == ["transcript"]
+
+def test_best_ranked_segment_wins_among_many_matches(pg, postgres_url):
+    with pg.begin() as connection:
+        audio_file_id = add_audio_file(connection, "Episode")
+        filler = " ".join(["other words"] * 40)
+        connection.execute(insert(TranscriptionDB), [
+            {"audio_file_id": audio_file_id, "language": "en", "content_type": "transcription",
+             "content": f"common {filler} {number}", "segment_order": number}
+            for number in range(5000)
+        ])
+        best = connection.execute(insert(TranscriptionDB).values(
+            audio_file_id=audio_file_id, language="en", content_type="transcription",
+            content="common common common", segment_order=5000,
+        ).returning(TranscriptionDB.id)).scalar()
+    hits = run_search(postgres_url, "common", language="en", scope="transcripts", limit=3)
+    assert hits[0].transcription_id == best
+    assert hits[0].rank > hits[1].rank
@@ -0,0 +1,63 @@
+from datetime import datetime
+from decimal import Decimal
+import json
+import pytest
+from src.serialization import encode_rows
+
+NAMES = ["id", "title", "created_at"]
+ROWS = [
+    (1, "First", datetime(2025, 1, 2, 3, 4, 5), "extra column"),
+    (2, "Ünïcödé \"quoted\"", None, "extra column"),
+    (3, None, datetime(2025, 1, 3), "extra column"),
+]
+EXPECTED = [
+    {"id": 1, "title": "First", "created_at": "2025-01-02T03:04:05"},
+    {"id": 2, "title": "Ünïcödé \"quoted\"", "created_at": None},
+    {"id": 3, "title": None, "created_at": "2025-01-03T00:00:00"},
+]
+
+def body(stream_format, rows=ROWS, batch_size=2):
+    return b"".join(encode_rows(stream_format, NAMES, rows, batch_size=batch_size))
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_json_stream_is_the_classic_array(batch_size):
+    assert json.loads(body("json-stream", batch_size=batch_size)) == EXPECTED
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_ndjson_has_one_object_per_line(batch_size):
+    lines = body("ndjson", batch_size=batch_size).decode().splitlines()
+    assert [json.loads(line) for line in lines] == EXPECTED
+
+def test_columnar_has_one_array_per_field():
+    assert json.loads(body("columnar")) == {name: [row[name] for row in EXPECTED] for name in NAMES}
+
+@pytest.mark.parametrize("stream_format, expected", [
+    ("json-stream", []),
+    ("ndjson", None),
+    ("columnar", {"id": [], "title": [], "created_at": []}),
+])
+def test_empty_pages(stream_format, expected):
+    encoded = body(stream_format, rows=[])
+    assert (json.loads(encoded) if encoded else None) == expected
+
+def test_decimals_are_numbers():
+    assert json.loads(b"".join(encode_rows("json-stream", ["value"], [(Decimal("1.25"),)]))) == [{"value": 1.25}]
+
+def test_chunks_follow_the_batches():
+    assert len(list(encode_rows("ndjson", NAMES, ROWS, batch_size=1))) == 3
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        list(encode_rows("xml", NAMES, ROWS))
+
+@pytest.mark.parametrize("stream_format", ["json-stream", "ndjson", "columnar"])
+def test_standard_json_fallback_decodes_the_same(monkeypatch, stream_format):
+    from src import serialization
+    expected = body(stream_format)
+    monkeypatch.setattr(serialization, "orjson", None)
+    fallback = body(stream_format)
+    if stream_format == "ndjson":
+        expected, fallback = expected.splitlines(), fallback.splitlines()
+        assert [json.loads(line) for line in fallback] == [json.loads(line) for line in expected]
+    else:
+        assert json.loads(fallback) == json.loads(expected)
@@ -0,0 +1,85 @@
+import errno
+import hashlib
+import os
+import pytest
+from src import storage
+from src.storage import hash_file, move_into_place, store_file
+
+@pytest.fixture
+def downloads(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "DOWNLOADS_DIR", tmp_path / "downloads")
+    return tmp_path / "downloads"
+
+def staged(tmp_path, name: str, data: bytes):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+def test_store_file_moves_new_audio_to_its_content_address(tmp_path, downloads):
+    data = b"audio" * 1000
+    src = staged(tmp_path, "episode.mp3", data)
+    blob = store_file(src, "mp3")
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    assert blob.path == downloads / content_hash[:2] / f"{content_hash}.mp3"
+    assert (blob.content_hash, blob.size, blob.deduplicated) == (content_hash, len(data), False)
+    assert blob.path.read_bytes() == data
+    assert not src.exists()
+
+def test_store_file_deduplicates_identical_audio(tmp_path, downloads):
+    first = store_file(staged(tmp_path, "a.mp3", b"same audio"), "mp3")
+    src = staged(tmp_path, "b.mp3", b"same audio")
+    second = store_file(src, "mp3", hash_file(src))
+
+    assert (second.path, second.deduplicated) == (first.path, True)
+    assert not src.exists()
+    assert [path.name for path in downloads.rglob("*.mp3")] == [first.path.name]
+
+def test_move_into_place_copies_across_filesystems(tmp_path, monkeypatch):
+    data = os.urandom(3 * storage.STORAGE_CHUNK_SIZE + 17)
+    src = staged(tmp_path, "episode.mp3", data)
+    destination = tmp_path / "store" / "aa" / "episode.mp3"
+    replace = os.replace
+
+    def cross_device_rename(source, target):
+        # Only the final rename of the temporary copy stays on one filesystem
+        if os.fspath(source) == os.fspath(src):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        return replace(source, target)
+
+    monkeypatch.setattr(storage.os, "replace", cross_device_rename)
+    move_into_place(src, destination)
+
+    assert destination.read_bytes() == data
+    assert not src.exists()
+    # No temporary file left next to the destination
+    assert os.listdir(destination.parent) == ["episode.mp3"]
+
+def test_a_failed_copy_leaves_the_source_and_no_temporary_file(tmp_path, monkeypatch):
+    src = staged(tmp_path, "episode.mp3", b"audio")
+    destination = tmp_path / "store" / "episode.mp3"
+
+    def fail(*args, **kwargs):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    def full_disk(src, dst_file):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(storage.os, "replace", fail)
+    monkeypatch.setattr(storage, "copy_file_chunked", full_disk)
+    with pytest.raises(OSError):
+        move_into_place(src, destination)
+    assert src.exists()
+    assert os.listdir(destination.parent) == []
+
+def test_copy_falls_back_to_chunks_without_copy_file_range(tmp_path, monkeypatch):
+    data = os.urandom(2 * storage.STORAGE_CHUNK_SIZE + 5)
+    src = staged(tmp_path, "episode.mp3", data)
+
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(storage.os, "copy_file_range", unsupported, raising=False)
+    with open(tmp_path / "copy.mp3", "w+b") as dst_file:
+        storage.copy_file_chunked(src, dst_file)
+    assert (tmp_path / "copy.mp3").read_bytes() == data
@@ -0,0 +1,105 @@
+import threading
+from datetime import datetime, timedelta
+from src.database import SessionLocal
+from src.locks import advisory_lock
+from src.models import AudioFileDB
+from src.storage import blob_lock_name, blob_path
+from src.storage_quota import StorageManager, storage_manager
+
+def stored_file(content_hash: str, size: int = 4):
+    path = blob_path(content_hash, "mp3")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\0" * size)
+    return path
+
+def add_audio_file(db, filename: str, path, status: str = "downloaded") -> AudioFileDB:
+    audio_file = AudioFileDB(
+        filename=filename,
+        original_url=f"https://example.com/{filename}",
+        file_path=str(path),
+        file_size_bytes=path.stat().st_size if path.exists() else None,
+        status=status,
+    )
+    db.add(audio_file)
+    db.commit()
+    return audio_file
+
+def evict_in_thread(path) -> threading.Thread:
+    def run():
+        session = SessionLocal()
+        try:
+            storage_manager.evict_file(session, str(path))
+        finally:
+            session.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def test_eviction_waits_for_a_download_linking_the_file(db):
+    path = stored_file("a" * 64)
+    first = add_audio_file(db, "first.mp3", path)
+
+    # A download deduplicated onto the file links it while eviction starts
+    with advisory_lock(blob_lock_name(path)):
+        thread = evict_in_thread(path)
+        thread.join(0.2)
+        assert thread.is_alive() and path.exists()
+        second = add_audio_file(db, "second.mp3", path)
+    thread.join(5)
+
+    # The new row was evicted with the file instead of pointing at a deleted one
+    db.refresh(first)
+    db.refresh(second)
+    assert (first.status, second.status) == ("evicted", "evicted")
+    assert not path.exists()
+
+def test_eviction_candidates_are_grouped_by_file_least_recently_used_first(db):
+    now = datetime.utcnow()
+    old = now - timedelta(days=30)
+    shared, played, downloaded, recent, gone = (stored_file(c * 64) for c in "12345")
+    for filename, path, played_at, updated_at, status in [
+        # Two rows share a file: the more recent play counts
+        ("shared-a.mp3", shared, old, old, "downloaded"),
+        ("shared-b.mp3", shared, now - timedelta(days=1), old, "downloaded"),
+        ("played.mp3", played, now - timedelta(days=10), old, "downloaded"),
+        # Never played: its (re-)download is its last use
+        ("downloaded.mp3", downloaded, None, now - timedelta(days=5), "downloaded"),
+        # Used within min_idle
+        ("recent.mp3", recent, now - timedelta(minutes=5), old, "downloaded"),
+        ("gone.mp3", gone, None, old, "evicted"),
+    ]:
+        audio_file = add_audio_file(db, filename, path, status)
+        audio_file.last_played_at, audio_file.updated_at = played_at, updated_at
+    db.commit()
+
+    manager = StorageManager(quota_bytes=1, interval=60, min_idle=3600)
+    assert manager.eviction_candidates(db) == [(str(played), 4), (str(downloaded), 4), (str(shared), 4)]
+
+def test_enforce_leaves_eviction_to_the_worker_holding_the_lock(db):
+    old = datetime.utcnow() - timedelta(days=1)
+    paths = [stored_file(c * 64) for c in "67"]
+    for n, path in enumerate(paths):
+        audio_file = add_audio_file(db, f"{n}.mp3", path)
+        audio_file.last_played_at = old + timedelta(minutes=n)
+    db.commit()
+    manager = StorageManager(quota_bytes=6, interval=60, min_idle=0)
+
+    with advisory_lock("storage-quota"):
+        assert manager.enforce(db) == 0
+    assert all(path.exists() for path in paths)
+
+    # Least recently played first, until the files fit
+    assert manager.enforce(db) == 1
+    assert [path.exists() for path in paths] == [False, True]
+
+def test_flushed_plays_do_not_count_as_changes(db):
+    audio_file = add_audio_file(db, "episode.mp3", stored_file("8" * 64))
+    updated_at, change_version = audio_file.updated_at, audio_file.change_version
+    manager = StorageManager(quota_bytes=0, interval=60, min_idle=0)
+    manager.record_play(audio_file.id)
+
+    assert manager.flush_plays(db) == 1
+    db.refresh(audio_file)
+    assert audio_file.last_played_at is not None
+    assert (audio_file.updated_at, audio_file.change_version) == (updated_at, change_version)
+    assert manager.flush_plays(db) == 0
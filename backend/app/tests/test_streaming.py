@@ -0,0 +1,192 @@
+import asyncio
+from email.utils import formatdate
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from src.file_cache import audio_file_cache
+from src.routes import audio_file_response
+from src.streaming import (
+    AudioFileResponse,
+    RangeNotSatisfiable,
+    STREAM_MAX_RANGES,
+    conditional_audio_response,
+    etag_matches,
+    if_range_matches,
+    is_not_modified,
+    make_etag,
+    parse_range_header,
+)
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=100-", [(100, 999)]),
+    ("bytes=-100", [(900, 999)]),
+    ("bytes=-5000", [(0, 999)]),
+    ("bytes=900-5000", [(900, 999)]),
+    ("Bytes = 0-0", [(0, 0)]),
+    # Overlapping and adjacent ranges are merged, out-of-order ones sorted
+    ("bytes=500-599,0-99,100-199,550-650", [(0, 199), (500, 650)]),
+    # A range starting past the end is dropped when another one is satisfiable
+    ("bytes=0-9,2000-3000", [(0, 9)]),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "items=0-10",
+    "bytes=",
+    "bytes=10",
+    "bytes=abc-def",
+    "bytes=20-10",
+    "bytes=--5",
+    ",".join(["bytes=0-0"] + [f"{n}-{n}" for n in range(2, 2 * STREAM_MAX_RANGES + 2, 2)]),
+])
+def test_parse_range_header_serves_the_whole_file_when_malformed(header):
+    assert parse_range_header(header, 1000) is None
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0"])
+def test_parse_range_header_unsatisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, 1000)
+
+def serve(response: AudioFileResponse, extensions: dict = None, method: str = "GET"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "extensions": extensions or {}}
+    asyncio.run(response(scope, receive, send))
+    start = messages[0]
+    headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    return start["status"], headers, messages[1:]
+
+@pytest.fixture
+def audio_path(tmp_path):
+    path = tmp_path / "audio.mp3"
+    path.write_bytes(bytes(range(256)) * 4)
+    return path
+
+def test_full_response_sends_the_file_through_mmap(audio_path):
+    status, headers, messages = serve(AudioFileResponse(open(audio_path, "rb"), 1024))
+    assert status == 200
+    assert headers["content-length"] == "1024"
+    assert headers["accept-ranges"] == "bytes"
+    assert b"".join(message["body"] for message in messages) == audio_path.read_bytes()
+    assert messages[-1]["more_body"] is False
+
+def test_single_range_response(audio_path):
+    status, headers, messages = serve(AudioFileResponse(open(audio_path, "rb"), 1024, ranges=[(10, 19)], chunk_size=4))
+    assert status == 206
+    assert headers["content-range"] == "bytes 10-19/1024"
+    assert headers["content-length"] == "10"
+    assert b"".join(message["body"] for message in messages) == audio_path.read_bytes()[10:20]
+
+def test_multipart_response_matches_its_content_length(audio_path):
+    status, headers, messages = serve(AudioFileResponse(open(audio_path, "rb"), 1024, ranges=[(0, 3), (1000, 1023)]))
+    body = b"".join(message["body"] for message in messages)
+    assert status == 206
+    boundary = headers["content-type"].split("boundary=")[1]
+    assert int(headers["content-length"]) == len(body)
+    assert body.startswith(f"--{boundary}\r\n".encode())
+    assert body.endswith(f"--{boundary}--\r\n".encode())
+    assert b"Content-Range: bytes 1000-1023/1024\r\n\r\n" + audio_path.read_bytes()[1000:] + b"\r\n" in body
+
+def test_zerocopy_response_hands_the_ranges_to_the_server(audio_path):
+    status, _, messages = serve(
+        AudioFileResponse(open(audio_path, "rb"), 1024, ranges=[(0, 3), (100, 199)]),
+        extensions={"http.response.zerocopysend": {}},
+    )
+    assert status == 206
+    sendfiles = [(message["offset"], message["count"]) for message in messages if message["type"] == "http.response.zerocopysend"]
+    assert sendfiles == [(0, 4), (100, 100)]
+
+def test_head_response_has_headers_but_no_body(audio_path):
+    status, headers, messages = serve(AudioFileResponse(open(audio_path, "rb"), 1024), method="HEAD")
+    assert (status, headers["content-length"]) == (200, "1024")
+    assert [message["body"] for message in messages] == [b""]
+
+@pytest.fixture
+def st(audio_path):
+    return audio_path.stat()
+
+def request(**headers) -> Headers:
+    return Headers({key.replace("_", "-"): value for key, value in headers.items()})
+
+def test_etag_changes_with_the_file(audio_path, st):
+    audio_path.write_bytes(b"other content")
+    assert make_etag(audio_path.stat()) != make_etag(st)
+
+def test_is_not_modified_if_none_match(st):
+    etag = make_etag(st)
+    assert is_not_modified(request(if_none_match=etag), st)
+    assert is_not_modified(request(if_none_match=f'"other", W/{etag}'), st)
+    assert is_not_modified(request(if_none_match="*"), st)
+    assert not is_not_modified(request(if_none_match='"other"'), st)
+
+def test_etag_matches_uses_the_weak_comparison():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches(' "b" ,W/"a"', '"a"')
+    assert etag_matches('"a"', 'W/"a"')
+    assert etag_matches(" * ", '"a"')
+    assert not etag_matches('"b", "c"', '"a"')
+
+def test_is_not_modified_if_modified_since(st):
+    assert is_not_modified(request(if_modified_since=formatdate(st.st_mtime + 60, usegmt=True)), st)
+    assert not is_not_modified(request(if_modified_since=formatdate(st.st_mtime - 60, usegmt=True)), st)
+    assert not is_not_modified(request(if_modified_since="not a date"), st)
+    assert not is_not_modified(request(), st)
+
+def test_if_none_match_takes_precedence_over_if_modified_since(st):
+    headers = request(if_none_match='"other"', if_modified_since=formatdate(st.st_mtime + 60, usegmt=True))
+    assert not is_not_modified(headers, st)
+
+def test_if_range_matches(st):
+    assert if_range_matches(request(), st)
+    assert if_range_matches(request(if_range=make_etag(st)), st)
+    # Weak tags never match If-Range
+    assert not if_range_matches(request(if_range=f"W/{make_etag(st)}"), st)
+    assert not if_range_matches(request(if_range='"other"'), st)
+    assert if_range_matches(request(if_range=formatdate(int(st.st_mtime), usegmt=True)), st)
+    assert not if_range_matches(request(if_range=formatdate(st.st_mtime - 60, usegmt=True)), st)
+
+def test_conditional_response_honours_the_validators(audio_path, st):
+    response = conditional_audio_response(request(if_none_match=make_etag(st)), str(audio_path))
+    assert response.status_code == 304
+    assert response.headers["etag"] == make_etag(st)
+
+    response = conditional_audio_response(request(range="bytes=0-9", if_range='"stale"'), str(audio_path))
+    assert response.status_code == 200
+
+    response = conditional_audio_response(request(range="bytes=0-9", if_range=make_etag(st)), str(audio_path))
+    assert response.status_code == 206
+
+def test_conditional_response_serves_a_file_unlinked_after_it_was_opened(audio_path):
+    content = audio_path.read_bytes()
+    response = conditional_audio_response(request(), str(audio_path))
+    # Evicted between resolving and sending: the open file still has every byte
+    audio_path.unlink()
+    status, headers, messages = serve(response)
+    assert (status, headers["content-length"]) == (200, str(len(content)))
+    assert b"".join(message["body"] for message in messages) == content
+    assert response.file.closed
+
+def test_conditional_response_raises_before_sending_when_the_file_is_gone(audio_path):
+    audio_path.unlink()
+    with pytest.raises(FileNotFoundError):
+        conditional_audio_response(request(), str(audio_path))
+
+def test_missing_file_is_a_retryable_error_that_drops_the_cached_entry(audio_path, st):
+    resolved = audio_file_cache.put(7, "audio.mp3", str(audio_path), "downloaded", st)
+    audio_path.unlink()
+    with pytest.raises(HTTPException) as error:
+        audio_file_response(Request({"type": "http", "headers": []}), resolved)
+    assert error.value.status_code == 503
+    assert "Retry-After" in error.value.headers
+    assert audio_file_cache.get("audio.mp3") is None
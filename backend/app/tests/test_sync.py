@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import pytest
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from src.database import AsyncSessionLocal, async_engine, to_async_url
+from src.models import AudioFileDB, Base
+from src.sync import current_watermark, decode_sync_token, encode_sync_token, get_changes, record_deletion
+
+def run(scenario):
+    async def wrapped():
+        try:
+            async with AsyncSessionLocal() as db:
+                return await scenario(db)
+        finally:
+            # Pooled aiosqlite connections belong to this event loop
+            await async_engine.dispose()
+    return asyncio.run(wrapped())
+
+def sync(since=None, limit=100):
+    return run(lambda db: get_changes(db, since, limit))
+
+_names = itertools.count()
+
+def add_audio_files(db, count: int):
+    audio_files = []
+    for _ in range(count):
+        n = next(_names)
+        audio_file = AudioFileDB(filename=f"{n}.mp3", original_url=f"https://example.com/{n}", file_path=f"/x/{n}.mp3")
+        db.add(audio_file)
+        # One change version per write
+        db.commit()
+        audio_files.append(audio_file)
+    return audio_files
+
+def delete_audio_file(db, audio_file: AudioFileDB) -> int:
+    audio_file_id = audio_file.id
+    db.expunge(audio_file)
+
+    async def scenario(db):
+        await db.execute(delete(AudioFileDB).where(AudioFileDB.id == audio_file_id))
+        await record_deletion(db, audio_file_id)
+        await db.commit()
+    run(scenario)
+    return audio_file_id
+
+def test_token_round_trip():
+    assert decode_sync_token(encode_sync_token(7, 3, 9)) == (7, 3, 9)
+    assert decode_sync_token(encode_sync_token(9, -1)) == (9, -1, None)
+    for token in ("not base64!", encode_sync_token(1, 2)[:-2], "W10"):
+        with pytest.raises(ValueError):
+            decode_sync_token(token)
+
+def test_pages_cover_every_change_once_and_end_at_the_watermark(db):
+    audio_files = add_audio_files(db, 5)
+    watermark = max(audio_file.change_version for audio_file in audio_files) + 1
+
+    seen, token, pages = [], None, 0
+    while True:
+        page = sync(token, limit=2)
+        seen += [change.id for change in page.changes]
+        token, pages = page.token, pages + 1
+        if not page.has_more:
+            break
+        # Continuation tokens carry the watermark taken by the first page
+        assert decode_sync_token(token)[2] == watermark
+    assert seen == [audio_file.id for audio_file in audio_files]
+    assert pages == 3
+    assert decode_sync_token(token) == (watermark, -1, None)
+    # Nothing changed since
+    assert sync(token).changes == []
+
+def test_a_page_of_exactly_limit_changes_ends_the_pass(db):
+    add_audio_files(db, 2)
+    page = sync(limit=2)
+    assert (len(page.changes), page.has_more) == (2, False)
+    assert decode_sync_token(page.token)[1:] == (-1, None)
+
+    add_audio_files(db, 1)
+    page = sync(limit=2)
+    assert (len(page.changes), page.has_more) == (2, True)
+    assert len(sync(page.token, limit=2).changes) == 1
+
+def test_deletions_are_reported_as_tombstones_in_version_order(db):
+    first, second, third = add_audio_files(db, 3)
+    token = sync().token
+
+    first_id = delete_audio_file(db, first)
+    third.title = "Renamed"
+    db.commit()
+    second_id = delete_audio_file(db, second)
+
+    page = sync(token, limit=2)
+    # Tombstones and rows share one (change_version, id) order
+    assert ([change.id for change in page.changes], page.deleted, page.has_more) == ([third.id], [first_id], True)
+    page = sync(page.token, limit=2)
+    assert (page.changes, page.deleted, page.has_more) == ([], [second_id], False)
+
+def test_a_reused_id_hides_its_tombstone(db):
+    (audio_file,) = add_audio_files(db, 1)
+    token = sync().token
+    audio_file_id = delete_audio_file(db, audio_file)
+    db.add(AudioFileDB(id=audio_file_id, filename="new.mp3", original_url="https://example.com/new", file_path="/x/new.mp3"))
+    db.commit()
+
+    page = sync(token)
+    assert ([change.filename for change in page.changes], page.deleted) == (["new.mp3"], [])
+
+@pytest.fixture
+def pg(postgres_url):
+    engine = create_engine(postgres_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    try:
+        yield engine
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+def pg_sync(postgres_url, since=None, limit=100):
+    async def scenario():
+        engine = create_async_engine(to_async_url(postgres_url))
+        try:
+            async with AsyncSession(engine) as db:
+                return await current_watermark(db), await get_changes(db, since, limit)
+        finally:
+            await engine.dispose()
+    return asyncio.run(scenario())
+
+def test_a_write_still_running_on_postgresql_is_returned_by_the_next_pass(pg, postgres_url):
+    values = {"filename": "a.mp3", "original_url": "https://example.com/a", "file_path": "/x/a.mp3"}
+    with pg.begin() as connection:
+        connection.execute(insert(AudioFileDB).values(**values))
+    with pg.connect() as running:
+        # Stamped with its transaction id, which stays at or above the watermark until it commits
+        running.execute(insert(AudioFileDB).values(**{**values, "filename": "b.mp3"}))
+        watermark, page = pg_sync(postgres_url)
+        assert [change.filename for change in page.changes] == ["a.mp3"]
+        assert decode_sync_token(page.token) == (watermark, -1, None)
+        running.commit()
+
+    _, page = pg_sync(postgres_url, page.token)
+    assert [change.filename for change in page.changes] == ["b.mp3"]
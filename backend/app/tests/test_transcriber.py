@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import numpy as np
+import pytest
+from sqlalchemy.exc import IntegrityError
+from src import transcriber
+from src.database import SessionLocal
+from src.models import AudioFileDB, TranscriptionChunkDB, TranscriptionDB, TranscriptionJobDB
+from src.transcriber import Chunk, StubEngine, merge_segments, plan_chunks, run_transcription_job, SAMPLE_RATE
+
+def test_plan_chunks_covers_the_file_with_overlapping_windows():
+    chunks = plan_chunks(70, 30, 5)
+    assert [(chunk.index, chunk.start, chunk.end) for chunk in chunks] == [(0, 0, 30), (1, 25, 55), (2, 50, 70)]
+
+def test_plan_chunks_short_file_is_one_window():
+    assert plan_chunks(12.5, 30, 5) == [Chunk(0, 0.0, 12.5)]
+
+def test_plan_chunks_rejects_overlap_not_shorter_than_window():
+    with pytest.raises(ValueError):
+        plan_chunks(60, 10, 10)
+
+def test_merge_segments_keeps_each_segment_from_the_window_holding_its_midpoint():
+    chunks = plan_chunks(55, 30, 10)  # windows 0-30 and 20-50, then 40-55; overlaps split at 25 and 45
+    results = {
+        0: [[0, 5, "a", None], [22, 26, "edge of 0", None], [26, 30, "late in 0", None]],
+        1: [[22, 26, "early in 1", None], [26, 30, "b", None], [43, 48, "edge of 1", None]],
+        2: [[43, 48, "c", None], [50, 55, "d", None]],
+    }
+    merged = merge_segments(chunks, results, 10)
+    assert [segment[2] for segment in merged] == ["a", "edge of 0", "b", "c", "d"]
+
+def test_merge_segments_ignores_missing_windows():
+    chunks = plan_chunks(50, 30, 10)
+    assert merge_segments(chunks, {1: [[40, 45, "x", None]]}, 10) == [[40, 45, "x", None]]
+
+def tone(seconds: float, silent_from: float = None) -> np.ndarray:
+    samples = (0.1 * np.sin(np.arange(int(seconds * SAMPLE_RATE)) / 10)).astype("<f4")
+    if silent_from is not None:
+        samples[int(silent_from * SAMPLE_RATE):] = 0
+    return samples
+
+def test_stub_engine_is_independent_of_the_windowing():
+    samples = tone(20, silent_from=15)
+    engine = StubEngine()
+    whole = [(s.start, s.end, s.text) for s in engine.transcribe(samples, "ja", 0.0)]
+    # Same audio seen through a window starting at 7 s
+    window = engine.transcribe(samples[7 * SAMPLE_RATE:], "ja", 7.0)
+    assert len(whole) == 3  # slots 0-5, 5-10 and 10-15; 15-20 is silent
+    assert [s.text for s in window] == [text for _, _, text in whole][1:]
+    assert [(s.start + 7.0, s.end + 7.0) for s in window] == [(7.0, 10.0), (10.0, 15.0)]
+
+class FakeAudio:
+    """Stands in for FFmpeg: decodes windows of a synthetic file and counts them."""
+
+    def __init__(self, samples: np.ndarray):
+        self.samples = samples
+        self.decoded = []
+
+    def decode_window(self, source, start, duration):
+        self.decoded.append(start)
+        begin = int(round(start * SAMPLE_RATE))
+        end = len(self.samples) if duration is None else begin + int(round(duration * SAMPLE_RATE))
+        return self.samples[begin:end]
+
+    def probe_duration(self, source):
+        return len(self.samples) / SAMPLE_RATE
+
+@pytest.fixture
+def audio(monkeypatch):
+    fake = FakeAudio(tone(62, silent_from=50))
+    monkeypatch.setattr(transcriber, "decode_window", fake.decode_window)
+    monkeypatch.setattr(transcriber, "probe_duration", fake.probe_duration)
+    monkeypatch.setattr(transcriber, "TRANSCRIBE_ENGINE", "stub")
+    return fake
+
+def add_job(db) -> TranscriptionJobDB:
+    audio_file = AudioFileDB(
+        filename="episode.mp3", original_url="https://example.com/v", file_path="/nonexistent/episode.mp3",
+        content_hash="ab" * 32, status="downloaded",
+    )
+    db.add(audio_file)
+    db.commit()
+    db_job = TranscriptionJobDB(
+        audio_file_id=audio_file.id, language="ja", status="queued", progress=0.0, engine="stub",
+        content_hash=audio_file.content_hash, chunk_seconds=30, overlap_seconds=5, chunks_done=0,
+    )
+    db.add(db_job)
+    db.commit()
+    return db_job
+
+def transcript(db, audio_file_id):
+    return [
+        (float(row.start_time_seconds), float(row.end_time_seconds), row.content)
+        for row in db.query(TranscriptionDB).filter(TranscriptionDB.audio_file_id == audio_file_id).order_by(TranscriptionDB.segment_order)
+    ]
+
+def test_transcription_job_writes_the_merged_transcript(db, audio):
+    db_job = add_job(db)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        run_transcription_job(db_job.id, pool)
+    db.expire_all()
+    assert db_job.status == "completed", db_job.error
+    assert sorted(audio.decoded) == [0, 25, 50]
+    segments = transcript(db, db_job.audio_file_id)
+    # 5 s slots up to the silence at 50 s, each once despite the overlaps
+    assert [(start, end) for start, end, _ in segments] == [(n * 5.0, n * 5.0 + 5) for n in range(10)]
+    assert db_job.segments == 10
+    assert db.query(TranscriptionChunkDB).count() == 0
+
+def test_resumed_transcription_job_only_runs_missing_windows(db, audio):
+    db_job = add_job(db)
+    # Window 1 finished before the job was interrupted; its saved segments are reused as is
+    saved = [[27.0, 29.0, "saved before the crash", 0.9]]
+    db.add(TranscriptionChunkDB(job_id=db_job.id, chunk_index=1, start_seconds=25, end_seconds=55, segments=json.dumps(saved)))
+    db.commit()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        run_transcription_job(db_job.id, pool)
+    db.expire_all()
+    assert db_job.status == "completed", db_job.error
+    assert sorted(audio.decoded) == [0, 50]
+    texts = [text for _, _, text in transcript(db, db_job.audio_file_id)]
+    assert "saved before the crash" in texts
+    assert db_job.chunks_total == 3 and db_job.chunks_done == 3
+
+def test_finished_windows_are_discarded_when_the_audio_changed(db, audio):
+    db_job = add_job(db)
+    db.add(TranscriptionChunkDB(job_id=db_job.id, chunk_index=1, start_seconds=25, end_seconds=55, segments="[]"))
+    db_job.content_hash = "cd" * 32
+    db.commit()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        run_transcription_job(db_job.id, pool)
+    db.expire_all()
+    assert db_job.status == "completed", db_job.error
+    assert sorted(audio.decoded) == [0, 25, 50]
+
+def test_transcription_job_keeps_an_uploaded_translation(db, audio):
+    db_job = add_job(db)
+    db.add_all([
+        TranscriptionDB(audio_file_id=db_job.audio_file_id, language="ja", content_type="translation", content="uploaded", segment_order=0),
+        TranscriptionDB(audio_file_id=db_job.audio_file_id, language="ja", content_type="transcription", content="outdated", segment_order=0),
+    ])
+    db.commit()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        run_transcription_job(db_job.id, pool)
+    rows = db.query(TranscriptionDB.content_type, TranscriptionDB.content).filter(TranscriptionDB.audio_file_id == db_job.audio_file_id).all()
+    assert ("translation", "uploaded") in rows
+    assert ("transcription", "outdated") not in rows
+
+def test_a_file_has_one_active_transcription_job_per_language(db, monkeypatch):
+    queued = []
+    monkeypatch.setattr(transcriber.transcription_manager, "enqueue", queued.append)
+    db_job = add_job(db)
+    assert transcriber.queue_transcription(db, db_job.audio_file_id, "ja").id == db_job.id
+
+    # A duplicate inserted by a concurrent request is rejected by the database
+    db.add(TranscriptionJobDB(
+        audio_file_id=db_job.audio_file_id, language="ja", status="queued", engine="stub",
+        chunk_seconds=30, overlap_seconds=5,
+    ))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+    # Another language, or a failed job next to the active one, is allowed
+    other = transcriber.queue_transcription(db, db_job.audio_file_id, "en")
+    assert other.id != db_job.id and queued == [other.id]
+    db.add(TranscriptionJobDB(
+        audio_file_id=db_job.audio_file_id, language="ja", status="failed", engine="stub",
+        chunk_seconds=30, overlap_seconds=5,
+    ))
+    db.commit()
+
+def test_queueing_a_job_another_request_just_queued_returns_it(db, monkeypatch):
+    queued = []
+    monkeypatch.setattr(transcriber.transcription_manager, "enqueue", queued.append)
+    db_job = add_job(db)
+    db_job.status = "failed"
+    db.commit()
+    # Queued by another worker between the lookup and the insert
+    original_update = transcriber.update_transcription_job
+
+    def racing_update(session, job_id, **fields):
+        with SessionLocal() as other:
+            other.add(TranscriptionJobDB(
+                audio_file_id=db_job.audio_file_id, language="ja", status="queued", engine="stub",
+                chunk_seconds=30, overlap_seconds=5,
+            ))
+            other.commit()
+        return original_update(session, job_id, **fields)
+
+    monkeypatch.setattr(transcriber, "update_transcription_job", racing_update)
+    job = transcriber.queue_transcription(db, db_job.audio_file_id, "ja")
+    assert job.id != db_job.id and job.status == "queued"
+    assert queued == []
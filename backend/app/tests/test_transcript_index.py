@@ -0,0 +1,69 @@
+from decimal import Decimal
+import random
+from src.models import Transcription
+from src.transcript_index import TranscriptIndex, TranscriptIndexCache
+
+def segment(order, start, end, content_type="transcription"):
+    return Transcription(
+        id=order, audio_file_id=1, language="ja", content_type=content_type, content=f"segment {order}",
+        start_time_seconds=start, end_time_seconds=end, segment_order=order,
+    )
+
+def orders(segments):
+    return [segment.segment_order for segment in segments]
+
+def test_window_returns_overlapping_segments_in_start_order():
+    index = TranscriptIndex([segment(2, 10, 20), segment(0, 0, 5), segment(1, 5, 10), segment(3, 20, 30)])
+    assert orders(index.window(6, 12)) == [1, 2]
+    # Touching the window boundaries counts as overlapping
+    assert orders(index.window(10, 10)) == [1, 2]
+    assert orders(index.window(31, 40)) == []
+    assert orders(index.window(0, 100)) == [0, 1, 2, 3]
+
+def test_window_finds_long_segments_that_start_early():
+    # Segment 0 spans the whole window although later segments end before it
+    index = TranscriptIndex([segment(0, 0, 100), segment(1, 1, 2), segment(2, 3, 4), segment(3, 50, 51)])
+    assert orders(index.window(10, 20)) == [0]
+
+def test_segments_without_timing_cover_the_whole_file():
+    index = TranscriptIndex([segment(0, None, None), segment(1, Decimal("5.5"), Decimal("6.5"))])
+    assert orders(index.window(1000, 1001)) == [0]
+    assert orders(index.window(6, 7)) == [0, 1]
+
+def test_window_filters_by_content_type():
+    index = TranscriptIndex([segment(0, 0, 5), segment(1, 0, 5, "translation")])
+    assert orders(index.window(0, 5, "translation")) == [1]
+
+def test_window_matches_a_linear_scan():
+    rng = random.Random(7)
+    segments = []
+    for order in range(300):
+        start = rng.uniform(0, 600)
+        segments.append(segment(order, start, start + rng.uniform(0, 60)))
+    index = TranscriptIndex(segments)
+    for _ in range(200):
+        start = rng.uniform(-10, 700)
+        end = start + rng.uniform(0, 30)
+        expected = sorted(
+            (s for s in segments if s.start_time_seconds <= end and s.end_time_seconds >= start),
+            key=lambda s: (s.start_time_seconds, s.segment_order),
+        )
+        assert orders(index.window(start, end)) == orders(expected)
+
+def test_cache_invalidates_one_language_or_a_whole_file():
+    cache = TranscriptIndexCache(max_size=10)
+    for key in [(1, "ja"), (1, "en"), (2, "ja")]:
+        cache.put(*key, TranscriptIndex([]))
+    cache.invalidate(1, "ja")
+    assert cache.get(1, "ja") is None and cache.get(1, "en") is not None
+    cache.invalidate(1)
+    assert cache.get(1, "en") is None and cache.get(2, "ja") is not None
+
+def test_cache_evicts_the_least_recently_used():
+    cache = TranscriptIndexCache(max_size=2)
+    cache.put(1, "ja", TranscriptIndex([]))
+    cache.put(2, "ja", TranscriptIndex([]))
+    cache.get(1, "ja")
+    cache.put(3, "ja", TranscriptIndex([]))
+    assert cache.get(2, "ja") is None
+    assert cache.get(1, "ja") is not None and cache.get(3, "ja") is not None
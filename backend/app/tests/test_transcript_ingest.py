@@ -0,0 +1,44 @@
+import asyncio
+import json
+from src.database import AsyncSessionLocal, async_engine
+from src.models import AudioFileDB, TranscriptionDB
+from src.transcript_index import TranscriptIndex, transcript_index_cache
+from src.transcript_ingest import ingest_transcript
+
+async def body(*segments):
+    yield "".join(json.dumps(segment) + "\n" for segment in segments).encode()
+
+def ingest(audio_file_id: int, content_type: str, *segments):
+    async def run():
+        try:
+            async with AsyncSessionLocal() as db:
+                return await ingest_transcript(db, audio_file_id, "en", content_type, "jsonl", body(*segments))
+        finally:
+            # Pooled aiosqlite connections belong to this event loop
+            await async_engine.dispose()
+    return asyncio.run(run())
+
+def contents(db, audio_file_id: int):
+    rows = db.query(TranscriptionDB).filter(TranscriptionDB.audio_file_id == audio_file_id).order_by(TranscriptionDB.content_type, TranscriptionDB.segment_order)
+    return [(row.content_type, row.content) for row in rows]
+
+def test_uploading_one_content_type_keeps_the_other(db):
+    audio_file = AudioFileDB(filename="episode.mp3", original_url="https://example.com/v", file_path="/nonexistent/episode.mp3", status="downloaded")
+    db.add(audio_file)
+    db.commit()
+    ingest(audio_file.id, "transcription", {"text": "hello", "start": 0, "end": 1})
+    ingest(audio_file.id, "translation", {"text": "bonjour", "start": 0, "end": 1})
+    assert contents(db, audio_file.id) == [("transcription", "hello"), ("translation", "bonjour")]
+
+    # Replaced per content type
+    result = ingest(audio_file.id, "translation", {"text": "salut", "start": 0, "end": 1}, {"text": "monde", "start": 1, "end": 2})
+    assert result.rows == 2
+    assert contents(db, audio_file.id) == [("transcription", "hello"), ("translation", "salut"), ("translation", "monde")]
+
+def test_ingesting_drops_the_cached_index(db):
+    audio_file = AudioFileDB(filename="episode.mp3", original_url="https://example.com/v", file_path="/nonexistent/episode.mp3", status="downloaded")
+    db.add(audio_file)
+    db.commit()
+    transcript_index_cache.put(audio_file.id, "en", TranscriptIndex([]))
+    ingest(audio_file.id, "transcription", {"text": "hello", "start": 0, "end": 1})
+    assert transcript_index_cache.get(audio_file.id, "en") is None